@@ -0,0 +1,229 @@
+from functools import partial
+from math import ceil
+import re
+
+PERCENTILE_PATTERN = re.compile(r'p(?P<rank>\d{1,2})$')
+# Сколько значений хранит один уровень скетча квантилей.
+SKETCH_CAPACITY = 256
+
+
+class SumState:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def add(self, value):
+        self.value += value
+
+    def merge(self, other):
+        self.value += other.value
+
+    def result(self):
+        return self.value
+
+
+class AvgState:
+    __slots__ = ('total', 'count')
+
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, value):
+        self.total += value
+        self.count += 1
+
+    def merge(self, other):
+        self.total += other.total
+        self.count += other.count
+
+    def result(self):
+        return round(self.total / self.count, 2)
+
+
+class CountState:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def add(self, value):
+        self.value += 1
+
+    def merge(self, other):
+        self.value += other.value
+
+    def result(self):
+        return self.value
+
+
+class MinState:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = None
+
+    def add(self, value):
+        if self.value is None or value < self.value:
+            self.value = value
+
+    def merge(self, other):
+        if other.value is not None:
+            self.add(other.value)
+
+    def result(self):
+        return self.value
+
+
+class MaxState(MinState):
+    __slots__ = ()
+
+    def add(self, value):
+        if self.value is None or value > self.value:
+            self.value = value
+
+
+# Скетч для приближенных квантилей с ограниченной памятью (в духе KLL).
+# Уровень h хранит значения с весом 2**h. Переполненный уровень сортируется,
+# и каждое второе значение переходит на следующий уровень. Пока значений
+# меньше capacity, ответ точный. Выбор половины детерминирован, поэтому
+# результат не зависит от запуска.
+class QuantileSketch:
+    __slots__ = ('capacity', 'levels', 'count', 'offset')
+
+    def __init__(self, capacity=SKETCH_CAPACITY):
+        self.capacity = capacity
+        self.levels = [[]]
+        self.count = 0
+        self.offset = 0
+
+    def add(self, value):
+        self.levels[0].append(value)
+        self.count += 1
+        if len(self.levels[0]) >= self.capacity:
+            self.compress(0)
+
+    def compress(self, level):
+        items = sorted(self.levels[level])
+        # При нечетном числе одно значение остается на своем уровне.
+        self.levels[level] = [items.pop()] if len(items) % 2 else []
+        if level + 1 == len(self.levels):
+            self.levels.append([])
+        self.levels[level + 1].extend(items[self.offset::2])
+        self.offset ^= 1
+        if len(self.levels[level + 1]) >= self.capacity:
+            self.compress(level + 1)
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.count += other.count
+        for level in range(len(self.levels)):
+            if len(self.levels[level]) >= self.capacity:
+                self.compress(level)
+
+    # Значение ранга ceil(q * n) (метод ближайшего ранга).
+    def quantile(self, q):
+        if not self.count:
+            return None
+        weighted = sorted((value, 1 << level)
+                          for level, items in enumerate(self.levels)
+                          for value in items)
+        total = sum(weight for _, weight in weighted)
+        rank = max(1, ceil(q * total))
+        passed = 0
+        for value, weight in weighted:
+            passed += weight
+            if passed >= rank:
+                return value
+        return weighted[-1][0]
+
+
+class QuantileState:
+    __slots__ = ('q', 'sketch')
+
+    def __init__(self, q):
+        self.q = q
+        self.sketch = QuantileSketch()
+
+    def add(self, value):
+        self.sketch.add(value)
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+
+    def result(self):
+        return self.sketch.quantile(self.q)
+
+
+AGGR_STATES = {
+    'sum': SumState,
+    'avg': AvgState,
+    'count': CountState,
+    'min': MinState,
+    'max': MaxState,
+    'median': partial(QuantileState, 0.5)
+}
+
+
+def is_aggr_func(name):
+    return name in AGGR_STATES or PERCENTILE_PATTERN.match(name) is not None
+
+
+def state_factory(name):
+    if name in AGGR_STATES:
+        return AGGR_STATES[name]
+    q = int(PERCENTILE_PATTERN.match(name).group('rank')) / 100
+    return partial(QuantileState, q)
+
+
+# Тип результата агрегирующей функции по типу колонки.
+def result_type(name, column_type):
+    if name == 'count':
+        return 'int'
+    if name == 'avg' or (name == 'sum' and column_type != 'int'):
+        return 'float'
+    return column_type
+
+
+# Однопроходная группировка: на каждый ключ хранится только состояние
+# агрегатов, а не все значения группы.
+class GroupAggregator:
+    def __init__(self, aggr_funcs):
+        self.aggr_funcs = tuple(aggr_funcs)
+        self.factories = [state_factory(name) for name in self.aggr_funcs]
+        self.groups = {}
+
+    def add(self, key, values):
+        states = self.groups.get(key)
+        if states is None:
+            states = self.groups[key] = [factory()
+                                         for factory in self.factories]
+        for state, value in zip(states, values):
+            state.add(value)
+
+    # Строки -- кортежи (поля группировки..., агрегируемые значения...).
+    def consume(self, rows, key_length):
+        for line in rows:
+            self.add(tuple(line[:key_length]), line[key_length:])
+        return self
+
+    def merge(self, other):
+        for key, other_states in other.groups.items():
+            states = self.groups.get(key)
+            if states is None:
+                self.groups[key] = other_states
+                continue
+            for state, other_state in zip(states, other_states):
+                state.merge(other_state)
+        return self
+
+    def results(self):
+        for key, states in self.groups.items():
+            yield key, tuple(state.result() for state in states)
+
+    def __len__(self):
+        return len(self.groups)
@@ -0,0 +1,313 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+from table_report_generator import TableReportGenerator
+from report_generator import ReportGenerator
+import instrumentation
+import morphology
+import numpy_engine
+
+# Наборы параметров по умолчанию. rows и holes умножаются на --scale.
+# groups -- число различных значений ключа группировки (0 -- без группы),
+# selectivity -- доля строк, проходящих фильтр (1.0 -- без фильтра),
+# multiline -- доля ячеек с переводом строки, units -- доля дыр с
+# единицей измерения (склонение через pymorphy2).
+TABLE_CASES = [
+    dict(name='table_plain', rows=20000, columns=6, multiline=0.0,
+         groups=0, selectivity=1.0),
+    dict(name='table_multiline', rows=20000, columns=6, multiline=0.2,
+         groups=0, selectivity=1.0),
+    dict(name='table_selective', rows=20000, columns=6, multiline=0.0,
+         groups=0, selectivity=0.05),
+    dict(name='table_wide', rows=5000, columns=24, multiline=0.0,
+         groups=0, selectivity=0.5),
+    dict(name='table_group_low', rows=20000, columns=6, multiline=0.0,
+         groups=10, selectivity=1.0),
+    dict(name='table_group_high', rows=20000, columns=6, multiline=0.0,
+         groups=5000, selectivity=0.5),
+]
+TEXT_CASES = [
+    dict(name='text_plain', holes=5000, multiline=0.0, units=0.0),
+    dict(name='text_multiline', holes=5000, multiline=0.3, units=0.0),
+    dict(name='text_units', holes=5000, multiline=0.0, units=0.5),
+]
+
+# Этапы, которые замеряет сам TableReportGenerator (instrumentation).
+TABLE_STAGES = ('pattern', 'read', 'type', 'group', 'filter', 'order',
+                'format', 'write')
+# Этапы ReportGenerator.
+TEXT_STAGES = ('pattern', 'read', 'render', 'write')
+
+GROUP_FIELD = 'ГРУППА'
+FILTER_FIELD = 'ОТБОР'
+WORDS = ('альфа', 'бета', 'гамма', 'дельта', 'эпсилон', 'дзета')
+UNITS = ('рубль', 'штука', 'день')
+
+
+# Колонки синтетической таблицы: ключ группы, поле для фильтра и
+# чередующиеся числовые и текстовые колонки.
+def table_columns(columns):
+    names = [(GROUP_FIELD, 'str'), (FILTER_FIELD, 'int')]
+    for i in range(max(columns - len(names), 1)):
+        names.append((f'ЧИСЛО{i}', 'int') if i % 2 == 0
+                     else (f'ТЕКСТ{i}', 'str'))
+    return names
+
+
+def random_text(rnd, multiline):
+    words = rnd.sample(WORDS, 2)
+    separator = '\n' if rnd.random() < multiline else ' '
+    return separator.join(words)
+
+
+def make_table_data(filename, rows, columns, multiline=0.0, groups=0,
+                    seed=0):
+    rnd = random.Random(seed)
+    names = table_columns(columns)
+    key_count = groups or 100
+    with open(filename, 'w', encoding='utf-8', newline='') as file:
+        file.write(','.join(name for name, _ in names) + '\n')
+        for _ in range(rows):
+            line = [f'g{rnd.randrange(key_count):05d}',
+                    str(rnd.randrange(100))]
+            for name, _type in names[2:]:
+                line.append(str(rnd.randint(-1000, 100000)) if _type == 'int'
+                            else random_text(rnd, multiline))
+            file.write(','.join(line) + '#\n')
+
+
+def make_table_pattern(filename, columns, groups=0, selectivity=1.0):
+    names = table_columns(columns)
+    lines = ['table name: Бенчмарк #',
+             'table columns: ' + '; '.join(f'{name}|{_type}-12'
+                                           for name, _type in names) + '#']
+    if groups:
+        aggregated = [name for name, _type in names[2:] if _type == 'int']
+        lines.append(f'group: fields|{GROUP_FIELD} data|sum; {FILTER_FIELD} '
+                     + ' '.join(f'data|max; {name}' for name in aggregated)
+                     + '#')
+    if selectivity < 1.0:
+        # С группой фильтр проверяется по ключу: ключи равномерны.
+        if groups:
+            bound = f'g{int(groups * selectivity):05d}'
+            lines.append(f'filter: {GROUP_FIELD} < {bound}#')
+        else:
+            lines.append(f'filter: {FILTER_FIELD} < '
+                         f'{int(100 * selectivity)}#')
+    with open(filename, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(lines))
+
+
+def make_text_data(filename, holes, multiline=0.0, seed=0):
+    rnd = random.Random(seed)
+    records = []
+    for i in range(holes):
+        value = (str(rnd.randrange(1000)) if i % 2 == 0
+                 else random_text(rnd, multiline))
+        records.append(f'ПОЛЕ{i} = {value}')
+    with open(filename, 'w', encoding='utf-8') as file:
+        file.write('#\n'.join(records) + '#')
+
+
+def make_text_pattern(filename, holes, units=0.0, seed=0):
+    rnd = random.Random(seed)
+    with open(filename, 'w', encoding='utf-8') as file:
+        for i in range(holes):
+            # Единица измерения склоняется только у числовых полей.
+            if i % 2 == 0 and rnd.random() < units:
+                hole = f'{{{{ПОЛЕ{i}|14-r-{rnd.choice(UNITS)}}}}}'
+            else:
+                hole = f'{{{{ПОЛЕ{i}|14-c}}}}'
+            file.write(f'Поле {i}: {hole}#\n')
+
+
+# Замеры этапов, которые делает сам генератор (instrumentation.stage):
+# запись не пишется в файл, а остается в record. Без tracemalloc.
+class StageRecorder(instrumentation.Report):
+    def __init__(self):
+        super().__init__(None, {}, trace_memory=False)
+        self.record = None
+
+    def emit(self, record):
+        self.record = record
+
+    # Время этапов stages (0, если этапа не было) и total -- всего отчета.
+    def times(self, stages):
+        times = OrderedDict((stage, 0.0) for stage in stages)
+        for stage in self.record['stages']:
+            if stage['stage'] in times:
+                times[stage['stage']] += stage['wall']
+        times['total'] = self.record['wall']
+        return times
+
+
+# Генератор работает как в обычном запуске (с тем же engine), этапы
+# замеряет он сам.
+def run_table(p_filename, d_filename, output_filename, engine):
+    recorder = StageRecorder()
+    with recorder:
+        generator = TableReportGenerator(p_filename, d_filename,
+                                         output_filename, engine=engine)
+    return recorder.times(TABLE_STAGES), len(generator.filtered_table)
+
+
+# Кэш склонений очищается перед каждым повтором, чтобы все повторы
+# делали одинаковую работу (сам анализатор загружается один раз).
+def run_text(p_filename, d_filename, output_filename, default_field_width=20):
+    morphology.cache_clear()
+    recorder = StageRecorder()
+    with recorder:
+        generator = ReportGenerator(d_filename, p_filename, output_filename,
+                                    default_field_width=default_field_width)
+    return recorder.times(TEXT_STAGES), len(generator.sub_data)
+
+
+def summarize(samples, stages):
+    return OrderedDict(
+        (stage, OrderedDict([
+            ('min', min(sample[stage] for sample in samples)),
+            ('median', statistics.median(sample[stage]
+                                         for sample in samples))]))
+        for stage in stages + ('total',))
+
+
+def scaled(case, scale, key):
+    case = dict(case)
+    case[key] = max(1, int(case[key] * scale))
+    return case
+
+
+def run_cases(workdir, table_cases=TABLE_CASES, text_cases=TEXT_CASES,
+              repeat=3, scale=1.0, seed=0, engine=numpy_engine.PYTHON):
+    results = []
+    output_filename = os.path.join(workdir, 'report.txt')
+    for case in table_cases:
+        case = scaled(case, scale, 'rows')
+        p_filename = os.path.join(workdir, f'{case["name"]}_pattern.txt')
+        d_filename = os.path.join(workdir, f'{case["name"]}_data.txt')
+        make_table_pattern(p_filename, case['columns'], case['groups'],
+                           case['selectivity'])
+        make_table_data(d_filename, case['rows'], case['columns'],
+                        case['multiline'], case['groups'], seed)
+        samples = []
+        for _ in range(repeat):
+            times, result_rows = run_table(p_filename, d_filename,
+                                           output_filename, engine)
+            samples.append(times)
+        results.append(OrderedDict([
+            ('name', case['name']), ('format', 'table'),
+            ('params', case), ('result_rows', result_rows),
+            ('stages', summarize(samples, TABLE_STAGES))]))
+    for case in text_cases:
+        case = scaled(case, scale, 'holes')
+        p_filename = os.path.join(workdir, f'{case["name"]}_pattern.txt')
+        d_filename = os.path.join(workdir, f'{case["name"]}_data.txt')
+        make_text_pattern(p_filename, case['holes'], case['units'], seed)
+        make_text_data(d_filename, case['holes'], case['multiline'], seed)
+        samples = []
+        for _ in range(repeat):
+            times, fields = run_text(p_filename, d_filename, output_filename)
+            samples.append(times)
+        results.append(OrderedDict([
+            ('name', case['name']), ('format', 'text'),
+            ('params', case), ('result_rows', fields),
+            ('stages', summarize(samples, TEXT_STAGES))]))
+    return results
+
+
+def environment(seed, repeat, scale, engine):
+    return OrderedDict([
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('numpy', numpy_engine.np.__version__ if numpy_engine.available()
+         else None),
+        ('engine', numpy_engine.select_engine(engine)),
+        ('seed', seed), ('repeat', repeat), ('scale', scale),
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S'))])
+
+
+# Отношения медиан текущего прогона к прошлому. Этапы короче
+# min_time не сравниваются: там одни шумы.
+def compare(current, baseline, threshold=1.2, min_time=0.005):
+    old_cases = {case['name']: case for case in baseline['cases']}
+    regressions = []
+    for case in current['cases']:
+        old = old_cases.get(case['name'])
+        if old is None or old['params'] != case['params']:
+            continue
+        for stage, times in case['stages'].items():
+            old_time = old['stages'].get(stage, {}).get('median')
+            if not old_time or old_time < min_time:
+                continue
+            ratio = times['median'] / old_time
+            print(f'{case["name"]:20} {stage:8} {old_time:9.4f} -> '
+                  f'{times["median"]:9.4f}  x{ratio:.2f}')
+            if ratio > threshold:
+                regressions.append((case['name'], stage, ratio))
+    return regressions
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(
+        prog='benchmark',
+        description='Times every stage of table and text report pipelines '
+                    'on synthetic data and saves the results as JSON.')
+    parser.add_argument('--output', '-o', default='benchmark.json',
+                        help='JSON file with results')
+    parser.add_argument('--repeat', '-r', type=int, default=3,
+                        help='Runs per case, min and median are saved')
+    parser.add_argument('--scale', '-s', type=float, default=1.0,
+                        help='Multiplier for rows and holes of every case')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the data generators')
+    parser.add_argument('--engine', choices=numpy_engine.ENGINES,
+                        default=numpy_engine.PYTHON)
+    parser.add_argument('--only', choices=['table', 'text'],
+                        help='Run only one pipeline')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='Previous results; exit code 1 on regression')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Allowed slowdown of a stage median')
+    parser.add_argument('--keep', metavar='DIR',
+                        help='Keep generated data in DIR')
+    return parser
+
+
+def main():
+    args = create_argument_parser().parse_args()
+    table_cases = TABLE_CASES if args.only != 'text' else []
+    text_cases = TEXT_CASES if args.only != 'table' else []
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.keep or tmp
+        os.makedirs(workdir, exist_ok=True)
+        cases = run_cases(workdir, table_cases, text_cases, args.repeat,
+                          args.scale, args.seed, args.engine)
+    results = OrderedDict([
+        ('environment', environment(args.seed, args.repeat, args.scale,
+                                    args.engine)),
+        ('cases', cases)])
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+    for case in cases:
+        print(f'{case["name"]:20} ' + ' '.join(
+            f'{stage}={times["median"]:.4f}'
+            for stage, times in case['stages'].items()))
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for name, stage, ratio in regressions:
+            print(f'Regression: {name} {stage} x{ratio:.2f}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+from array import array
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from columnar_table import ColumnarTable, TYPECODES
+
+MAGIC = b'RGCOLS\0\0'
+# Меняется вместе с форматом файла: старые файлы не подойдут.
+VERSION = 3
+SUFFIX = '.columns'
+# Длина заголовка (JSON) после MAGIC.
+LENGTH = struct.Struct('<Q')
+# Начала колонок выравниваются, чтобы массивы читались без сдвигов.
+ALIGN = 8
+HEAP_ENCODING = 'utf-8'
+HEAP_ERRORS = 'surrogatepass'
+
+
+# Один файл на файл данных, кодировку и типы колонок. Размер и время
+# изменения файла данных хранятся внутри: если они другие, кэш
+# перестраивается на том же месте.
+def cache_filename(directory, d_filename, encoding, types):
+    key = repr((os.path.abspath(d_filename), encoding,
+                sorted(types.items())))
+    return os.path.join(directory,
+                        hashlib.sha256(key.encode()).hexdigest() + SUFFIX)
+
+
+def file_signature(d_filename):
+    stat = os.stat(d_filename)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def padding(size):
+    return -size % ALIGN
+
+
+# Колонка -> (вид, части файла). Числа -- массивы как есть; строки --
+# куча (текст всех значений подряд в utf-8) и смещения значений в символах
+# этого текста (n + 1 штук). Целые, не влезшие в 64 бита, хранятся строками.
+def encode_column(column, _type):
+    if column.__class__ is not list:
+        return column.typecode, [column]
+    values = column if _type == 'str' else [str(value) for value in column]
+    offsets = array('q', [0])
+    position = 0
+    for value in values:
+        position += len(value)
+        offsets.append(position)
+    heap = ''.join(values).encode(HEAP_ENCODING, HEAP_ERRORS)
+    return 'str' if _type == 'str' else _type, [offsets, heap]
+
+
+def decode_column(view, kind, parts):
+    if kind in TYPECODES.values():
+        (start, size), = parts
+        values = array(kind)
+        values.frombytes(view[start:start + size])
+        return values
+    (offsets_start, offsets_size), (heap_start, heap_size) = parts
+    offsets = array('q')
+    offsets.frombytes(view[offsets_start:offsets_start + offsets_size])
+    text = str(view[heap_start:heap_start + heap_size], HEAP_ENCODING,
+               HEAP_ERRORS)
+    values = [text[start:end] for start, end in zip(offsets, offsets[1:])]
+    if kind != 'str':
+        values = list(map(int, values))
+    return values
+
+
+# signature -- подпись файла данных до его чтения: если файл менялся,
+# пока читался, следующий запуск перестроит кэш. messages -- сообщения о
+# неудачном приведении значений, напечатанные при чтении.
+def save(filename, d_filename, table, signature, messages=''):
+    columns = []
+    sections = []
+    position = 0
+    for name in table.fieldnames:
+        kind, parts = encode_column(table.column(name), table.types[name])
+        spans = []
+        for part in parts:
+            size = len(part) * (part.itemsize if isinstance(part, array)
+                                else 1)
+            spans.append((position, size))
+            sections.append(part)
+            position += size + padding(size)
+        columns.append({'name': name, 'kind': kind, 'parts': spans})
+    header = json.dumps({
+        'version': VERSION,
+        'source': os.path.abspath(d_filename),
+        'signature': signature,
+        'byteorder': sys.byteorder,
+        'types': table.types,
+        'rows': len(table),
+        'columns': columns,
+        'messages': messages
+    }, ensure_ascii=False).encode()
+    header += b' ' * padding(len(MAGIC) + LENGTH.size + len(header))
+    directory = os.path.dirname(filename) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(MAGIC + LENGTH.pack(len(header)) + header)
+            for part in sections:
+                file.write(part)
+                size = file.tell()
+                file.write(b'\0' * padding(size))
+        os.replace(temp_name, filename)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
+def read_header(buffer):
+    if buffer[:len(MAGIC)] != MAGIC:
+        return None, 0
+    start = len(MAGIC) + LENGTH.size
+    length, = LENGTH.unpack_from(buffer, len(MAGIC))
+    return json.loads(bytes(buffer[start:start + length])), start + length
+
+
+# Таблица из кэша; None -- кэша нет, он устарел (файл данных или типы
+# другие) или поврежден. Сохраненные сообщения печатаются снова, как при
+# чтении файла.
+def load(filename, d_filename, types):
+    try:
+        with open(filename, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    with buffer:
+        try:
+            header, start = read_header(buffer)
+        except ValueError as error:
+            print(f'Broken column cache "{filename}" is ignored: {error!r}')
+            return None
+        if (header is None or header['version'] != VERSION
+                or header['source'] != os.path.abspath(d_filename)
+                or header['signature'] != file_signature(d_filename)
+                or header['byteorder'] != sys.byteorder
+                or header['types'] != types):
+            return None
+        with memoryview(buffer) as view:
+            table = ColumnarTable.from_columns(
+                {column['name']: decode_column(
+                    view[start:], column['kind'], column['parts'])
+                 for column in header['columns']}, types)
+        table.size = header['rows']
+    sys.stdout.write(header['messages'])
+    return table
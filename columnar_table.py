@@ -0,0 +1,118 @@
+from array import array
+from collections import OrderedDict
+import sys
+
+TYPES = {
+    'int': int,
+    'float': float,
+    'str': str
+}
+
+
+def convert_value(converter, value, line):
+    try:
+        return converter(value)
+    except ValueError:
+        print(f'It is not possible to convert "{value}"" to'
+              f' type "{converter}" in line:\n"{line}"')
+        # Инициализирую дефолтное значение типа.
+        return converter()
+
+
+# Числовые колонки хранятся в типизированных массивах.
+TYPECODES = {
+    'int': 'q',
+    'float': 'd'
+}
+
+
+class ColumnarTable:
+    def __init__(self, fieldnames, types=None):
+        types = types if types is not None else {}
+        self.fieldnames = tuple(fieldnames)
+        self.types = OrderedDict((name, types.get(name, 'str'))
+                                 for name in self.fieldnames)
+        self.columns = OrderedDict((name, self.new_column(_type))
+                                   for name, _type in self.types.items())
+        self.size = 0
+
+    @staticmethod
+    def new_column(_type):
+        typecode = TYPECODES.get(_type)
+        return array(typecode) if typecode is not None else []
+
+    @classmethod
+    def from_rows(cls, fieldnames, types, rows):
+        table = cls(fieldnames, types)
+        table.extend(rows)
+        return table
+
+    @classmethod
+    def from_columns(cls, columns, types=None):
+        table = cls(columns.keys(), types)
+        for name, values in columns.items():
+            table.columns[name] = values
+        table.size = len(next(iter(columns.values()), ()))
+        return table
+
+    # Значения строки уже приведены к типам колонок.
+    def append(self, values):
+        for name, value in zip(self.fieldnames, values):
+            column = self.columns[name]
+            if column.__class__ is list:
+                column.append(sys.intern(value) if value.__class__ is str
+                              else value)
+                continue
+            try:
+                column.append(value)
+            except OverflowError:
+                # Число не влезло в 64 бита -- колонка становится списком.
+                column = self.columns[name] = list(column)
+                column.append(value)
+        self.size += 1
+
+    def extend(self, rows):
+        for values in rows:
+            self.append(values)
+
+    def column(self, name):
+        return self.columns[name]
+
+    def row(self, i):
+        return OrderedDict((name, column[i])
+                           for name, column in self.columns.items())
+
+    def rows(self):
+        return zip(*self.columns.values())
+
+    def take(self, indices):
+        if not isinstance(indices, (list, range)):
+            indices = list(indices)
+        table = self.__class__(self.fieldnames, self.types)
+        for name, column in self.columns.items():
+            values = [column[i] for i in indices]
+            if column.__class__ is list:
+                table.columns[name] = values
+            else:
+                table.columns[name] = array(column.typecode, values)
+        table.size = len(indices)
+        return table
+
+    def to_dicts(self):
+        return [OrderedDict(zip(self.fieldnames, values))
+                for values in self.rows()]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __len__(self):
+        return self.size
+
+    def __eq__(self, other):
+        if not isinstance(other, ColumnarTable):
+            return NotImplemented
+        return (self.fieldnames == other.fieldnames
+                and list(self.rows()) == list(other.rows()))
+
+    def __repr__(self):
+        return f'ColumnarTable({self.to_dicts()})'
@@ -1,29 +1,203 @@
+from collections.abc import Mapping
+import codecs
+import mmap
 import re
 
 DATA_PATTERN = re.compile(r'''(?P<name>[\w\s\-,]+)\s*=\s*
                               (?P<value>[\d\w\s\-,]+)
                           ''', re.X)
+# Части DATA_PATTERN для разбора записи по байтам: имя до '=' целиком,
+# первый символ после '=' и значение.
+NAME_PATTERN = re.compile(r'[\w\s\-,]+\Z')
+VALUE_START_PATTERN = re.compile(r'[\d\w\s\-,]')
+VALUE_PATTERN = re.compile(r'\s*(?P<value>[\d\w\s\-,]+)')
+# Запись в байтах -- все между '#'. HEAD_PATTERN находит те же записи,
+# но выделяет имя до '=' и первый байт значения.
+RECORD_PATTERN = re.compile(rb'[^#]+')
+HEAD_PATTERN = re.compile(rb'(?=[^#])([^#=]*)(?:=([^#]))?[^#]*')
+# Имена склеиваются через NUL; символ, которого не может быть в имени.
+NAME_SEPARATOR = '\0'
+BAD_NAME_CHAR = re.compile(r'[^\w\s\-,\0]')
+VALUE_START_BYTES = frozenset(
+    char.encode() for char in map(chr, range(0x80))
+    if VALUE_START_PATTERN.match(char))
+RECORD_DELIMITER = '#'
+NAME_DELIMITER = '='
+# Байт, которых хватит на один символ в любой кодировке.
+MAX_CHAR_BYTES = 4
+# Сколько байт просматривается за раз при поиске нужных полей с конца.
+BLOCK_SIZE = 1 << 16
 
 
+# Разделители ищутся прямо в байтах, если кодировка записывает их одним
+# байтом ASCII (utf-8, cp1251, но не utf-16).
+def byte_delimited(encoding):
+    try:
+        return all(char.encode(encoding) == char.encode()
+                   for char in (RECORD_DELIMITER, NAME_DELIMITER))
+    except LookupError:
+        return False
+
+
+# Как при чтении файла в текстовом режиме.
+def translate_newlines(text):
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def print_bad_line(line):
+    print(f'Line is not in right condition: {line}. '
+          f'Can\'t extract data.\n')
+
+
+# Поля файла данных поверх mmap. При открытии декодируются только имена
+# полей, значения -- при первом обращении (и запоминаются).
+# spans -- байтовые границы записи каждого поля (без '#').
+class FieldIndex(Mapping):
+    def __init__(self, buffer, encoding, spans):
+        self.buffer = buffer
+        self.encoding = encoding
+        self.spans = spans
+        self.values = {}
+
+    def __getitem__(self, name):
+        value = self.values.get(name)
+        if value is None:
+            start, end = self.offsets(name)
+            text = translate_newlines(
+                self.buffer[start:end].decode(self.encoding))
+            value = self.values[name] = \
+                VALUE_PATTERN.match(text).group('value').strip()
+        return value
+
+    def __iter__(self):
+        return iter(self.spans)
+
+    def __len__(self):
+        return len(self.spans)
+
+    # Байтовые границы значения: от символа после '=' до конца записи.
+    def offsets(self, name):
+        start, end = self.spans[name]
+        return self.buffer.find(NAME_DELIMITER.encode(), start, end) + 1, end
+
+
+# names -- имена полей, которые нужны (из шаблона); None -- все поля.
 class DataReader:
-    def __init__(self, filename, encoding='utf-8'):
-        self.__file_data = self.read_data(filename, encoding)
-        self.fields = self.extract_values()
+    def __init__(self, filename, encoding='utf-8', names=None):
+        if byte_delimited(encoding):
+            self.fields = self.index_fields(filename, encoding, names)
+        else:
+            self.fields = self.extract_values(self.read_data(filename,
+                                                             encoding))
 
     @staticmethod
     def read_data(filename, encoding):
         with open(filename, 'r', encoding=encoding) as file:
             return filter(None, file.read().split('#'))
 
-    def extract_values(self):
+    @staticmethod
+    def extract_values(lines):
         fields_dict = {}
-        for line in self.__file_data:
+        for line in lines:
             match = DATA_PATTERN.match(line)
             if match is not None:
                 field_name = match.group('name').strip().upper()
                 field_value = match.group('value').strip()
                 fields_dict[field_name] = field_value
             else:
-                print(f'Line is not in right condition: {line}. '
-                      f'Can\'t extract data.\n')
+                print_bad_line(line)
         return fields_dict
+
+    # То же, что extract_values(read_data(...)), но без копии файла в
+    # памяти: записи ищутся в байтах, значения не декодируются.
+    @classmethod
+    def index_fields(cls, filename, encoding, names=None):
+        with open(filename, 'rb') as file:
+            try:
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Пустой файл не отображается.
+                buffer = b''
+        if names is None:
+            spans = cls.index_spans(buffer, encoding)
+        else:
+            spans = cls.find_spans(buffer, encoding, names)
+        return FieldIndex(buffer, encoding, spans)
+
+    # Поиск нужных полей блоками с конца файла. Первое найденное с конца
+    # поле -- то же, что последнее при чтении с начала (повторы затираются),
+    # поэтому, как только найдены все имена, начало файла не читается.
+    # Плохие записи сообщаются только в прочитанных блоках.
+    @classmethod
+    def find_spans(cls, buffer, encoding, names):
+        wanted = set(names)
+        spans = {}
+        end = len(buffer)
+        while wanted and end > 0:
+            # Блок начинается сразу после '#', запись не режется.
+            start = buffer.rfind(RECORD_DELIMITER.encode(), 0,
+                                 max(end - BLOCK_SIZE, 0)) + 1
+            for name, span in cls.index_spans(buffer, encoding,
+                                              start, end).items():
+                if name in wanted:
+                    spans[name] = span
+                    wanted.discard(name)
+            end = start
+        return spans
+
+    # Два прохода по байтам в C: границы записей и (имя, первый байт
+    # значения). Имена декодируются и проверяются одним куском, по записям
+    # проверяются только начала значений.
+    @classmethod
+    def index_spans(cls, buffer, encoding, start=0, end=None):
+        if end is None:
+            end = len(buffer)
+        spans = [match.span()
+                 for match in RECORD_PATTERN.finditer(buffer, start, end)]
+        heads = HEAD_PATTERN.findall(buffer, start, end)
+        separator = NAME_SEPARATOR.encode()
+        if buffer.find(separator, start, end) != -1:
+            names = [name.decode(encoding) for name, _ in heads]
+            text = None
+        else:
+            text = separator.join([name for name, _ in heads]).decode(
+                encoding)
+            names = text.split(NAME_SEPARATOR) if heads else []
+        invalid = {i for i, (name, first) in enumerate(heads)
+                   if not name or first not in VALUE_START_BYTES}
+        for i in [i for i in invalid if heads[i][0] and heads[i][1]]:
+            if cls.value_starts(buffer, encoding, heads[i][1], spans[i]):
+                invalid.discard(i)
+        if text is None or BAD_NAME_CHAR.search(text) is not None:
+            invalid.update(i for i, name in enumerate(names)
+                           if not NAME_PATTERN.match(name))
+        for i in sorted(invalid):
+            start, end = spans[i]
+            print_bad_line(translate_newlines(
+                buffer[start:end].decode(encoding)))
+        if text is None or '\r' in text:
+            names = map(translate_newlines, names)
+        keys = [name.strip().upper() for name in names]
+        # Плохие записи не попадают в словарь, но и не затирают хорошие.
+        for i in invalid:
+            keys[i] = None
+        fields = dict(zip(keys, spans))
+        fields.pop(None, None)
+        return fields
+
+    # Первый символ после '=' (не ASCII) подходит для значения.
+    @staticmethod
+    def value_starts(buffer, encoding, first, span):
+        if first[0] < 0x80:
+            return first in VALUE_START_BYTES
+        start = buffer.find(NAME_DELIMITER.encode(), *span) + 1
+        return VALUE_START_PATTERN.match(
+            codecs.getincrementaldecoder(encoding)().decode(
+                buffer[start:min(start + MAX_CHAR_BYTES, span[1])]))
+
+    # Поля шаблона, которых нет в данных, и поля данных, которых нет в
+    # шаблоне. Значения полей для этого не декодируются.
+    @staticmethod
+    def field_usage(fields, names):
+        return (sorted(set(names) - fields.keys()),
+                sorted(fields.keys() - set(names)))
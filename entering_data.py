@@ -3,13 +3,28 @@ import argparse
 
 class EnteredData:
     def __init__(self, namespace):
-        self.pattern_name = namespace.pattern
+        # Несколько шаблонов (только таблицы) -- один проход по данным.
+        self.pattern_names = namespace.pattern
+        self.pattern_name = namespace.pattern[0]
         self.pattern_enc = namespace.pattern_encoding
         self.data_name = namespace.data
         self.data_enc = namespace.data_encoding
         self.default_field_width = namespace.default_field_width
         self.output_filename = namespace.output_filename
         self.input_format = namespace.input_format
+        self.jobs = namespace.jobs
+        self.stream = namespace.stream
+        self.engine = namespace.engine
+        self.profile = namespace.profile
+        self.no_cache = namespace.no_cache
+        self.cache_dir = namespace.cache_dir
+        self.cache_size = namespace.cache_size
+        self.incremental = namespace.incremental
+        self.merge = namespace.merge
+        self.check_fields = namespace.check_fields
+        self.profile_startup = namespace.profile_startup
+        self.index = namespace.index
+        self.data_cache = namespace.data_cache
 
 
 def create_argument_parser():
@@ -17,7 +32,10 @@ def create_argument_parser():
     epilog = ('\n\nExit code "0" - Successfully ended.\nExit code "1" - '
               'Exception during the working with the file. Check filename\'s '
               '\n\nMarch 2019, Ural Federal University')
-    pattern_help = 'Pattern is needed for substitution of your data'
+    pattern_help = ('Pattern is needed for substitution of your data.\n'
+                    'Table format can take a few patterns: every data file\n'
+                    'is read and typed once for all of them, reports are\n'
+                    'N_M_OUTPUT for the N-th data file and M-th pattern.')
     data_help = ('Input data will be substituted to the pattern.\n'
                  'You can add a few files with data.\n'
                  'It will be looks like \'-d f1.txt f2.txt\'')
@@ -29,6 +47,49 @@ def create_argument_parser():
                         'with text\'s readability of the pattern.\n'
                         'Default encoding is cp1251.')
     input_format_help = 'Chooses a form to read data from table or from text\n'
+    jobs_help = ('Number of processes generating reports in parallel.\n'
+                 '0 uses all available cores. Default is 1.')
+    engine_help = ('Engine for typing, filtering and grouping table data.\n'
+                   '"numpy" works on whole columns and falls back to "python"\n'
+                   'if NumPy is not installed. Default is python.')
+    profile_help = ('Writes wall time, CPU time, peak memory and row count of\n'
+                    'every stage as JSON lines to PROFILE ("-" or no value\n'
+                    'is stderr). The same is enabled by the\n'
+                    'REPORT_GENERATOR_PROFILE environment variable.')
+    profile_startup_help = ('Prints to stderr the time of every module import\n'
+                            'made after the arguments are parsed (report\n'
+                            'pipeline, numpy, pymorphy2), in the format of\n'
+                            '"python -X importtime" but in milliseconds.')
+    no_cache_help = ('Always generates reports. By default a report is copied\n'
+                     'from the cache if the pattern, data, encodings, field\n'
+                     'width and input format have not changed.')
+    cache_dir_help = ('Directory of the report cache. Default is\n'
+                      'REPORT_GENERATOR_CACHE or ~/.cache/report_generator.')
+    cache_size_help = ('Size of the report cache in MiB, least recently used\n'
+                       'reports are removed first. Default is 64.')
+    incremental_help = ('For grouped tables in append-only data files: keeps\n'
+                        'the group state between runs and reads only rows\n'
+                        'appended since the last run. A rewritten file is\n'
+                        'grouped from scratch.')
+    index_help = ('Table format only: keeps an index of the data file next\n'
+                  'to the cache. Filtered rows are found in it instead of\n'
+                  'reading every row. The index is rebuilt when the file\n'
+                  'size, mtime or content hash changes.')
+    data_cache_help = ('Table format only: keeps the typed columns of data files\n'
+                       'in a binary cache next to the report cache. Later\n'
+                       'runs map it into memory instead of parsing the file.\n'
+                       'It is rebuilt when the file path, size or mtime or\n'
+                       'the pattern column types change. Not used with\n'
+                       '--stream.')
+    merge_help = ('Table format only: one report over all data files\n'
+                  'written to OUTPUT. Groups are counted per file in\n'
+                  'JOBS processes and merged.')
+    check_fields_help = ('Text format only: prints the pattern fields missing\n'
+                         'from the data and the data fields the pattern does\n'
+                         'not use. Otherwise only the fields the pattern uses\n'
+                         'are read.')
+    stream_help = ('Reads table data record by record instead of loading\n'
+                   'the whole file into memory.')
 
     parser = argparse.ArgumentParser(
         prog='ReportsGenerator',
@@ -39,6 +100,7 @@ def create_argument_parser():
     parser.add_argument(
         '--pattern', '-p',
         metavar='PATTERN',
+        nargs='+',
         type=str,
         help=pattern_help,
         required=True
@@ -86,12 +148,95 @@ def create_argument_parser():
         type=str,
         default='generated_report.txt'
     )
+    parser.add_argument(
+        '--jobs', '-j',
+        metavar='JOBS',
+        type=int,
+        help=jobs_help,
+        default=1
+    )
+    parser.add_argument(
+        '--engine',
+        metavar='ENGINE',
+        type=str,
+        choices=['python', 'numpy'],
+        help=engine_help,
+        default='python'
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help=stream_help
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help=incremental_help
+    )
+    parser.add_argument(
+        '--index',
+        action='store_true',
+        help=index_help
+    )
+    parser.add_argument(
+        '--data-cache',
+        action='store_true',
+        help=data_cache_help
+    )
+    parser.add_argument(
+        '--merge',
+        action='store_true',
+        help=merge_help
+    )
+    parser.add_argument(
+        '--check-fields',
+        action='store_true',
+        help=check_fields_help
+    )
+    parser.add_argument(
+        '--profile',
+        metavar='PROFILE',
+        type=str,
+        nargs='?',
+        const='-',
+        help=profile_help
+    )
+    parser.add_argument(
+        '--profile-startup',
+        action='store_true',
+        help=profile_startup_help
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help=no_cache_help
+    )
+    parser.add_argument(
+        '--cache-dir',
+        metavar='CACHE_DIR',
+        type=str,
+        help=cache_dir_help
+    )
+    parser.add_argument(
+        '--cache-size',
+        metavar='MIB',
+        type=int,
+        help=cache_size_help,
+        default=64
+    )
     return parser
 
 
 def input_data():
     parser = create_argument_parser()
     namespace = parser.parse_args()
+    if len(namespace.pattern) > 1 and (namespace.input_format != 'table'
+                                       or namespace.merge
+                                       or namespace.incremental):
+        parser.error('a few patterns are supported only for table format '
+                     'without --merge and --incremental')
+    if namespace.jobs < 0:
+        parser.error('--jobs must not be negative')
 
     return EnteredData(namespace)
 
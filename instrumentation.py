@@ -0,0 +1,226 @@
+import builtins
+from collections import OrderedDict
+import json
+import os
+import sys
+import time
+# Нужные функции tracemalloc есть в _tracemalloc; сам tracemalloc при
+# импорте загружает pickle и linecache.
+import _tracemalloc as tracemalloc
+
+# Путь к файлу JSON lines с замерами ('-' -- stderr). Переменная окружения
+# наследуется процессами пула, поэтому замеры пишут и они.
+ENV_VAR = 'REPORT_GENERATOR_PROFILE'
+STDERR = '-'
+
+
+def output_path():
+    return os.environ.get(ENV_VAR) or None
+
+
+def enable(path=STDERR):
+    os.environ[ENV_VAR] = path
+
+
+def disable():
+    os.environ.pop(ENV_VAR, None)
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def enabled():
+    return ENV_VAR in os.environ
+
+
+# Пиковая память этапа считается от сброса пика в начале этапа
+# (tracemalloc.reset_peak есть с Python 3.9, раньше -- пик процесса).
+def _reset_peak():
+    reset_peak = getattr(tracemalloc, 'reset_peak', None)
+    if reset_peak is not None:
+        reset_peak()
+
+
+# Этап можно проходить несколько раз (строки приводятся к типам и пишутся
+# пачками вперемешку с другими этапами): время складывается. Время
+# вложенного этапа не входит во время внешнего.
+class Stage:
+    __slots__ = ('name', 'rows', 'wall', 'cpu', 'peak_memory', '_active',
+                 '_wall', '_cpu', '_memory', '_nested_wall', '_nested_cpu')
+
+    def __init__(self, name, active):
+        self.name = name
+        self.rows = None
+        self.wall = self.cpu = 0.0
+        self.peak_memory = 0
+        self._active = active
+
+    def __enter__(self):
+        if self._active:
+            self._active[-1].update_peak()
+        self._active.append(self)
+        _reset_peak()
+        self._memory = tracemalloc.get_traced_memory()[0]
+        self._nested_wall = self._nested_cpu = 0.0
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        self.update_peak()
+        self._active.pop()
+        if self._active:
+            self._active[-1]._nested_wall += wall
+            self._active[-1]._nested_cpu += cpu
+        self.wall += wall - self._nested_wall
+        self.cpu += cpu - self._nested_cpu
+
+    # Вложенный этап сбрасывает пик, поэтому пик внешнего запоминается до
+    # этого.
+    def update_peak(self):
+        self.peak_memory = max(self.peak_memory,
+                               tracemalloc.get_traced_memory()[1]
+                               - self._memory)
+
+    def as_dict(self):
+        return {'stage': self.name, 'wall': round(self.wall, 6),
+                'cpu': round(self.cpu, 6), 'peak_memory': self.peak_memory,
+                'rows': self.rows}
+
+
+# Заглушка для выключенных замеров: один объект на все вызовы.
+class NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+# trace_memory=False -- без tracemalloc (он заметно замедляет работу),
+# пиковая память этапов тогда 0.
+class Report:
+    def __init__(self, path, info, trace_memory=True):
+        self.path = path
+        self.info = info
+        self.trace_memory = trace_memory
+        # Этапы по именам в порядке первого входа и этапы, идущие сейчас.
+        self.stages = OrderedDict()
+        self.active = []
+
+    def __enter__(self):
+        global _current
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._previous, _current = _current, self
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _current
+        _current = self._previous
+        record = dict(self.info)
+        record['pid'] = os.getpid()
+        record['wall'] = round(time.perf_counter() - self._wall, 6)
+        record['cpu'] = round(time.process_time() - self._cpu, 6)
+        record['stages'] = [stage.as_dict()
+                            for stage in self.stages.values()]
+        if exc_value is not None:
+            record['error'] = repr(exc_value)
+        self.emit(record)
+
+    def emit(self, record):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        if self.path == STDERR:
+            sys.stderr.write(line)
+        else:
+            # Одна запись -- одна строка, дописывается целиком.
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(line)
+
+
+class NullReport:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_REPORT = NullReport()
+_current = None
+
+
+# Время импорта модулей (--profile-startup). Импорт, вызванный из другого
+# импорта, входит в его общее время, но не в собственное. Модули, которые
+# уже загружены, не учитываются.
+class ImportTimer:
+    def __init__(self):
+        # (глубина, модуль, собственное время, общее время) в порядке
+        # окончания импорта, как у python -X importtime.
+        self.records = []
+        self._children = [0.0]
+        self._import = None
+
+    def install(self):
+        self._import = builtins.__import__
+        builtins.__import__ = self.timed_import
+
+    def uninstall(self):
+        builtins.__import__ = self._import
+
+    def timed_import(self, name, *args, **kwargs):
+        if name in sys.modules:
+            return self._import(name, *args, **kwargs)
+        self._children.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            cumulative = time.perf_counter() - start
+            children = self._children.pop()
+            self._children[-1] += cumulative
+            self.records.append((len(self._children) - 1, name,
+                                 cumulative - children, cumulative))
+
+    def total(self):
+        return self._children[0]
+
+    def write(self, stream):
+        stream.write('import time: self [ms] | cumulative | imported module\n')
+        for depth, name, own, cumulative in self.records:
+            stream.write(f'import time: {own * 1000:9.3f} | '
+                         f'{cumulative * 1000:10.3f} | '
+                         f'{"  " * depth}{name}\n')
+        stream.write(f'import time: total {self.total() * 1000:.3f} ms\n')
+
+
+# Замеры одного отчета: info попадает в запись как есть.
+def report(**info):
+    path = output_path()
+    if path is None:
+        return NULL_REPORT
+    return Report(path, info)
+
+
+# Этап текущего отчета; вне отчета или без замеров -- заглушка. Этап с
+# тем же именем продолжается.
+def stage(name):
+    if _current is None:
+        return NULL_STAGE
+    stages = _current.stages
+    if name not in stages:
+        stages[name] = Stage(name, _current.active)
+    return stages[name]
@@ -1,31 +1,290 @@
-from table_report_generator import TableReportGenerator
-from report_generator import ReportGenerator
+from contextlib import redirect_stdout
+import os
+import sys
+
 import entering_data as ed
+import instrumentation
 
+# Генераторы отчетов, пул процессов, кэш и состояние инкрементальной
+# группировки импортируются внутри функций: при запуске загружается только
+# то, что нужно для формата (-in) и ключей.
 
-def main():
-    input_data = ed.input_data()
-    for i in range(len(input_data.data_name)):
+
+# Шаблон разбирается один раз и используется для всех файлов данных.
+def read_pattern(input_data, pattern_name=None):
+    if pattern_name is None:
+        pattern_name = input_data.pattern_name
+    with instrumentation.report(format=input_data.input_format,
+                                pattern=pattern_name), \
+            instrumentation.stage('pattern'):
         if input_data.input_format == 'table':
-            generator = TableReportGenerator(
-                p_filename=input_data.pattern_name,
-                p_enc=input_data.pattern_enc,
-                d_filename=input_data.data_name[i],
-                d_enc=input_data.data_enc,
-                output_filename=f'{i + 1}_{input_data.output_filename}',
-                default_field_width=input_data.default_field_width
-            )
-            # print(generator.generated_report)
+            from table_pattern_reader import TablePatternReader
+            return TablePatternReader(pattern_name,
+                                      input_data.pattern_enc,
+                                      input_data.default_field_width)
+        from report_generator import ReportGenerator
+        from text_template import compile_template
+        return compile_template(ReportGenerator.read_pattern(
+            pattern_name, input_data.pattern_enc))
+
+
+# Отчет по i-му файлу данных. Функция уровня модуля, чтобы ее можно было
+# запускать в пуле процессов.
+def generate_report(input_data, pattern, i):
+    output_filename = f'{i + 1}_{input_data.output_filename}'
+    with instrumentation.report(format=input_data.input_format,
+                                data=input_data.data_name[i],
+                                output=output_filename):
+        cache = open_cache(input_data)
+        if cache is not None:
+            import report_cache
+            with instrumentation.stage('cache') as stage:
+                key = report_cache.make_key(
+                    input_data.input_format, input_data.pattern_name,
+                    input_data.data_name[i], input_data.pattern_enc,
+                    input_data.data_enc, input_data.default_field_width)
+                messages = cache.get(key, output_filename)
+                stage.rows = int(messages is not None)
+            if messages is not None:
+                sys.stdout.write(messages)
+                return output_filename
+            # Предупреждения о данных сохраняются вместе с отчетом.
+            output = report_cache.Tee(sys.stdout)
+            with redirect_stdout(output):
+                make_generator(input_data, pattern, i, output_filename)
+            cache.put(key, output_filename, output.getvalue())
         else:
-            generator = ReportGenerator(
-                p_filename=input_data.pattern_name,
-                p_enc=input_data.pattern_enc,
-                d_filename=input_data.data_name[i],
-                d_enc=input_data.data_enc,
-                default_field_width=input_data.default_field_width,
-                output_filename=f'{i + 1}_{input_data.output_filename}'
-            )
-            # print(generator.generated_report)
+            make_generator(input_data, pattern, i, output_filename)
+    return output_filename
+
+
+# Без шаблона в файле (передан уже разобранный) ключ не посчитать.
+# Проверка полей печатает сообщения, поэтому отчет всегда генерируется.
+def open_cache(input_data):
+    if (input_data.no_cache or input_data.check_fields
+            or input_data.pattern_name is None):
+        return None
+    import report_cache
+    return report_cache.ReportCache(input_data.cache_dir,
+                                    input_data.cache_size << 20)
+
+
+def make_generator(input_data, pattern, i, output_filename):
+    if input_data.input_format == 'table':
+        from table_report_generator import TableReportGenerator
+        generator = TableReportGenerator(
+            p_filename=input_data.pattern_name,
+            p_enc=input_data.pattern_enc,
+            d_filename=input_data.data_name[i],
+            d_enc=input_data.data_enc,
+            output_filename=output_filename,
+            default_field_width=input_data.default_field_width,
+            pattern=pattern,
+            stream=input_data.stream,
+            engine=input_data.engine,
+            state_filename=state_filename(input_data, i),
+            index_filename=index_filename(input_data, i),
+            column_cache_dir=column_cache_dir(input_data)
+        )
+        # print(generator.generated_report)
+    else:
+        from report_generator import ReportGenerator
+        generator = ReportGenerator(
+            p_filename=input_data.pattern_name,
+            p_enc=input_data.pattern_enc,
+            d_filename=input_data.data_name[i],
+            d_enc=input_data.data_enc,
+            default_field_width=input_data.default_field_width,
+            output_filename=output_filename,
+            template=pattern,
+            check_fields=input_data.check_fields
+        )
+        # print(generator.generated_report)
+    return generator
+
+
+# Состояние инкрементальной группировки лежит рядом с кэшем отчетов.
+def state_filename(input_data, i):
+    if not input_data.incremental:
+        return None
+    import table_state
+    return table_state.state_filename(
+        os.path.join(cache_dir(input_data), 'state'),
+        input_data.data_name[i], input_data.pattern_name)
+
+
+# Индекс для фильтров тоже лежит рядом с кэшем отчетов, один на файл
+# данных для всех шаблонов.
+def index_filename(input_data, i):
+    if not input_data.index:
+        return None
+    import table_index
+    return table_index.index_filename(
+        os.path.join(cache_dir(input_data), 'index'),
+        input_data.data_name[i])
+
+
+# Кэш типизированных колонок файлов данных -- тоже рядом с кэшем отчетов.
+def column_cache_dir(input_data):
+    if not input_data.data_cache:
+        return None
+    return os.path.join(cache_dir(input_data), 'columns')
+
+
+# Каталог кэша: заданный ключом или по умолчанию.
+def cache_dir(input_data):
+    if input_data.cache_dir:
+        return input_data.cache_dir
+    import report_cache
+    return report_cache.default_dir()
+
+
+def job_count(input_data):
+    return input_data.jobs if input_data.jobs > 0 else os.cpu_count()
+
+
+# Один сводный отчет по всем файлам таблиц (без номера в имени файла).
+# Файл с ошибкой пропускается, остальные попадают в отчет.
+def generate_merged_report(input_data, pattern):
+    output_filename = input_data.output_filename
+    with instrumentation.report(format=input_data.input_format,
+                                data=input_data.data_name,
+                                output=output_filename):
+        from table_report_generator import TableReportGenerator
+        TableReportGenerator(
+            p_filename=input_data.pattern_name,
+            p_enc=input_data.pattern_enc,
+            d_filename=input_data.data_name,
+            d_enc=input_data.data_enc,
+            output_filename=output_filename,
+            default_field_width=input_data.default_field_width,
+            pattern=pattern,
+            stream=input_data.stream,
+            engine=input_data.engine,
+            jobs=job_count(input_data)
+        )
+    return output_filename
+
+
+# Отчеты по всем шаблонам для i-го файла таблицы: файл читается и колонки
+# приводятся к типам один раз, шаблоны обрабатываются в jobs процессах.
+# Отчеты из кэша не генерируются; если в кэше все, файл не читается и
+# печатаются сохраненные предупреждения о данных (одинаковые -- один раз).
+# Возвращает список пар (файл данных и шаблон, ошибка).
+def generate_fanout_report(input_data, patterns, i):
+    cache = open_cache(input_data)
+    if cache is not None:
+        import report_cache
+    tasks = []
+    cached_messages = []
+    for j, (pattern_name, pattern) in enumerate(
+            zip(input_data.pattern_names, patterns)):
+        output_filename = f'{i + 1}_{j + 1}_{input_data.output_filename}'
+        key = None
+        if cache is not None:
+            key = report_cache.make_key(
+                input_data.input_format, pattern_name,
+                input_data.data_name[i], input_data.pattern_enc,
+                input_data.data_enc, input_data.default_field_width)
+            messages = cache.get(key, output_filename)
+            if messages is not None:
+                if messages not in cached_messages:
+                    cached_messages.append(messages)
+                continue
+        tasks.append((pattern_name, pattern, output_filename, key))
+    if not tasks:
+        sys.stdout.write(''.join(cached_messages))
+        return []
+    import table_fanout
+    # Вывод копируется, только если его нужно сохранить в кэше.
+    output = sys.stdout if cache is None else report_cache.Tee(sys.stdout)
+    with instrumentation.report(format=input_data.input_format,
+                                data=input_data.data_name[i],
+                                patterns=[task[0] for task in tasks]), \
+            redirect_stdout(output):
+        with instrumentation.stage('read'):
+            data = table_fanout.SharedTableData(input_data.data_name[i],
+                                                input_data.data_enc)
+        # Колонки приводятся и для шаблонов из кэша: сообщения о значениях
+        # печатаются те же, что без кэша, и сохраняются с каждым отчетом.
+        if cache is not None:
+            with instrumentation.stage('type'):
+                data.prepare(patterns)
+        errors = table_fanout.render_patterns(
+            data, [task[1] for task in tasks], [task[2] for task in tasks],
+            job_count(input_data), engine=input_data.engine)
+    failed = []
+    for (pattern_name, _, output_filename, key), err in zip(tasks, errors):
+        if err is not None:
+            failed.append((f'{input_data.data_name[i]} ({pattern_name})',
+                           err))
+        elif key is not None:
+            cache.put(key, output_filename, output.getvalue())
+    return failed
+
+
+def generate_fanout_reports(input_data, patterns):
+    errors = []
+    for i, data_name in enumerate(input_data.data_name):
+        try:
+            errors.extend(generate_fanout_report(input_data, patterns, i))
+        except Exception as err:
+            errors.append((data_name, err))
+    return errors
+
+
+# Ошибка в одном файле не останавливает остальные.
+# Возвращает список пар (файл данных, ошибка).
+def generate_reports(input_data, pattern):
+    indices = range(len(input_data.data_name))
+    jobs = job_count(input_data)
+    errors = []
+    if jobs > 1 and len(indices) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(generate_report, input_data,
+                                       pattern, i) for i in indices]
+            for i, future in zip(indices, futures):
+                try:
+                    future.result()
+                except Exception as err:
+                    errors.append((input_data.data_name[i], err))
+    else:
+        for i in indices:
+            try:
+                generate_report(input_data, pattern, i)
+            except Exception as err:
+                errors.append((input_data.data_name[i], err))
+    return errors
+
+
+def main():
+    input_data = ed.input_data()
+    if input_data.profile is not None:
+        instrumentation.enable(input_data.profile)
+    if input_data.profile_startup:
+        import_timer = instrumentation.ImportTimer()
+        import_timer.install()
+    if len(input_data.pattern_names) > 1:
+        errors = generate_fanout_reports(input_data, [
+            read_pattern(input_data, pattern_name)
+            for pattern_name in input_data.pattern_names])
+    elif input_data.merge and input_data.input_format == 'table':
+        pattern = read_pattern(input_data)
+        errors = []
+        try:
+            generate_merged_report(input_data, pattern)
+        except Exception as err:
+            errors.append((', '.join(input_data.data_name), err))
+    else:
+        errors = generate_reports(input_data, read_pattern(input_data))
+    if input_data.profile_startup:
+        import_timer.uninstall()
+        import_timer.write(sys.stderr)
+    for data_name, err in errors:
+        print(f'Report for "{data_name}" failed: {err!r}')
+    if errors:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
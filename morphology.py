@@ -0,0 +1,65 @@
+from functools import lru_cache
+
+# Сколько пар (слово, форма числа) держим в кэше.
+CACHE_SIZE = 1024
+
+ONE = 'one'
+FEW = 'few'
+MANY = 'many'
+
+_analyzer = None
+
+
+# Один анализатор на процесс: загрузка словарей дорогая. pymorphy2
+# импортируется здесь же, при первом склонении, а не при запуске.
+def get_analyzer():
+    global _analyzer
+    if _analyzer is None:
+        from pymorphy2 import MorphAnalyzer
+        _analyzer = MorphAnalyzer()
+    return _analyzer
+
+
+# Класс числа, от которого зависит согласование: 1 рубль, 2 рубля, 5 рублей.
+# Повторяет правило из OpencorporaTag.numeral_agreement_grammemes.
+def plural_form(number):
+    if number % 10 == 1 and number % 100 != 11:
+        return ONE
+    if 2 <= number % 10 <= 4 and (number % 100 < 10 or number % 100 >= 20):
+        return FEW
+    return MANY
+
+
+# Представитель каждого класса: для слова результат зависит только от класса.
+FORM_NUMBERS = {
+    ONE: 1,
+    FEW: 2,
+    MANY: 5
+}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _agree(word, form):
+    parsed = get_analyzer().parse(word)[0]
+    agreed = parsed.make_agree_with_number(FORM_NUMBERS[form])
+    return agreed.word if agreed is not None else word
+
+
+def agree_with_number(word, number):
+    if word == '':
+        return word
+    return _agree(word, plural_form(number))
+
+
+def cache_info():
+    info = _agree.cache_info()
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'maxsize': info.maxsize
+    }
+
+
+def cache_clear():
+    _agree.cache_clear()
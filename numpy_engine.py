@@ -0,0 +1,239 @@
+from array import array
+from collections import OrderedDict
+import sys
+
+from columnar_table import ColumnarTable, TYPES, TYPECODES, convert_value
+from aggregation import state_factory
+from table_filter import OPERATIONS
+import instrumentation
+
+# numpy импортируется при первом выборе движка: импорт заметно
+# замедляет запуск, а по умолчанию работает чистый Python.
+np = None
+_checked = False
+
+PYTHON = 'python'
+NUMPY = 'numpy'
+ENGINES = (PYTHON, NUMPY)
+
+# Все суммы int-колонок считаются в int64; с запасом от переполнения.
+INT64_LIMIT = 2 ** 62
+
+
+# Случаи, где numpy дал бы результат, отличный от чистого Python
+# (переполнение int64, NaN в min/max, арифметика над строками).
+# Генератор тогда повторяет шаг на Python.
+class Unsupported(Exception):
+    pass
+
+
+def available():
+    global np, _checked
+    if not _checked:
+        _checked = True
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return np is not None
+
+
+# Если numpy не установлен, работает чистый Python.
+def select_engine(name):
+    if name == NUMPY and available():
+        return NUMPY
+    return PYTHON
+
+
+def dtype(_type):
+    return np.int64 if _type == 'int' else np.float64
+
+
+# Колонка ColumnarTable как массив numpy. Числовые колонки -- без копии.
+def column_array(table, name):
+    column = table.column(name)
+    if isinstance(column, array):
+        return np.frombuffer(column, dtype=dtype(table.types[name]))
+    if table.types[name] != 'str':
+        # int-колонка, не влезшая в 64 бита.
+        raise Unsupported(name)
+    return np.asarray(column, dtype=object)
+
+
+def to_column(values, _type):
+    if _type in TYPECODES:
+        return array(TYPECODES[_type], values.tobytes())
+    return [sys.intern(value) for value in values.tolist()]
+
+
+# Приведение колонки строк к типу. Если хоть одно значение не приводится,
+# колонка приводится поэлементно с теми же сообщениями, что и в Python.
+def convert_column(column, _type, raw_columns=None):
+    if _type == 'str':
+        return column
+    try:
+        return column.astype(dtype(_type))
+    except OverflowError:
+        raise Unsupported(_type)
+    except ValueError:
+        pass
+    converter = TYPES[_type]
+    values = np.empty(len(column), dtype(_type))
+    try:
+        for i, value in enumerate(column.tolist()):
+            if raw_columns is not None:
+                line = [raw[i] for raw in raw_columns]
+                values[i] = convert_value(converter, value, line)
+                continue
+            # Без сообщений: колонка нужна только для фильтра.
+            try:
+                values[i] = converter(value)
+            except ValueError:
+                values[i] = converter()
+    except OverflowError:
+        raise Unsupported(_type)
+    return values
+
+
+# Маска строк, удовлетворяющих всем условиям. None -- условий нет.
+def filter_mask(conditions, columns, types):
+    mask = None
+    for cond in conditions or ():
+        if cond.field not in columns:
+            continue
+        value = TYPES[types[cond.field]](cond.value)
+        try:
+            result = np.asarray(OPERATIONS[cond.op](columns[cond.field],
+                                                    value), dtype=bool)
+        except OverflowError:
+            raise Unsupported(cond.field)
+        mask = result if mask is None else mask & result
+    return mask
+
+
+# Чтение таблицы: строки -> колонки строк -> фильтр -> приведение типов.
+def read_table(rows, fieldnames, types, conditions=None):
+    rows = list(rows)
+    raw = OrderedDict(
+        (name, np.asarray(values, dtype=object)) for name, values
+        in zip(fieldnames, zip(*rows) if rows else [()] * len(fieldnames)))
+    del rows
+    with instrumentation.stage('type'):
+        filter_columns = {
+            cond.field: convert_column(raw[cond.field], types[cond.field])
+            for cond in conditions or () if cond.field in raw}
+    mask = filter_mask(conditions, filter_columns, types)
+    if mask is not None:
+        raw = OrderedDict((name, values[mask]) for name, values in raw.items())
+    with instrumentation.stage('type'):
+        columns = OrderedDict(
+            (name, to_column(convert_column(values, types[name],
+                                            list(raw.values())),
+                             types[name]))
+            for name, values in raw.items())
+    return ColumnarTable.from_columns(columns, types)
+
+
+def filter_table(table, conditions):
+    columns = {cond.field: column_array(table, cond.field)
+               for cond in conditions or () if cond.field in table}
+    mask = filter_mask(conditions, columns, table.types)
+    if mask is None:
+        return table
+    return table.take(np.flatnonzero(mask).tolist())
+
+
+# Номера групп в порядке первого появления значения, как у dict.
+def factorize(values):
+    if values.dtype == object or values.dtype == np.float64 and (
+            np.isnan(values).any() or np.signbit(values[values == 0]).any()):
+        # NaN и -0.0 группируются так же, как ключи dict в Python,
+        # а строки через dict быстрее сортировки объектов.
+        index = {}
+        codes = np.fromiter((index.setdefault(value, len(index))
+                             for value in values.tolist()),
+                            dtype=np.int64, count=len(values))
+        return codes, len(index)
+    uniques, first, inverse = np.unique(values, return_index=True,
+                                        return_inverse=True)
+    rank = np.empty(len(uniques), dtype=np.int64)
+    rank[np.argsort(first, kind='stable')] = np.arange(len(uniques))
+    return rank[inverse.reshape(-1)], len(uniques)
+
+
+def group_codes(keys, size):
+    if not keys:
+        return np.zeros(size, dtype=np.int64), 1 if size else 0
+    codes, count = factorize(keys[0])
+    for key in keys[1:]:
+        key_codes, key_count = factorize(key)
+        codes, count = factorize(codes * key_count + key_codes)
+    return codes, count
+
+
+def aggregate_column(func, values, codes, count):
+    if func == 'count':
+        return np.bincount(codes, minlength=count).tolist()
+    if func in ('sum', 'avg'):
+        if values.dtype == object:
+            raise Unsupported(func)
+        if values.dtype == np.int64:
+            if len(values) and int(np.abs(values).max()) * len(values) \
+                    >= INT64_LIMIT:
+                raise Unsupported(func)
+            totals = np.zeros(count, dtype=np.int64)
+            np.add.at(totals, codes, values)
+        else:
+            # bincount складывает по порядку строк, как и Python.
+            totals = np.bincount(codes, weights=values, minlength=count)
+        if func == 'sum':
+            return totals.tolist()
+        counts = np.bincount(codes, minlength=count).tolist()
+        return [round(total / n, 2)
+                for total, n in zip(totals.tolist(), counts)]
+    counts = np.bincount(codes, minlength=count)
+    starts = np.cumsum(counts) - counts
+    if func in ('min', 'max'):
+        if values.dtype == object or (values.dtype == np.float64
+                                      and np.isnan(values).any()):
+            raise Unsupported(func)
+        if values.dtype == np.int64:
+            limits = np.iinfo(np.int64)
+            if func == 'min':
+                reduce, start = np.minimum, limits.max
+            else:
+                reduce, start = np.maximum, limits.min
+            result = np.full(count, start, dtype=np.int64)
+            reduce.at(result, codes, values)
+            return result.tolist()
+        # Устойчивая сортировка: среди равных (0.0 и -0.0) берется первое
+        # значение, как в MinState/MaxState.
+        order = np.lexsort((values if func == 'min' else -values, codes))
+        return values[order[starts]].tolist()
+    # Квантили -- тем же скетчем, в порядке строк.
+    order = np.argsort(codes, kind='stable')
+    ends = (starts + counts).tolist()
+    sorted_values = values[order].tolist()
+    factory = state_factory(func)
+    result = []
+    for start, end in zip(starts.tolist(), ends):
+        state = factory()
+        for value in sorted_values[start:end]:
+            state.add(value)
+        result.append(state.result())
+    return result
+
+
+# Список пар (значения полей группировки, значения агрегатов) в порядке
+# первого появления группы.
+def aggregate(table, fields, aggregates):
+    keys = [column_array(table, field) for field in fields]
+    codes, count = group_codes(keys, len(table))
+    first = np.unique(codes, return_index=True)[1]
+    key_values = [key[first].tolist() for key in keys]
+    columns = [aggregate_column(aggr.func, column_array(table, aggr.column),
+                                codes, count)
+               for aggr in aggregates]
+    keys = zip(*key_values) if key_values else [()] * count
+    return list(zip(keys, zip(*columns)))
@@ -0,0 +1,166 @@
+import functools
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+# Каталог кэша по умолчанию; меняется ключом --cache-dir или переменной
+# окружения.
+ENV_VAR = 'REPORT_GENERATOR_CACHE'
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                           'report_generator')
+# Общий размер отчетов в кэше, после которого удаляются давно не нужные.
+MAX_SIZE = 64 << 20
+# Версия формата записей кэша. Вид отчетов зависит еще и от кода
+# генератора -- он входит в ключ хэшем исходников (code_version).
+VERSION = b'3'
+BLOCK_SIZE = 1 << 16
+SUFFIX = '.report'
+# Модули, от которых зависит вид отчета. Тесты, замеры, сервер и сам кэш
+# в хэш не входят: их правка не должна сбрасывать кэш.
+CODE_MODULES = (
+    'aggregation.py', 'column_cache.py', 'columnar_table.py',
+    'data_reader.py', 'main.py', 'morphology.py', 'numpy_engine.py',
+    'report_generator.py', 'table_data_reader.py', 'table_fanout.py',
+    'table_filter.py', 'table_index.py', 'table_merge.py', 'table_order.py',
+    'table_pattern_reader.py', 'table_report_generator.py',
+    'table_state.py', 'table_tokenizer.py', 'text_template.py',
+)
+
+
+def default_dir():
+    return os.environ.get(ENV_VAR) or DEFAULT_DIR
+
+
+def update_file_hash(digest, filename):
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(BLOCK_SIZE), b''):
+            digest.update(block)
+
+
+# Хэш исходников модулей генератора (считается один раз на процесс):
+# отчеты, сделанные другой версией кода, в кэше не совпадут.
+@functools.lru_cache(maxsize=None)
+def code_version():
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in CODE_MODULES:
+        digest.update(name.encode() + b'\0')
+        update_file_hash(digest, os.path.join(directory, name))
+    return digest.digest()
+
+
+# Ключ -- хэш всего, от чего зависит отчет. Длины перед содержимым, чтобы
+# разные наборы частей не давали одинаковый поток байт.
+def make_key(input_format, p_filename, d_filename, p_enc, d_enc,
+             default_field_width):
+    digest = hashlib.sha256(VERSION)
+    digest.update(code_version())
+    options = '\0'.join([input_format, p_enc, d_enc,
+                         str(default_field_width)]).encode()
+    digest.update(b'%d:' % len(options) + options)
+    for filename in (p_filename, d_filename):
+        digest.update(b'%d:' % os.path.getsize(filename))
+        update_file_hash(digest, filename)
+    return digest.hexdigest()
+
+
+# Печатает как обычно и запоминает напечатанное: предупреждения о данных
+# сохраняются вместе с отчетом и печатаются снова, когда он берется из
+# кэша.
+class Tee:
+    def __init__(self, stream):
+        self.stream = stream
+        self.captured = io.StringIO()
+
+    def write(self, text):
+        self.captured.write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def getvalue(self):
+        return self.captured.getvalue()
+
+
+# Отчеты лежат файлами <ключ>.report: длина сообщений в байтах строкой,
+# сами сообщения (utf-8), потом отчет. Время изменения файла -- время
+# последнего обращения, по нему вытесняются старые записи (LRU).
+class ReportCache:
+    def __init__(self, directory=None, max_size=MAX_SIZE):
+        self.directory = directory or default_dir()
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    # Копирует отчет из кэша и возвращает сообщения, напечатанные при его
+    # генерации. None, если отчета там нет.
+    def get(self, key, output_filename):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                messages = file.read(int(file.readline())).decode()
+                with open(output_filename, 'wb') as output:
+                    shutil.copyfileobj(file, output)
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Запись успел вытеснить другой процесс, копия уже сделана.
+            pass
+        return messages
+
+    # Запись через временный файл: параллельные процессы не увидят
+    # недописанный отчет.
+    def put(self, key, report_filename, messages=''):
+        fd, temp_name = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        messages = messages.encode()
+        try:
+            with open(fd, 'wb') as file, \
+                    open(report_filename, 'rb') as report:
+                file.write(b'%d\n' % len(messages) + messages)
+                shutil.copyfileobj(report, file)
+            os.replace(temp_name, self.path(key))
+        except OSError:
+            os.remove(temp_name)
+            raise
+        self.evict()
+
+    def entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
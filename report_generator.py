@@ -1,7 +1,7 @@
-import re
-
 from data_reader import DataReader
-from pymorphy2 import MorphAnalyzer
+from morphology import agree_with_number
+from text_template import compile_template
+import instrumentation
 
 ALIGN = {
     'c': str.center,
@@ -10,20 +10,26 @@ ALIGN = {
     'с': str.center
 }
 
-FIELD_PATTERN = re.compile(r'''(?P<screen>!!)?
-                             {{(?P<name>[\w\s\-,]+)\|?\s*
-                               (?P<width>\d+)?-?\s*
-                               (?P<align>[rcl])?-?\s*
-                               (?P<unit>\w+[\w\s\-,]*)?}}
-                            ''', re.X)
-
 
 class ReportGenerator:
     def __init__(self, d_filename, p_filename,
                  output_filename='generated_report.txt',
-                 d_enc='utf-8', p_enc='utf-8', default_field_width=20):
-        self.pattern = self.read_pattern(p_filename, p_enc)
-        self.sub_data = DataReader(d_filename, d_enc).fields
+                 d_enc='utf-8', p_enc='utf-8', default_field_width=20,
+                 template=None, check_fields=False):
+        # Уже разобранный шаблон можно передать, чтобы не читать файл снова.
+        if template is None:
+            with instrumentation.stage('pattern'):
+                template = compile_template(self.read_pattern(p_filename,
+                                                              p_enc))
+        self.template = template
+        # Читаются только поля из шаблона. Для проверки полей нужны имена
+        # всех полей данных (значения все равно не декодируются).
+        with instrumentation.stage('read') as stage:
+            names = None if check_fields else template.names
+            self.sub_data = DataReader(d_filename, d_enc, names).fields
+            stage.rows = len(self.sub_data)
+        if check_fields:
+            self.print_field_usage(d_filename)
         self.generated_report = self.make_report(output_filename,
                                                  default_field_width)
 
@@ -32,6 +38,14 @@ class ReportGenerator:
         with open(filename, 'r', encoding=encoding) as file:
             return file.read()
 
+    def print_field_usage(self, d_filename):
+        missing, unused = DataReader.field_usage(self.sub_data,
+                                                 self.template.names)
+        if missing:
+            print(f'{d_filename}: missing fields: {", ".join(missing)}')
+        if unused:
+            print(f'{d_filename}: unused fields: {", ".join(unused)}')
+
     @staticmethod
     def align_value(value, width, align):
         if len(value) >= width:
@@ -43,11 +57,7 @@ class ReportGenerator:
     # Склонение
     @staticmethod
     def declension(value, word):
-        morph = MorphAnalyzer()
-        if word != '':
-            obj_name = morph.parse(word)[0]
-            return obj_name.make_agree_with_number(int(value))[0]
-        return word
+        return agree_with_number(word, int(value))
 
     def format_value(self, value, width, align, unit):
         if value.isdigit():
@@ -61,50 +71,16 @@ class ReportGenerator:
             aligned_value = self.align_value(value, width, align)
         return aligned_value
 
-    @staticmethod
-    def none_check(field, default):
-        return field if field is not None else default
-
-    def initialize_match_fields(self, match):
-        name = match.group('name').upper()
-        align = self.none_check(match.group('align'), 'c')
-        unit = self.none_check(match.group('unit'), '')
-        return name, align, unit
-
     @staticmethod
     def write_report(filename, report):
         with open(filename, 'w', encoding='utf-8') as file:
             file.write(report)
 
     def make_report(self, output_filename, _default_key_len):
-        pattern = self.pattern.split('#')
-        for i in range(len(pattern)):
-            fields = FIELD_PATTERN.finditer(pattern[i])
-            for match in fields:
-                if match.group('screen') is not None:
-                    pattern[i] = pattern[i].replace('!!', '')
-                    continue
-                name, align, unit = self.initialize_match_fields(match)
-                value = self.sub_data.get(name, None)
-                try:
-                    if value is None:
-                        raise ValueError(f'No value for name: '
-                                         f'{match.group("name")}')
-
-                    # only int acceptable
-                    width = int(self.none_check(match.group('width'),
-                                                _default_key_len))
-                except ValueError as err:
-                    print(str(err))
-                else:
-                    format_value = self.format_value(value, width, align, unit)
-                    sub_pattern = re.compile(
-                        fr'''{{{{(?P<name>{match.group('name')})\|?\s*
-                                 (?P<width>{match.group('width')})?-?\s*
-                                 (?P<align>{match.group('align')})?-?\s*
-                                 (?P<unit>{match.group('unit')})?\s*}}}}
-                          ''', re.X)
-                    pattern[i] = sub_pattern.sub(format_value, pattern[i])
-        result = ''.join(pattern)
-        self.write_report(output_filename, result)
+        with instrumentation.stage('render') as stage:
+            result = self.template.render(self.sub_data, _default_key_len,
+                                          self.format_value)
+            stage.rows = len(self.template.names)
+        with instrumentation.stage('write'):
+            self.write_report(output_filename, result)
         return result
@@ -0,0 +1,357 @@
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import signal
+import tempfile
+
+from report_generator import ReportGenerator
+from table_pattern_reader import TablePatternReader
+from table_report_generator import TableReportGenerator
+from text_template import compile_template
+import morphology
+
+HOST = '127.0.0.1'
+FORMATS = ('text', 'table')
+# Самое большое тело запроса (данные можно прислать в нем), байт.
+MAX_BODY = 64 << 20
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error'
+}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Процесс пула загружает словари pymorphy2 один раз, до первого запроса.
+# Если pymorphy2 не загружается, процесс все равно работает: отчетам без
+# склонения он не нужен, остальные получат ошибку при склонении.
+# Ctrl+C останавливает сервер, а пул он закрывает сам.
+def warm_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        morphology.get_analyzer()
+    except Exception as error:
+        print(f'pymorphy2 is not loaded: {error!r}')
+
+
+# Отчет в процессе пула. Сообщения генератора (нет значения для поля,
+# плохая строка данных) возвращаются вместе с отчетом. Без output_filename
+# отчет пишется во временный файл и возвращается текстом.
+def render(input_format, pattern, d_filename, d_enc, width,
+           output_filename=None):
+    temporary = output_filename is None
+    if temporary:
+        fd, output_filename = tempfile.mkstemp(suffix='.txt')
+        os.close(fd)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as messages:
+            if input_format == 'table':
+                TableReportGenerator(
+                    p_filename=None, d_filename=d_filename,
+                    output_filename=output_filename, d_enc=d_enc,
+                    default_field_width=width, pattern=pattern)
+            else:
+                ReportGenerator(d_filename, None, output_filename,
+                                d_enc=d_enc, default_field_width=width,
+                                template=pattern)
+        if not temporary:
+            return None, messages.getvalue()
+        with open(output_filename, 'r', encoding='utf-8', newline='') as file:
+            return file.read(), messages.getvalue()
+    finally:
+        if temporary:
+            os.remove(output_filename)
+
+
+def write_temporary(text, encoding):
+    fd, filename = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w', encoding=encoding, newline='') as file:
+        file.write(text)
+    return filename
+
+
+def field(request, name, kind=str, default=None):
+    value = request.get(name, default)
+    if value is None or not isinstance(value, kind):
+        raise RequestError(400, f'Field "{name}" is required '
+                                f'({kind.__name__})')
+    return value
+
+
+# Запрос HTTP: метод, путь и тело в JSON (пустое тело -- пустой словарь).
+async def read_request(reader):
+    request_line = (await reader.readline()).decode('latin-1').split()
+    if len(request_line) != 3:
+        raise RequestError(400, 'Bad request line')
+    method, path, _ = request_line
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            try:
+                length = int(value)
+            except ValueError:
+                length = -1
+            if length < 0:
+                raise RequestError(400, 'Bad Content-Length')
+    if length > MAX_BODY:
+        raise RequestError(413, f'Body is larger than {MAX_BODY} bytes')
+    body = await reader.readexactly(length) if length else b''
+    try:
+        request = json.loads(body) if body else {}
+    except ValueError as error:
+        raise RequestError(400, f'Bad JSON: {error}')
+    if not isinstance(request, dict):
+        raise RequestError(400, 'Body must be a JSON object')
+    return method.upper(), path.split('?')[0], request
+
+
+# Резидентный генератор отчетов. Шаблоны разбираются один раз и хранятся по
+# id; отчеты генерируются в пуле процессов, в которых анализатор pymorphy2
+# уже загружен. Протокол -- HTTP с JSON:
+#   POST /patterns {"id", "format", "path" или "text", "encoding", "width"}
+#   GET  /patterns
+#   POST /render   {"pattern", "data" (путь) или "inline" (текст данных),
+#                   "encoding", "output" (путь; без него отчет в ответе)}
+# root -- каталог, в котором лежат все файлы из запросов: пути считаются
+# от него, пути за его пределами (в том числе через ссылки) запрещены.
+# Без root сервер читает и пишет любые файлы, доступные его процессу.
+class TemplateServer:
+    def __init__(self, jobs=None, default_field_width=20, root=None):
+        self.default_field_width = default_field_width
+        self.root = os.path.realpath(root) if root is not None else None
+        self.patterns = {}
+        # Процессы пула запускаются заново (spawn), а не копией сервера:
+        # при fork они унаследовали бы открытые соединения, и клиент не
+        # дождался бы их закрытия.
+        self.executor = ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context('spawn'),
+            initializer=warm_worker)
+        self.routes = {
+            ('POST', '/patterns'): self.post_pattern,
+            ('GET', '/patterns'): self.get_patterns,
+            ('POST', '/render'): self.post_render
+        }
+
+    def add_pattern(self, pattern_id, input_format, filename=None,
+                    text=None, encoding='utf-8', width=None):
+        self.patterns[pattern_id] = self.load_pattern(
+            input_format, filename, text, encoding, width)
+
+    # Чтение и разбор шаблона: (формат, шаблон, ширина поля).
+    def load_pattern(self, input_format, filename=None, text=None,
+                     encoding='utf-8', width=None):
+        if input_format not in FORMATS:
+            raise RequestError(400, f'Unknown format "{input_format}"')
+        if (filename is None) == (text is None):
+            raise RequestError(400, 'Either "path" or "text" is required')
+        width = width if width is not None else self.default_field_width
+        if input_format == 'text':
+            if text is None:
+                text = ReportGenerator.read_pattern(filename, encoding)
+            pattern = compile_template(text)
+        elif text is None:
+            pattern = TablePatternReader(filename, encoding, width)
+        else:
+            filename = write_temporary(text, encoding)
+            try:
+                pattern = TablePatternReader(filename, encoding, width)
+            finally:
+                os.remove(filename)
+        return input_format, pattern, width
+
+    # Путь к файлу из запроса.
+    def resolve_path(self, path):
+        if path is None or self.root is None:
+            return path
+        resolved = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([self.root, resolved]) != self.root:
+            raise RequestError(403, f'Path "{path}" is outside of the root')
+        return resolved
+
+    # Шаблон читается и разбирается в потоке, чтобы не задерживать другие
+    # запросы; в словарь он попадает уже в цикле событий.
+    async def post_pattern(self, request):
+        pattern_id = field(request, 'id')
+        filename = self.resolve_path(request.get('path'))
+        try:
+            self.patterns[pattern_id] = await asyncio.get_running_loop(
+            ).run_in_executor(None, self.load_pattern,
+                              field(request, 'format'), filename,
+                              request.get('text'),
+                              field(request, 'encoding', default='utf-8'),
+                              request.get('width'))
+        except OSError as error:
+            raise RequestError(404, str(error))
+        return {'id': pattern_id}
+
+    async def get_patterns(self, request):
+        return {'patterns': sorted(self.patterns)}
+
+    async def post_render(self, request):
+        pattern_id = field(request, 'pattern')
+        if pattern_id not in self.patterns:
+            raise RequestError(404, f'Unknown pattern "{pattern_id}"')
+        input_format, pattern, width = self.patterns[pattern_id]
+        encoding = field(request, 'encoding', default='utf-8')
+        output_filename = self.resolve_path(request.get('output'))
+        inline = request.get('inline')
+        if inline is not None:
+            d_filename = write_temporary(field(request, 'inline'), encoding)
+        else:
+            d_filename = self.resolve_path(field(request, 'data'))
+            if not os.path.exists(d_filename):
+                raise RequestError(404, f'No data file "{d_filename}"')
+        try:
+            report, messages = await asyncio.get_running_loop(
+            ).run_in_executor(self.executor, render, input_format, pattern,
+                              d_filename, encoding, width, output_filename)
+        finally:
+            if inline is not None:
+                os.remove(d_filename)
+        if report is None:
+            return {'output': output_filename, 'messages': messages}
+        return {'report': report, 'messages': messages}
+
+    async def respond(self, reader):
+        try:
+            method, path, request = await read_request(reader)
+            route = self.routes.get((method, path))
+            if route is None:
+                raise RequestError(404, f'No route {method} {path}')
+            return 200, await route(request)
+        except RequestError as error:
+            return error.status, {'error': str(error)}
+        except Exception as error:
+            return 500, {'error': repr(error)}
+
+    # Одно соединение -- один запрос.
+    async def handle(self, reader, writer):
+        status, response = await self.respond(reader)
+        body = json.dumps(response, ensure_ascii=False).encode()
+        writer.write(f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+                     f'Content-Type: application/json; charset=utf-8\r\n'
+                     f'Content-Length: {len(body)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode() + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, socket_path=None, port=0):
+        if socket_path is not None:
+            return await asyncio.start_unix_server(self.handle,
+                                                   path=socket_path)
+        return await asyncio.start_server(self.handle, HOST, port)
+
+    async def serve(self, socket_path=None, port=0):
+        server = await self.start(socket_path, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def create_argument_parser():
+    parser = argparse.ArgumentParser(
+        prog='ReportsServer',
+        description='Resident report generator serving HTTP requests on a '
+                    'Unix socket or a localhost port',
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument(
+        '--socket',
+        metavar='PATH',
+        type=str,
+        help='Unix socket to listen on'
+    )
+    address.add_argument(
+        '--port',
+        metavar='PORT',
+        type=int,
+        help=f'TCP port on {HOST} to listen on (requires --root)'
+    )
+    parser.add_argument(
+        '--root',
+        metavar='DIR',
+        type=str,
+        help='Directory with all files named in requests: paths are\n'
+             'relative to it, paths outside of it are refused.\n'
+             'Without it any file of the server user can be read and\n'
+             'written.'
+    )
+    parser.add_argument(
+        '--pattern', '-p',
+        metavar=('ID', 'FORMAT', 'PATH'),
+        nargs=3,
+        action='append',
+        default=[],
+        help='Pattern parsed at startup. FORMAT is "text" or "table".\n'
+             'Can be repeated.'
+    )
+    parser.add_argument(
+        '--pattern_encoding', '-pe',
+        metavar='PATTERN_ENCODING',
+        type=str,
+        default='utf-8'
+    )
+    parser.add_argument(
+        '--default-field-width', '-l',
+        metavar='WIDTH',
+        type=int,
+        default=20
+    )
+    parser.add_argument(
+        '--jobs', '-j',
+        metavar='JOBS',
+        type=int,
+        help='Number of worker processes. Default is the number of cores.',
+        default=0
+    )
+    return parser
+
+
+def main():
+    parser = create_argument_parser()
+    namespace = parser.parse_args()
+    # К порту может подключиться любой локальный пользователь, к сокету --
+    # только тот, кому это разрешают права на файл сокета.
+    if namespace.port is not None and namespace.root is None:
+        parser.error('--port requires --root')
+    if namespace.jobs < 0:
+        parser.error('--jobs must not be negative')
+    server = TemplateServer(namespace.jobs or None,
+                            namespace.default_field_width, namespace.root)
+    try:
+        for pattern_id, input_format, filename in namespace.pattern:
+            server.add_pattern(pattern_id, input_format, filename,
+                               encoding=namespace.pattern_encoding)
+        asyncio.run(server.serve(namespace.socket, namespace.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if namespace.socket is not None and os.path.exists(namespace.socket):
+            os.remove(namespace.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,183 @@
-from collections import OrderedDict
+import io
+import sys
+from itertools import islice
+
+from columnar_table import ColumnarTable, TYPES, convert_value
+from table_filter import compile_filter
+from table_tokenizer import TableTokenizer, ROW_DELIMITER, FIELD_DELIMITER
+import numpy_engine
+import instrumentation
+
+# Размер блока, которым читается файл в потоковом режиме.
+CHUNK_SIZE = 1 << 16
+# Сколько строк приводится к типам за раз.
+CONVERT_BATCH = 1024
 
 
 class TableDataReader:
-    def __init__(self, filename='table_data.txt', encoding='utf-8'):
-        self.table = self.__read_table(filename, encoding)
+    # types -- типы колонок ({имя: 'int' | 'float' | 'str'}), значения
+    # приводятся к ним при чтении. По умолчанию все колонки строковые.
+    # conditions -- условия фильтрации (FilterUnit): строки, которые им
+    # не удовлетворяют, отбрасываются до приведения остальных колонок.
+    # engine='numpy' -- приведение и фильтрация целыми колонками (только
+    # не в потоковом режиме).
+    # index_filename -- индекс файла для фильтров (table_index): строки,
+    # прошедшие условия, читаются по смещениям без полного прохода.
+    # column_cache_dir -- каталог кэша типизированных колонок
+    # (column_cache, только не в потоковом режиме): повторный запуск
+    # отображает кэш в память вместо разбора файла.
+    def __init__(self, filename='table_data.txt', encoding='utf-8',
+                 stream=False, chunk_size=CHUNK_SIZE, types=None,
+                 conditions=None, engine=numpy_engine.PYTHON,
+                 index_filename=None, column_cache_dir=None):
+        self.filename = filename
+        self.fieldnames = self.read_header(filename, encoding)
+        types = types if types is not None else {}
+        self.types = {name: types.get(name, 'str') for name in self.fieldnames}
+        self.converters = [TYPES[self.types[name]] for name in self.fieldnames]
+        self.conditions = conditions
+        self.row_filter = compile_filter(conditions, self.fieldnames,
+                                         self.types, raw=True)
+        self.engine = numpy_engine.select_engine(engine)
+        # Сколько записей пропущено из-за ошибок (сообщения уже напечатаны).
+        self.errors = 0
+        self.index_filename = index_filename
+        self.cache_filename = None
+        if column_cache_dir is not None and not stream:
+            import column_cache
+            self.cache_filename = column_cache.cache_filename(
+                column_cache_dir, filename, encoding, self.types)
+        # В потоковом режиме table -- итератор по строкам (кортежам значений),
+        # файл не читается целиком.
+        if stream:
+            self.table = self.iter_table(filename, encoding, chunk_size)
+        else:
+            self.table = self.__read_table(filename, encoding, chunk_size)
 
+    # Записи разделены '#', переводы строк внутри записи сохраняются,
+    # значения могут быть в кавычках или с экранированными '#' и ','
+    # (table_tokenizer). Без проверки числа значений.
     @staticmethod
-    def validate_table(table, fieldnames):
-        for i in range(len(table)):
-            if len(fieldnames) < len(table[i]):
-                raise ValueError(f'TableDataError: no column name '
-                                 f'in row !{i}!')
-            elif len(fieldnames) > len(table[i]):
-                raise ValueError(f'TableDataError: no column value '
-                                 f'in row !{i}!')
-            else:
-                pass
+    def iter_records(fin, chunk_size=CHUNK_SIZE):
+        return TableTokenizer().records(fin, chunk_size)
+
+    # Запись с ошибкой сообщается и пропускается, остальные читаются.
+    def report_error(self, message):
+        self.errors += 1
+        print(f'{self.filename}: {message}')
+
+    def tokenizer(self, line=2):
+        return TableTokenizer(len(self.fieldnames), line, self.report_error)
 
     @staticmethod
-    def __convert_file(fin):
-        split_text = (line for line in fin.read().split('#'))
-        # got rid of extra space symbols and ''
-        text_lines = filter(None, (map(str.strip, split_text)))
-        res_lines = (line.split(',') for line in text_lines)
-        return list(res_lines)
-
-    def __read_table(self, filename, encoding):
+    def read_fieldnames(fin):
+        return fin.readline().rstrip().upper().split(FIELD_DELIMITER)
+
+    def read_header(self, filename, encoding):
         with open(filename, 'r', encoding=encoding, newline='') as fin:
-            try:
-                fieldnames = fin.readline().rstrip().upper().split(',')
-                lines = self.__convert_file(fin)
+            return self.read_fieldnames(fin)
+
+    def convert_row(self, line):
+        return [convert_value(converter, value, line)
+                for converter, value in zip(self.converters, line)]
+
+    # Строки приводятся к типам пачками: в замерах разбор файла и
+    # приведение -- отдельные этапы.
+    def convert_rows(self, lines):
+        lines = iter(lines)
+        while True:
+            batch = list(islice(lines, CONVERT_BATCH))
+            if not batch:
+                return
+            with instrumentation.stage('type'):
+                batch = [self.convert_row(line) for line in batch]
+            yield from batch
 
-                # Handling excessive fields
-                self.validate_table(lines, fieldnames)
+    # Строки файла без приведения типов. С индексом -- только строки,
+    # прошедшие условия (если по индексу можно ответить).
+    def iter_rows(self, filename, encoding, chunk_size=CHUNK_SIZE):
+        if self.index_filename is not None and self.conditions:
+            import table_index
+            lines = table_index.indexed_rows(
+                self.index_filename, filename, encoding, self.fieldnames,
+                self.types, self.conditions)
+            if lines is not None:
+                yield from lines
+                return
+        yield from self.iter_file_rows(filename, encoding, chunk_size)
+
+    def iter_file_rows(self, filename, encoding, chunk_size=CHUNK_SIZE):
+        with open(filename, 'r', encoding=encoding, newline='') as fin:
+            self.read_fieldnames(fin)
+            yield from self.tokenizer().records(fin, chunk_size)
+
+    def iter_table(self, filename, encoding, chunk_size=CHUNK_SIZE):
+        lines = self.iter_rows(filename, encoding, chunk_size)
+        if self.row_filter is not None:
+            lines = filter(self.row_filter, lines)
+        yield from self.convert_rows(lines)
+
+    # Записи из куска текста без заголовка (например, дописанного хвоста
+    # файла): номера строк в сообщениях неизвестны.
+    def iter_text_table(self, text):
+        lines = self.tokenizer(None).records(io.StringIO(text))
+        if self.row_filter is not None:
+            lines = filter(self.row_filter, lines)
+        yield from self.convert_rows(lines)
+
+    # Все строки файла, приведенные к типам, берутся из кэша колонок или
+    # читаются и сохраняются в него. Условия проверяются уже по
+    # типизированной таблице.
+    def read_cached_table(self, filename, encoding, chunk_size):
+        import column_cache
+        table = column_cache.load(self.cache_filename, filename, self.types)
+        if table is None:
+            from contextlib import redirect_stdout
+            from report_cache import Tee
+            signature = column_cache.file_signature(filename)
+            rows = self.convert_rows(
+                self.iter_file_rows(filename, encoding, chunk_size))
+            # Сообщения о неудачном приведении значений сохраняются в кэше.
+            output = Tee(sys.stdout)
+            with redirect_stdout(output):
+                table = ColumnarTable.from_rows(self.fieldnames, self.types,
+                                                rows)
+            # Файл с ошибками не кэшируется: сообщения о них нужны и дальше.
+            if not self.errors:
+                column_cache.save(self.cache_filename, filename, table,
+                                  signature, output.getvalue())
+        return self.filter_table(table)
+
+    def filter_table(self, table):
+        if self.engine == numpy_engine.NUMPY:
+            try:
+                return numpy_engine.filter_table(table, self.conditions)
+            except numpy_engine.Unsupported:
+                pass
+        # Строки для условий -- только из колонок условий.
+        names = list(dict.fromkeys(cond.field for cond in self.conditions or ()
+                                   if cond.field in self.fieldnames))
+        predicate = compile_filter(self.conditions, names, self.types)
+        if predicate is None:
+            return table
+        lines = zip(*[table.column(name) for name in names])
+        return table.take([i for i, line in enumerate(lines)
+                           if predicate(line)])
 
-                res = [OrderedDict(zip(fieldnames, line)) for line in lines]
-                return res
-            except ValueError as error:
-                print(error)
-                return None
+    def __read_table(self, filename, encoding, chunk_size):
+        try:
+            if self.cache_filename is not None:
+                return self.read_cached_table(filename, encoding, chunk_size)
+            if self.engine == numpy_engine.NUMPY:
+                try:
+                    return numpy_engine.read_table(
+                        self.iter_rows(filename, encoding, chunk_size),
+                        self.fieldnames, self.types, self.conditions)
+                except numpy_engine.Unsupported:
+                    pass
+            return ColumnarTable.from_rows(
+                self.fieldnames, self.types,
+                self.iter_table(filename, encoding, chunk_size))
+        except ValueError as error:
+            print(error)
+            return None
@@ -0,0 +1,124 @@
+from array import array
+from collections import OrderedDict
+import multiprocessing
+
+from table_data_reader import TableDataReader
+from columnar_table import ColumnarTable, TYPES, TYPECODES, convert_value
+import instrumentation
+
+# Общие данные для процессов пула. Процессы запускаются копией (fork)
+# после приведения колонок, поэтому данные им не передаются через pickle.
+_data = None
+
+
+# Файл таблицы для нескольких шаблонов: строки читаются один раз, каждая
+# колонка приводится к типу один раз -- для всех шаблонов, которым она
+# нужна с этим типом. Таблицы шаблонов ссылаются на общие колонки.
+# raw -- None, если файл не удалось прочитать (ошибка уже напечатана).
+class SharedTableData:
+    def __init__(self, filename, encoding='utf-8'):
+        # Потоковый читатель без типов и условий: файл читается ниже.
+        reader = TableDataReader(filename, encoding, stream=True)
+        self.fieldnames = reader.fieldnames
+        try:
+            rows = list(reader.iter_rows(filename, encoding))
+        except ValueError as error:
+            print(error)
+            self.raw = None
+        else:
+            self.raw = OrderedDict(zip(self.fieldnames, (
+                list(values) for values in zip(*rows)) if rows
+                else ([] for _ in self.fieldnames)))
+        self.typed = {}
+
+    # Исходная строка -- для сообщения о неудачном приведении.
+    def line(self, i):
+        return [column[i] for column in self.raw.values()]
+
+    def column(self, name, _type):
+        key = (name, _type)
+        values = self.typed.get(key)
+        if values is None:
+            values = self.typed[key] = self.convert_column(name, _type)
+        return values
+
+    def convert_column(self, name, _type):
+        raw = self.raw[name]
+        if _type == 'str':
+            return raw
+        converter = TYPES[_type]
+        try:
+            values = list(map(converter, raw))
+        except ValueError:
+            values = [convert_value(converter, value, self.line(i))
+                      for i, value in enumerate(raw)]
+        try:
+            return array(TYPECODES[_type], values)
+        except OverflowError:
+            return values
+
+    # Данные для TableReportGenerator (как у TableDataReader): колонки
+    # шаблона -- его типов, остальные -- строки. Фильтр -- у генератора.
+    def reader(self, types):
+        return SharedTableReader(self, types)
+
+    # Колонки всех шаблонов приводятся заранее, до запуска процессов.
+    def prepare(self, patterns):
+        for pattern in patterns:
+            self.reader({name: column.type
+                         for name, column in pattern.columns.items()})
+
+
+class SharedTableReader:
+    def __init__(self, data, types):
+        self.fieldnames = data.fieldnames
+        self.types = {name: types.get(name, 'str')
+                      for name in self.fieldnames}
+        if data.raw is None:
+            self.table = None
+        else:
+            self.table = ColumnarTable.from_columns(OrderedDict(
+                (name, data.column(name, _type))
+                for name, _type in self.types.items()), self.types)
+
+
+# Замеры каждого шаблона -- отдельной записью (и в процессах пула).
+def render_pattern(pattern, output_filename, options):
+    from table_report_generator import TableReportGenerator
+    with instrumentation.report(format='table', output=output_filename):
+        TableReportGenerator(p_filename=None, d_filename=None,
+                             output_filename=output_filename,
+                             pattern=pattern, data=_data, **options)
+
+
+# Отчеты по шаблонам patterns из одних данных. С jobs > 1 шаблоны
+# обрабатываются параллельно в процессах-копиях (где есть fork), иначе по
+# очереди. Возвращает ошибку (или None) для каждого шаблона.
+def render_patterns(data, patterns, output_filenames, jobs=1, **options):
+    global _data
+    with instrumentation.stage('type'):
+        data.prepare(patterns)
+    _data = data
+    tasks = list(zip(patterns, output_filenames))
+    try:
+        if jobs > 1 and len(tasks) > 1 and \
+                'fork' in multiprocessing.get_all_start_methods():
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(
+                    max_workers=jobs,
+                    mp_context=multiprocessing.get_context('fork')) \
+                    as executor:
+                futures = [executor.submit(render_pattern, pattern,
+                                           output_filename, options)
+                           for pattern, output_filename in tasks]
+                return [future.exception() for future in futures]
+        errors = []
+        for pattern, output_filename in tasks:
+            try:
+                render_pattern(pattern, output_filename, options)
+                errors.append(None)
+            except Exception as error:
+                errors.append(error)
+        return errors
+    finally:
+        _data = None
@@ -0,0 +1,58 @@
+from functools import reduce
+import operator
+
+from columnar_table import TYPES
+
+OPERATIONS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le
+}
+
+
+# Приведение без сообщений: для фильтра по сырой строке. Сообщение о
+# неудачном приведении напечатается потом, если строка пройдет фильтр.
+def quiet_converter(converter):
+    def convert(value):
+        try:
+            return converter(value)
+        except ValueError:
+            return converter()
+    return convert
+
+
+# Проверка одного условия: номер колонки, операция и значение, уже
+# приведенное к типу колонки, считаются один раз.
+def condition_check(op, index, value, convert=None):
+    if convert is None:
+        return lambda line: op(line[index], value)
+    return lambda line: op(convert(line[index]), value)
+
+
+# Условия через and: следующее проверяется, только если прошли прежние.
+def both(first, second):
+    return lambda line: first(line) and second(line)
+
+
+# Все условия собираются в одну функцию от строки (списка значений).
+# Условия на колонки, которых нет в fieldnames, пропускаются.
+# raw=True -- значения строки еще не приведены к типам: приводятся только
+# колонки из условий.
+def compile_filter(conditions, fieldnames, types, raw=False):
+    fieldnames = list(fieldnames)
+    checks = []
+    for cond in conditions or ():
+        if cond.field not in fieldnames:
+            continue
+        converter = TYPES[types[cond.field]]
+        convert = (quiet_converter(converter)
+                   if raw and converter is not str else None)
+        checks.append(condition_check(OPERATIONS[cond.op],
+                                      fieldnames.index(cond.field),
+                                      converter(cond.value), convert))
+    if not checks:
+        return None
+    return reduce(both, checks)
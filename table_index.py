@@ -0,0 +1,203 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import hashlib
+import mmap
+import os
+import pickle
+import re
+import tempfile
+
+from columnar_table import TYPES, TYPECODES
+from table_filter import quiet_converter
+
+# Меняется вместе с форматом файла индекса: старые файлы не подойдут.
+VERSION = 2
+# Сколько байт в начале и в конце файла данных входит в хэш подписи.
+WINDOW = 1 << 16
+SUFFIX = '.index'
+RECORD_PATTERN = re.compile(rb'[^#]+')
+
+
+def index_filename(directory, d_filename):
+    name = os.path.abspath(d_filename).encode()
+    return os.path.join(directory, hashlib.sha256(name).hexdigest() + SUFFIX)
+
+
+# Размер, время изменения и хэш начала и конца файла: если что-то из этого
+# другое, индекс строится заново.
+def file_signature(fin):
+    stat = os.fstat(fin.fileno())
+    digest = hashlib.sha256()
+    fin.seek(0)
+    digest.update(fin.read(WINDOW))
+    fin.seek(max(stat.st_size - WINDOW, 0))
+    digest.update(fin.read(WINDOW))
+    return stat.st_size, stat.st_mtime_ns, digest.hexdigest()
+
+
+# Разделители ищутся в байтах, поэтому они должны кодироваться одним
+# байтом ASCII (utf-8, cp1251, но не utf-16).
+def supports(encoding):
+    try:
+        return all(char.encode(encoding) == char.encode()
+                   for char in '#,\n')
+    except LookupError:
+        return False
+
+
+def new_column(_type):
+    typecode = TYPECODES.get(_type)
+    return array(typecode) if typecode is not None else []
+
+
+# Индекс файла таблицы для фильтров: для каждой колонки (и типа, к которому
+# ее приводит шаблон) -- значения по возрастанию и байтовые смещения
+# записей с этими значениями. Колонки добавляются, когда их впервые
+# используют в фильтре.
+# valid -- все записи файла правильные (число значений = числу колонок).
+# Иначе индекс не используется: ошибку должен найти полный проход.
+class TableIndex:
+    def __init__(self, signature, header_end, valid=True, columns=None):
+        self.signature = signature
+        self.header_end = header_end
+        self.valid = valid
+        self.columns = columns if columns is not None else {}
+
+    @staticmethod
+    def load(filename):
+        try:
+            with open(filename, 'rb') as file:
+                version, index = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as error:
+            print(f'Broken index file "{filename}" is ignored: {error!r}')
+            return None
+        return index if version == VERSION else None
+
+    def save(self, filename):
+        directory = os.path.dirname(filename) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump((VERSION, self), file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_name, filename)
+        except BaseException:
+            os.remove(temp_name)
+            raise
+
+    # Один проход по записям файла: значения колонок keys ((имя, тип))
+    # приводятся к типам без сообщений, как в фильтре по сырой строке.
+    def add_columns(self, buffer, encoding, fieldnames, keys):
+        # Кавычки и экранирование разбирает только полный проход.
+        if buffer.find(b'"', self.header_end) != -1 or \
+                buffer.find(b'\\', self.header_end) != -1:
+            self.valid = False
+            return
+        indices = [fieldnames.index(name) for name, _ in keys]
+        converters = [quiet_converter(TYPES[_type]) if _type != 'str'
+                      else None for _, _type in keys]
+        values = [[] for _ in keys]
+        offsets = array('q')
+        for match in RECORD_PATTERN.finditer(buffer, self.header_end):
+            line = buffer[match.start():match.end()].decode(encoding).strip()
+            if not line:
+                continue
+            line = line.split(',')
+            if len(line) != len(fieldnames):
+                self.valid = False
+                return
+            offsets.append(match.start())
+            for column, i, converter in zip(values, indices, converters):
+                column.append(line[i] if converter is None
+                              else converter(line[i]))
+        for key, column in zip(keys, values):
+            # NaN не сравнивается, по такой колонке индекс не ищет.
+            if any(value != value for value in column):
+                self.columns[key] = None
+                continue
+            order = sorted(range(len(column)), key=column.__getitem__)
+            sorted_values = new_column(key[1])
+            try:
+                sorted_values.extend(column[i] for i in order)
+            except OverflowError:
+                sorted_values = [column[i] for i in order]
+            self.columns[key] = (sorted_values,
+                                 array('q', (offsets[i] for i in order)))
+
+    # Смещения записей, для которых op(значение, value) истинно.
+    def select(self, key, op, value):
+        values, offsets = self.columns[key]
+        if op == '=':
+            return offsets[bisect_left(values, value):
+                           bisect_right(values, value)]
+        if op == '!=':
+            return (offsets[:bisect_left(values, value)]
+                    + offsets[bisect_right(values, value):])
+        if op == '<':
+            return offsets[:bisect_left(values, value)]
+        if op == '<=':
+            return offsets[:bisect_right(values, value)]
+        if op == '>':
+            return offsets[bisect_right(values, value):]
+        return offsets[bisect_left(values, value):]
+
+    # Смещения записей по возрастанию, которые проходят все условия.
+    # None -- по индексу ответить нельзя.
+    def find(self, conditions, types):
+        if not self.valid:
+            return None
+        result = None
+        for cond in conditions:
+            key = (cond.field, types[cond.field])
+            if self.columns.get(key) is None:
+                return None
+            value = TYPES[key[1]](cond.value)
+            if value != value:
+                return None
+            offsets = set(self.select(key, cond.op, value))
+            result = offsets if result is None else result & offsets
+        return sorted(result)
+
+
+# Записи файла (списки строк), прошедшие условия, найденные по индексу.
+# Индекс берется из index_filename; если его нет, он устарел или в нем нет
+# нужных колонок, он достраивается одним проходом и сохраняется.
+# None -- индекс использовать нельзя (кодировка, ошибки в записях).
+def indexed_rows(index_filename, d_filename, encoding, fieldnames, types,
+                 conditions):
+    conditions = [cond for cond in conditions if cond.field in fieldnames]
+    if not conditions or not supports(encoding):
+        return None
+    with open(d_filename, 'rb') as fin:
+        signature = file_signature(fin)
+        try:
+            buffer = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Пустой файл.
+            return None
+    index = TableIndex.load(index_filename)
+    if index is None or index.signature != signature:
+        with open(d_filename, 'r', encoding=encoding, newline='') as fin:
+            header_end = len(fin.readline().encode(encoding))
+        index = TableIndex(signature, header_end)
+    keys = list(dict.fromkeys(
+        (cond.field, types[cond.field]) for cond in conditions
+        if (cond.field, types[cond.field]) not in index.columns))
+    if keys and index.valid:
+        index.add_columns(buffer, encoding, list(fieldnames), keys)
+        index.save(index_filename)
+    offsets = index.find(conditions, types)
+    if offsets is None:
+        buffer.close()
+        return None
+    return read_records(buffer, encoding, offsets)
+
+
+def read_records(buffer, encoding, offsets):
+    with buffer:
+        for offset in offsets:
+            end = buffer.find(b'#', offset)
+            yield buffer[offset:end if end != -1 else len(buffer)].decode(
+                encoding).strip().split(',')
@@ -0,0 +1,80 @@
+from functools import partial
+
+from table_data_reader import TableDataReader
+from columnar_table import ColumnarTable
+from aggregation import GroupAggregator
+
+
+# Строки файла в порядке колонок names. Колонки в файлах могут идти в
+# разном порядке, поэтому они ищутся по имени.
+def project_rows(data, names):
+    missing = [name for name in names if name not in data.fieldnames]
+    if missing:
+        raise ValueError(f'TableDataError: no columns {", ".join(missing)}')
+    indices = [data.fieldnames.index(name) for name in names]
+    return (tuple(line[i] for i in indices) for line in data.table)
+
+
+# Частичная группировка одного файла. Функция уровня модуля, чтобы ее
+# можно было запускать в пуле процессов. Ошибка в файле печатается,
+# файл пропускается (None).
+def aggregate_file(d_filename, d_enc, types, conditions, fields, aggregates):
+    try:
+        data = TableDataReader(d_filename, d_enc, stream=True, types=types,
+                               conditions=conditions)
+        rows = project_rows(data, tuple(fields) + tuple(
+            aggr.column for aggr in aggregates))
+        return GroupAggregator([aggr.func for aggr in aggregates]).consume(
+            rows, len(fields))
+    except (OSError, ValueError) as error:
+        print(f'{d_filename}: {error}')
+        return None
+
+
+# Состояния групп по всем файлам. Файлы считаются параллельно, состояния
+# сливаются по порядку файлов: группы идут в порядке первого появления,
+# как если бы файлы были склеены. В памяти -- состояния групп, не строки.
+def aggregate_files(d_filenames, d_enc, types, conditions, fields,
+                    aggregates, jobs=1):
+    task = partial(aggregate_file, d_enc=d_enc, types=types,
+                   conditions=conditions, fields=fields,
+                   aggregates=aggregates)
+    result = GroupAggregator([aggr.func for aggr in aggregates])
+    if jobs > 1 and len(d_filenames) > 1:
+        # Импорт пула заметен при запуске, нужен он не всегда.
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            partials = executor.map(task, d_filenames)
+            for aggregator in partials:
+                if aggregator is not None:
+                    result.merge(aggregator)
+    else:
+        for d_filename in d_filenames:
+            aggregator = task(d_filename)
+            if aggregator is not None:
+                result.merge(aggregator)
+    return result
+
+
+# Строки всех файлов подряд (без группировки), в порядке колонок names.
+# Без names колонки берутся у первого файла, который удалось открыть.
+# Файл с ошибкой пропускается целиком, как и при группировке.
+# None -- ни один файл не прочитан.
+def read_files(d_filenames, d_enc, types, conditions, names=None):
+    table = None
+    for d_filename in d_filenames:
+        try:
+            data = TableDataReader(d_filename, d_enc, stream=True,
+                                   types=types, conditions=conditions)
+            if names is None:
+                names = data.fieldnames
+            part = ColumnarTable.from_rows(names, types,
+                                           project_rows(data, names))
+        except (OSError, ValueError) as error:
+            print(f'{d_filename}: {error}')
+            continue
+        if table is None:
+            table = part
+        else:
+            table.extend(part.rows())
+    return table
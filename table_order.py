@@ -0,0 +1,101 @@
+from heapq import merge, nsmallest
+from itertools import islice
+from operator import itemgetter
+import pickle
+import tempfile
+
+# Сколько строк сортируется в памяти. Больше -- строки сортируются
+# кусками такого размера, куски пишутся во временные файлы и сливаются.
+RUN_SIZE = 1 << 17
+# Строки пишутся в файл куска пачками: так быстрее, чем по одной.
+BATCH_SIZE = 1024
+
+
+# Обратный порядок для значений, которые нельзя сделать отрицательными
+# (строки).
+class Descending:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+# Ключ сортировки строки-кортежа по условиям order (OrderUnit). Числа по
+# убыванию сортируются как отрицательные, строки -- через Descending.
+def order_key(fieldnames, types, order):
+    indices = [fieldnames.index(unit.field) for unit in order]
+    if not any(unit.descending for unit in order):
+        return itemgetter(*indices)
+    keys = []
+    for i, unit in zip(indices, order):
+        if not unit.descending:
+            keys.append(itemgetter(i))
+        elif types.get(unit.field) in ('int', 'float'):
+            keys.append(lambda line, i=i: -line[i])
+        else:
+            keys.append(lambda line, i=i: Descending(line[i]))
+    if len(keys) == 1:
+        return keys[0]
+    return lambda line: tuple(key(line) for key in keys)
+
+
+def write_run(lines):
+    file = tempfile.TemporaryFile()
+    for start in range(0, len(lines), BATCH_SIZE):
+        pickle.dump(lines[start:start + BATCH_SIZE], file,
+                    pickle.HIGHEST_PROTOCOL)
+    file.seek(0)
+    return file
+
+
+def read_run(file):
+    with file:
+        while True:
+            try:
+                batch = pickle.load(file)
+            except EOFError:
+                return
+            yield from batch
+
+
+# Сортировка, которой не нужны все строки в памяти сразу: куски по
+# run_size строк сортируются и пишутся на диск, потом сливаются heapq.merge.
+# Сортировка устойчивая: равные строки остаются в исходном порядке.
+def sort_rows(rows, key, run_size=RUN_SIZE):
+    rows = iter(rows)
+    runs = []
+    try:
+        while True:
+            lines = list(islice(rows, run_size))
+            lines.sort(key=key)
+            if not runs and len(lines) < run_size:
+                # Все влезло в память.
+                yield from lines
+                return
+            if lines:
+                runs.append(write_run(lines))
+            if len(lines) < run_size:
+                break
+        del lines
+        yield from merge(*map(read_run, runs), key=key)
+    finally:
+        for file in runs:
+            file.close()
+
+
+# Строки в порядке order, не больше limit. С limit хранится только куча из
+# limit лучших строк (heapq.nsmallest), полная сортировка не нужна.
+def order_rows(rows, fieldnames, types, order=None, limit=None,
+               run_size=RUN_SIZE):
+    if not order:
+        return rows if limit is None else islice(rows, limit)
+    key = order_key(fieldnames, types, order)
+    if limit is not None:
+        return nsmallest(limit, rows, key=key)
+    return sort_rows(rows, key, run_size)
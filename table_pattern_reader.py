@@ -1,32 +1,47 @@
-from collections import namedtuple, OrderedDict
+from collections import namedtuple, OrderedDict, Counter
 import re
 
+from aggregation import is_aggr_func
+
 FilterUnit = namedtuple('FilterUnit', 'field op value')
-GroupUnit = namedtuple('GroupUnit', 'grouped_fields aggr_func aggr_column')
+GroupUnit = namedtuple('GroupUnit', 'grouped_fields aggregates')
+# name -- имя колонки результата группировки.
+Aggregate = namedtuple('Aggregate', 'func column name')
+OrderUnit = namedtuple('OrderUnit', 'field descending')
 GROUP = 'group'
 TABLE_COLUMNS = 'table columns'
 TABLE_NAME = 'table name'
 COLUMN_FILTERS = 'filter'
+ORDER = 'order'
+LIMIT = 'limit'
 
 COLUMN_PATTERN = re.compile(r'''(?P<name>[\w\-\s,]+)\|(?P<type>\w+)
                                 -?(?P<width>\d+)?  # field width
                                 -?(?P<align>[rcl])?  # align type
                                 -?(?P<unit>\w+)?  # measurement type
                             ''', re.X)
-FILTER_PATTERN = re.compile(r'''(?P<name>[\w\-\s,]+)\s*
+FILTER_PATTERN = re.compile(r'''(?P<name>[\w\-\s,()]+)\s*
                                 (?P<op>[=><!]+)\s*
                                 (?P<value>\w+[\s\d\w\-.]*)
                             ''', re.X)
 GROUP_PATTERN = re.compile(r'''\s*fields\|(?P<groups>[\w;\s]+)
-                               data\|(?P<func>\w+);\s*
-                               (?P<column>[\w,\s\-]+)
-                            ''', re.X)
+                               (?P<data>data\|.*)
+                            ''', re.X | re.S)
+# Имя колонки (у результата агрегирования -- 'avg(СТОИМОСТЬ)') и
+# направление: Стоимость desc; Тариф
+ORDER_PATTERN = re.compile(r'''(?P<name>[\w\-\s,()]+?)
+                               (?:\s+(?P<direction>asc|desc))?\s*$
+                            ''', re.X | re.I)
+# Агрегатов может быть несколько: data|sum; Стоимость data|avg; Счет
+AGGREGATE_PATTERN = re.compile(r'''data\|(?P<func>\w+);\s*
+                                   (?P<column>[\w,\s\-]+?)\s*
+                                   (?=data\||$)
+                                ''', re.X)
 
 # Возможные операции при фильтрации
 # >, <, >=, <= -- для чисел только. Не только. Строки будут в
 # лексикографическом порядке.
 FILTER_OPS = {'=', '!=', '>', '<', '>=', '<='}
-AGGR_FUNC = {'sum', 'avg'}
 
 
 class Column:
@@ -54,6 +69,8 @@ class TablePatternReader:
         self.group_by = self.extract_group(self.get_field_value(GROUP))
         self.filter = self.extract_filter_conditions(
             self.get_field_value(COLUMN_FILTERS))
+        self.order = self.extract_order(self.get_field_value(ORDER))
+        self.limit = self.extract_limit(self.get_field_value(LIMIT))
 
     def extract_group(self, value):
         if value is None:
@@ -64,30 +81,55 @@ class TablePatternReader:
                 filter(None, (line.strip().upper() for line
                               in match.group('groups').split(';'))))
 
-            aggr_column = match.group('column').upper()
-            aggr_func = match.group('func')
+            aggregates = [(aggr.group('func'), aggr.group('column').upper())
+                          for aggr in AGGREGATE_PATTERN.finditer(
+                              match.group('data'))]
             try:
-                if aggr_func not in AGGR_FUNC:
-                    raise ValueError(f'Unknown aggregation function: '
-                                     f'{aggr_func}\n')
-                if aggr_column not in self.columns:
-                    raise ValueError(f'Unknown table field: {aggr_column}\n')
+                if not aggregates:
+                    raise ValueError(f'No aggregation in group: {value}\n')
+                for aggr_func, aggr_column in aggregates:
+                    if not is_aggr_func(aggr_func):
+                        raise ValueError(f'Unknown aggregation function: '
+                                         f'{aggr_func}\n')
+                    if aggr_column not in self.columns:
+                        raise ValueError(f'Unknown table field: '
+                                         f'{aggr_column}\n')
                 for field in fields_to_group:
                     if field not in self.columns:
                         raise ValueError(f'Unknown table field: {field}\n')
             except ValueError as err:
                 print(str(err))
             else:
-                return GroupUnit(fields_to_group, aggr_func, aggr_column)
+                return GroupUnit(fields_to_group,
+                                 self.name_aggregates(aggregates,
+                                                      fields_to_group))
+
+    # Колонка результата называется как исходная. Если одну колонку
+    # агрегируют несколько раз или по ней же группируют -- 'func(колонка)'.
+    @staticmethod
+    def name_aggregates(aggregates, fields_to_group=()):
+        # Повторы одного и того же агрегата не нужны.
+        aggregates = list(OrderedDict.fromkeys(aggregates))
+        columns_count = Counter(column for _, column in aggregates)
+        columns_count.update(fields_to_group)
+        return tuple(
+            Aggregate(func, column, column if columns_count[column] == 1
+                      else f'{func}({column})')
+            for func, column in aggregates)
 
     def get_field_value(self, field_name):
         value = self.__fields_dict.get(field_name)
         return value.strip() if value is not None else value
 
+    # С группировкой условие проверяется по сгруппированной таблице: на
+    # поле группировки или результат агрегирования ('sum(СТОИМОСТЬ)', если
+    # колонку агрегируют несколько раз). Условие на другую колонку
+    # не применилось бы -- о нем сообщается, и оно отбрасывается.
     def extract_filter_conditions(self, values=None, delimiter=';'):
         if values is None:
             return
         filter_cases = tuple(cond.strip() for cond in values.split(delimiter))
+        names = {name.upper(): name for name in self.result_names()}
         filters = []
         for case in filter_cases:
             _filter = FILTER_PATTERN.match(case)
@@ -98,7 +140,10 @@ class TablePatternReader:
                 try:
                     if _filter_op not in FILTER_OPS:
                         raise ValueError(f'Unknown operation: {_filter_op}\n')
-                    if _filter_name not in self.columns:
+                    if self.group_by is not None:
+                        self.check_grouped_filter(_filter_name, names)
+                        _filter_name = names[_filter_name]
+                    elif _filter_name not in self.columns:
                         raise ValueError(f'Unknown table field: '
                                          f'{_filter_name}\n')
                 except ValueError as err:
@@ -108,6 +153,57 @@ class TablePatternReader:
                                               _filter_value))
         return filters
 
+    def check_grouped_filter(self, name, names):
+        if name in names:
+            return
+        if name not in self.columns:
+            raise ValueError(f'Unknown table field: {name}\n')
+        aggregated = [aggr.name for aggr in self.group_by.aggregates
+                      if aggr.column == name]
+        if aggregated:
+            raise ValueError(f'Column {name} is aggregated several times, '
+                             f'filter by one of: {", ".join(aggregated)}\n')
+        raise ValueError(f'Column {name} is not in the grouped table\n')
+
+    # Колонки, по которым можно сортировать: колонки итоговой таблицы.
+    def result_names(self):
+        if self.group_by is None:
+            return list(self.columns or ())
+        return list(self.group_by.grouped_fields) + [
+            aggr.name for aggr in self.group_by.aggregates]
+
+    def extract_order(self, values=None, delimiter=';'):
+        if values is None:
+            return
+        # Имена результатов агрегирования -- 'avg(СТОИМОСТЬ)', регистр
+        # функции в шаблоне может быть любым.
+        names = {name.upper(): name for name in self.result_names()}
+        order = []
+        for case in filter(None, map(str.strip, values.split(delimiter))):
+            match = ORDER_PATTERN.match(case)
+            try:
+                if match is None:
+                    raise ValueError('Not valid order\n')
+                name = names.get(match.group('name').strip().upper())
+                if name is None:
+                    raise ValueError(f'Unknown table field: '
+                                     f'{match.group("name").strip()}\n')
+            except ValueError as err:
+                print(f'{err} in case: {case}')
+            else:
+                direction = (match.group('direction') or 'asc').lower()
+                order.append(OrderUnit(name, direction == 'desc'))
+        return order
+
+    @staticmethod
+    def extract_limit(value=None):
+        if value is None:
+            return
+        if not value.isdigit():
+            print(f'Not valid limit: "{value}". It must be a number')
+            return
+        return int(value)
+
     @staticmethod
     def none_check(field, default):
         return field if field is not None else default
@@ -155,4 +251,6 @@ class TablePatternReader:
         return f'{self.table_name}\n' \
             f'{self.columns}\n' \
             f'{self.group_by}\n' \
-            f'{self.filter}\n'
+            f'{self.filter}\n' \
+            f'{self.order}\n' \
+            f'{self.limit}\n'
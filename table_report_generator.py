@@ -1,8 +1,16 @@
-from collections import OrderedDict, defaultdict
-from table_pattern_reader import TablePatternReader
+import copy
+from collections import OrderedDict
+from itertools import islice, zip_longest
+from table_pattern_reader import TablePatternReader, Column
 from table_data_reader import TableDataReader
-from copy import deepcopy
-import operator
+from columnar_table import ColumnarTable
+from aggregation import GroupAggregator, result_type
+from table_filter import compile_filter
+import numpy_engine
+import instrumentation
+
+# table_state, table_merge и table_order импортируются в ветках, которым
+# они нужны: обычный отчет за них не платит.
 
 ALIGN = {
     'c': str.center,
@@ -11,77 +19,244 @@ ALIGN = {
     'с': str.center
 }
 
+VERT_BORDER = '|'
+HORIZ_BORDER = '-'
+EMPTY_STR = ''
+NOTHING_FOUND = 'Ничего не найдено. Проверьте шаблон и данные'
+# Буфер файла отчета и число частей отчета (строк таблицы), которые
+# форматируются и пишутся за раз.
+WRITE_BUFFER = 1 << 16
+WRITE_BATCH = 1024
 
-def avg(lst):
-    return round(sum(lst) / len(lst), 2)
 
+# Раскладка строк таблицы: ширины, выравнивания, пустые заполнители и
+# шаблон строки с границами считаются один раз по колонкам отчета.
+# Без колонок (таблицы нет или она пуста) -- заголовок NOTHING_FOUND.
+class TableLayout:
+    def __init__(self, columns=()):
+        self.columns = tuple(columns)
+        self.widths = tuple(column.width for column in self.columns)
+        self.aligns = tuple(ALIGN[column.align] for column in self.columns)
+        self.blanks = tuple(' ' * width for width in self.widths)
+        self.row_format = VERT_BORDER.join(
+            [EMPTY_STR] + ['{}'] * len(self.columns) + [EMPTY_STR])
+        if self.columns:
+            self.header = self.row_format.format(*[
+                self.align_value(self.title(column), align, width)
+                for column, align, width
+                in zip(self.columns, self.aligns, self.widths)])
+        else:
+            self.header = VERT_BORDER.join([EMPTY_STR, NOTHING_FOUND,
+                                            EMPTY_STR])
+        self.width = len(self.header)
+        self.separator = HORIZ_BORDER * self.width
 
-AGGR_FUNC = {
-    'sum': sum,
-    'avg': avg
-}
+    @staticmethod
+    def title(column):
+        if column.unit != EMPTY_STR:
+            return ','.join([column.name, column.unit])
+        return column.name
 
-OPERATIONS = {
-    '=': operator.eq,
-    '!=': operator.ne,
-    '>': operator.gt,
-    '<': operator.lt,
-    '>=': operator.ge,
-    '<=': operator.le
-}
+    @staticmethod
+    def align_value(value, align, width):
+        if len(value) >= width:
+            return value[:width]
+        return align(value, width)
 
-TYPES = {
-    'int': int,
-    'float': float,
-    'str': str
-}
-VERT_BORDER = '|'
-HORIZ_BORDER = '-'
-EMPTY_STR = ''
-NOTHING_FOUND = 'Ничего не найдено. Проверьте шаблон и данные'
+    # Значения строки -> строки ячеек ровно по ширине колонок.
+    def format_row(self, line):
+        cells = []
+        for value, align, width in zip(line, self.aligns, self.widths):
+            value = str(value)
+            if '\n' in value:
+                value = '\n'.join([self.align_value(part, align, width)
+                                   for part in value.split('\n')])
+            elif len(value) >= width:
+                value = value[:width]
+            else:
+                value = align(value, width)
+            cells.append(value)
+        return tuple(cells)
+
+    # Отформатированные ячейки -> строка таблицы с границами. Многострочные
+    # ячейки идут параллельно, у закончившихся -- пробелы ширины колонки.
+    def render_row(self, cells):
+        row = self.row_format.format(*cells)
+        if '\n' not in row:
+            return row
+        return '\n'.join(
+            self.row_format.format(*[blank if part is None else part
+                                     for part, blank
+                                     in zip(parts, self.blanks)])
+            for parts in zip_longest(*[cell.split('\n') for cell in cells]))
 
 
 # Подставляет данные только с LF разделителем. Поэтому нужны файлы с таким
 # разделителем(для переводов строк)
 class TableReportGenerator:
     def __init__(self, p_filename, d_filename, output_filename,
-                 p_enc='utf-8', d_enc='utf-8', default_field_width=20):
-        self.pattern = TablePatternReader(p_filename, p_enc,
-                                          default_field_width)
-        self.data = TableDataReader(d_filename, d_enc)
-        self.columns = self.pattern.columns
-        self.format_data_values()
+                 p_enc='utf-8', d_enc='utf-8', default_field_width=20,
+                 pattern=None, stream=False, engine=numpy_engine.PYTHON,
+                 state_filename=None, jobs=1, index_filename=None,
+                 data=None, column_cache_dir=None):
+        # Уже разобранный шаблон можно передать, чтобы не читать файл снова.
+        if pattern is None:
+            with instrumentation.stage('pattern'):
+                pattern = TablePatternReader(p_filename, p_enc,
+                                             default_field_width)
+        self.pattern = pattern
+        self.columns = self.result_columns()
+        # Раскладки по набору колонок таблицы (после группировки он другой).
+        self.layouts = {}
+        # В потоковом режиме строки проходят через группировку и фильтрацию
+        # по одной, целиком исходная таблица не хранится. Общие данные
+        # нескольких шаблонов (table_fanout.SharedTableData) уже в памяти.
+        self.stream = stream and data is None
+        # numpy считает типизацию, фильтры и группировку целыми колонками;
+        # без numpy и в потоковом режиме работает чистый Python.
+        self.engine = (numpy_engine.select_engine(engine)
+                       if not self.stream else numpy_engine.PYTHON)
+        # Значения приводятся к типам колонок шаблона при чтении, там же
+        # отбрасываются строки, не прошедшие фильтр по исходным колонкам.
+        read_conditions, group_conditions = self.split_conditions()
+        # Список файлов -- один сводный отчет по всем файлам. С группировкой
+        # файлы группируются по отдельности (в jobs процессах), а состояния
+        # групп сливаются.
+        self.merge = isinstance(d_filename, (list, tuple))
+        if self.merge:
+            d_filenames = d_filename
+        # Инкрементальный режим: состояние группировки хранится в
+        # state_filename, читается только дописанный в файл хвост.
+        self.incremental = False
+        if state_filename is not None and not self.merge \
+                and self.pattern.group_by is not None:
+            import table_state
+            self.incremental = table_state.supports(d_enc)
+        # В потоковом режиме чтение идет вместе со следующим этапом.
+        with instrumentation.stage('read') as stage:
+            lazy = self.stream or self.incremental or self.merge
+            if self.merge:
+                # Файлы читает table_merge, каждый со своим заголовком.
+                self.data = None
+            elif data is not None:
+                # Файл уже прочитан, колонки приведены: остается фильтр.
+                self.data = data.reader(self.column_types())
+                if self.data.table is not None:
+                    self.data.table = self.filter_table(self.data.table,
+                                                        read_conditions)
+            else:
+                self.data = TableDataReader(d_filename, d_enc, stream=lazy,
+                                            types=self.column_types(),
+                                            conditions=read_conditions,
+                                            engine=self.engine,
+                                            index_filename=index_filename,
+                                            column_cache_dir=column_cache_dir)
+            if not lazy and self.data.table is not None:
+                stage.rows = len(self.data.table)
 
-        self.grouped_table = self.initialize_grouped_table()
+        with instrumentation.stage('group') as stage:
+            if self.incremental:
+                self.grouped_table = self.update_grouped_table(
+                    d_filename, d_enc, state_filename, read_conditions)
+            elif self.merge:
+                self.grouped_table = self.merge_grouped_table(
+                    d_filenames, d_enc, read_conditions, jobs)
+            else:
+                self.grouped_table = self.initialize_grouped_table()
+            if self.grouped_table is not None:
+                stage.rows = len(self.grouped_table)
 
-        if self.grouped_table is not None:
-            self.filtered_table = self.filter_table(self.grouped_table)
-        else:
-            self.filtered_table = self.filter_table(self.data.table)
-        self.format_column_data(self.filtered_table)
+        with instrumentation.stage('filter') as stage:
+            ordered = False
+            if self.grouped_table is not None:
+                self.filtered_table = self.filter_table(self.grouped_table,
+                                                        group_conditions)
+            elif self.incremental:
+                self.filtered_table = None
+            elif self.merge:
+                import table_merge
+                self.filtered_table = table_merge.read_files(
+                    d_filenames, d_enc, self.column_types(), read_conditions)
+            elif self.stream:
+                # Порядок и limit -- пока строки идут из файла: с limit в
+                # памяти только limit лучших строк.
+                self.filtered_table = ColumnarTable.from_rows(
+                    self.data.fieldnames, self.data.types, self.order_rows(
+                        self.data.table, self.data.fieldnames,
+                        self.data.types))
+                ordered = True
+            else:
+                self.filtered_table = self.data.table
+            if self.filtered_table is not None:
+                stage.rows = len(self.filtered_table)
 
-        self.make_report(self.filtered_table, output_filename)
-        self.generated_report = self.make_report(self.filtered_table,
-                                                 output_filename)
+        if self.filtered_table is not None and not ordered and (
+                self.pattern.order or self.pattern.limit is not None):
+            with instrumentation.stage('order') as stage:
+                self.filtered_table = self.order_table(self.filtered_table)
+                stage.rows = len(self.filtered_table)
 
-    def initialize_grouped_table(self):
+        # Строки форматируются и пишутся в файл пачками, целиком отчет в
+        # памяти не собирается.
+        self.write_report(self.iter_report(
+            self.filtered_table, self.format_rows(self.filtered_table)),
+            output_filename)
+        instrumentation.stage('format').rows = (
+            len(self.filtered_table) if self.filtered_table is not None
+            else 0)
+
+    # Текст отчета строится заново и только по запросу.
+    @property
+    def generated_report(self):
+        return '\n'.join(self.iter_report(
+            self.filtered_table, self.format_rows(self.filtered_table)))
+
+    @property
+    def formatted_table(self):
+        return self.format_column_data(self.filtered_table)
+
+    # Колонки шаблона и колонки результатов агрегирования, если у них
+    # свое имя (например, 'avg(СТОИМОСТЬ)'). Оформление берется у исходной.
+    def result_columns(self):
+        columns = OrderedDict(self.pattern.columns)
         if self.pattern.group_by is not None:
+            for aggregate in self.pattern.group_by.aggregates:
+                if aggregate.name not in columns:
+                    source = columns[aggregate.column]
+                    columns[aggregate.name] = Column(
+                        aggregate.name, result_type(aggregate.func,
+                                                    source.type),
+                        source.width, source.align, source.unit)
+        return columns
+
+    # Условия на поля группировки проверяются при чтении: отбросить строку
+    # до группировки -- то же, что отбросить ее группу. Условия на
+    # результаты агрегирования проверяются после группировки. Условия на
+    # прочие колонки отбрасывает уже разбор шаблона (с сообщением).
+    def split_conditions(self):
+        conditions = self.pattern.filter or []
+        group_by = self.pattern.group_by
+        if group_by is None:
+            return conditions, []
+        aggregated = {aggr.name for aggr in group_by.aggregates}
+        read_conditions = [cond for cond in conditions
+                           if cond.field in group_by.grouped_fields
+                           and cond.field not in aggregated]
+        group_conditions = [cond for cond in conditions
+                            if cond.field in aggregated]
+        return read_conditions, group_conditions
+
+    def column_types(self):
+        return {name: column.type
+                for name, column in self.pattern.columns.items()}
+
+    def initialize_grouped_table(self):
+        # Таблицу не удалось прочитать -- группировать нечего.
+        if self.pattern.group_by is not None and \
+                self.data.table is not None:
             return self.group_by_columns(
                 *self.pattern.group_by.grouped_fields,
-                aggr_func=self.pattern.group_by.aggr_func,
-                aggr_column=self.pattern.group_by.aggr_column)
-
-    def format_data_values(self):
-        for line in self.data.table:
-            for column in line:
-                _column = self.columns[column]
-                try:
-                    line[column] = TYPES[_column.type](line[column])
-                except ValueError as err:
-                    print(f'It is not possible to convert "{line[column]}"" to'
-                          f' type "{TYPES[_column.type]}" in line:\n"{line}"')
-                    # Инициализирую дефолтное значение типа.
-                    line[column] = TYPES[_column.type]()
+                aggregates=self.pattern.group_by.aggregates)
 
     @staticmethod
     def align_value(value, column):
@@ -103,138 +278,219 @@ class TableReportGenerator:
 
     # Если значение составное, придется сдвигать остальные части поля под
     # нужное место в таблице при отображении.
+    # Вызывается после группировки и фильтрации, поэтому все значения можно
+    # привести к str. Возвращает новую таблицу из строковых колонок.
     def format_column_data(self, table=None):
-        if table is not None:
-            for line in table:
-                for column_name in self.columns:
-                    # getting value of current column
-                    _column = self.columns[column_name]
-                    if _column.name not in line:
-                        continue
-                    # This method called after all group/filter operations
-                    # That's why cast to str is possible
-                    value = str(line[_column.name])
-                    line[_column.name] = self.format_value(value, _column)
-
-    def get_temp_table(self, fields, aggr_column):
-        temp_table = [OrderedDict() for _ in self.data.table]
-        for i in range(len(self.data.table)):
-            for field in fields:
-                temp_table[i][field] = self.data.table[i].get(field)
-            temp_table[i][aggr_column] = self.data.table[i].get(aggr_column)
-        return temp_table
+        if table is None:
+            return None
+        columns = OrderedDict()
+        for column_name in table.fieldnames:
+            _column = self.columns[column_name]
+            columns[column_name] = [self.format_value(str(value), _column)
+                                    for value in table.column(column_name)]
+        return ColumnarTable.from_columns(columns)
 
-    @staticmethod
-    def use_aggr_func(table, fields, aggr_func, aggr_column):
-        grouped_fields_dict = defaultdict(list)
-        for line in table:
-            aggr_value = line[aggr_column]
-            group_fields = tuple((field, line[field]) for field in fields)
-            grouped_fields_dict[group_fields].append(aggr_value)
-        result = {
-            k: AGGR_FUNC[aggr_func](v) for k, v in grouped_fields_dict.items()}
-        return result
+    # То же построчно: в памяти одна отформатированная строка.
+    def format_rows(self, table=None):
+        if table is None:
+            return None
+        return map(self.make_layout(table).format_row, table.rows())
 
+    # order: и limit: шаблона. rows -- строки-кортежи в порядке fieldnames.
+    def order_rows(self, rows, fieldnames, types):
+        import table_order
+        return table_order.order_rows(rows, fieldnames, types,
+                                      self.pattern.order, self.pattern.limit)
+
+    def order_table(self, table):
+        return ColumnarTable.from_rows(
+            table.fieldnames, table.types,
+            self.order_rows(table.rows(), table.fieldnames, table.types))
+
+    # Кортежи (значения полей группировки..., агрегируемые значения...).
+    # lines -- строки-списки вместо таблицы (потоковый режим, хвост файла).
+    def group_rows(self, fields, aggr_columns, lines=None):
+        names = tuple(fields) + tuple(aggr_columns)
+        if self.stream and lines is None:
+            lines = self.data.table
+        if lines is not None:
+            indices = [self.data.fieldnames.index(name) for name in names]
+            return (tuple(line[i] for i in indices) for line in lines)
+        return zip(*(self.data.table.column(name) for name in names))
+
+    # Память пропорциональна числу групп, а не числу строк.
     @staticmethod
-    def cast_to_ordered(table, aggr_column):
-        result = []
-        for line in table:
-            _line = OrderedDict(line)
-            _line[aggr_column] = table[line]
-            result.append(_line)
-        return result
+    def use_aggr_func(rows, aggr_funcs, key_length):
+        return GroupAggregator(aggr_funcs).consume(rows, key_length)
+
+    def cast_to_table(self, results, fields, aggregates):
+        names = tuple(fields) + tuple(aggr.name for aggr in aggregates)
+        types = {field: self.columns[field].type for field in fields}
+        for aggr in aggregates:
+            types[aggr.name] = result_type(aggr.func,
+                                           self.columns[aggr.column].type)
+        return ColumnarTable.from_rows(
+            names, types,
+            (tuple(group_fields) + tuple(values)
+             for group_fields, values in results))
 
     # Группировка как в примере.
-    def group_by_columns(self, *args, aggr_func, aggr_column):
-        temp_table = self.get_temp_table(args, aggr_column)
-        aggregated_dict = self.use_aggr_func(temp_table, args, aggr_func,
-                                             aggr_column)
-        result_table = self.cast_to_ordered(aggregated_dict, aggr_column)
+    def group_by_columns(self, *args, aggregates):
+        results = None
+        if self.engine == numpy_engine.NUMPY:
+            try:
+                results = numpy_engine.aggregate(self.data.table, args,
+                                                 aggregates)
+            except numpy_engine.Unsupported:
+                pass
+        if results is None:
+            results = self.use_aggr_func(
+                self.group_rows(args, (aggr.column for aggr in aggregates)),
+                [aggr.func for aggr in aggregates], len(args)).results()
+        result_table = self.cast_to_table(results, args, aggregates)
         return result_table
 
-    def filter_func(self, filter_unit):
-        column_name = filter_unit.field
-        op = filter_unit.op
-        value = TYPES[self.columns[column_name].type](filter_unit.value)
-        return lambda table: OPERATIONS[op](table[column_name], value)
+    # Все, от чего зависит сохраненное состояние группировки.
+    def state_signature(self, d_enc, read_conditions):
+        return repr((d_enc, self.pattern.group_by, read_conditions,
+                     sorted(self.column_types().items())))
+
+    # Группировка с сохраненного состояния: учитываются только строки,
+    # дописанные после прошлого запуска. Если файл не дописан, а изменен
+    # (короче, другой заголовок или другие байты перед смещением) или
+    # шаблон другой -- группировка с нуля.
+    def update_grouped_table(self, d_filename, d_enc, state_filename,
+                             read_conditions=None):
+        group_by = self.pattern.group_by
+        fields = group_by.grouped_fields
+        aggr_columns = [aggr.column for aggr in group_by.aggregates]
+        from table_state import TableState
+        signature = self.state_signature(d_enc, read_conditions)
+        state = TableState.load(state_filename)
+        with open(d_filename, 'rb') as fin:
+            if state is None or not state.matches(fin, signature):
+                state = TableState.start(fin, signature, GroupAggregator(
+                    [aggr.func for aggr in group_by.aggregates]))
+            complete, partial = state.read_tail(fin, d_enc)
+        try:
+            state.aggregator.consume(self.group_rows(
+                fields, aggr_columns,
+                self.data.iter_text_table(complete.decode(d_enc))),
+                len(fields))
+            aggregator = state.aggregator
+            # Незаконченная последняя запись в отчет попадает, а в
+            # сохраненное состояние -- нет: ее еще могут дописать.
+            if partial.strip():
+                aggregator = copy.deepcopy(aggregator).consume(
+                    self.group_rows(fields, aggr_columns,
+                                    self.data.iter_text_table(
+                                        partial.decode(d_enc))),
+                    len(fields))
+        except ValueError as error:
+            print(error)
+            return None
+        state.save(state_filename)
+        return self.cast_to_table(aggregator.results(), fields,
+                                  group_by.aggregates)
+
+    def merge_grouped_table(self, d_filenames, d_enc, read_conditions=None,
+                            jobs=1):
+        group_by = self.pattern.group_by
+        if group_by is None:
+            return None
+        import table_merge
+        aggregator = table_merge.aggregate_files(
+            d_filenames, d_enc, self.column_types(), read_conditions,
+            group_by.grouped_fields, group_by.aggregates, jobs)
+        return self.cast_to_table(aggregator.results(),
+                                  group_by.grouped_fields,
+                                  group_by.aggregates)
 
     # filter instructions
-    def filter_table(self, table):
-        conditions = self.pattern.filter
-        if conditions is not None:
-            filtered_table = deepcopy(table)
-            for cond in conditions:
-                # Проверка наличия поля фильтрации в таблице.
-                if cond.field in filtered_table[0]:
-                    filtered_table = filter(self.filter_func(cond),
-                                            filtered_table)
-            return list(filtered_table)
-        return table  # Если нет фильтров
+    # Значение фильтра приводится к типу колонки таблицы: после группировки
+    # он может отличаться от типа в шаблоне (avg -- всегда float).
+    def filter_table(self, table, conditions=None):
+        if conditions is None:
+            conditions = self.pattern.filter
+        if self.engine == numpy_engine.NUMPY:
+            try:
+                return numpy_engine.filter_table(table, conditions)
+            except numpy_engine.Unsupported:
+                pass
+        predicate = compile_filter(conditions, table.fieldnames, table.types)
+        if predicate is None:
+            return table  # Если нет фильтров
+        return table.take([i for i, line in enumerate(table.rows())
+                            if predicate(line)])
 
     # Методы для отрисовки таблицы
     def table_name(self, width):
         return f'{self.pattern.table_name}'.center(width, HORIZ_BORDER)
 
+    def make_layout(self, table=None):
+        if not table:
+            return TableLayout()
+        key = tuple(table.fieldnames)
+        layout = self.layouts.get(key)
+        if layout is None:
+            layout = self.layouts[key] = TableLayout(
+                [self.columns[name] for name in key])
+        return layout
+
     def columns_names(self, table=None):
-        columns = [EMPTY_STR]
-        if table:
-            line = table[0]  # Беру первую запись таблицы.
-            for column in line:
-                _column = self.columns[column]
-                if _column.unit != EMPTY_STR:
-                    value = ','.join([_column.name, _column.unit])
-                else:
-                    value = _column.name
-                formatted_name = self.align_value(value, _column)
-                columns.append(formatted_name)
-            columns.append(EMPTY_STR)
-            return VERT_BORDER.join(columns)
-        else:
-            columns.append(NOTHING_FOUND)
-            columns.append(EMPTY_STR)
-            return VERT_BORDER.join(columns)
+        return self.make_layout(table).header
 
     def table_width(self, table):
-        return len(self.columns_names(table))
+        return self.make_layout(table).width
 
-    def table_values(self, table=None):
-        separator = HORIZ_BORDER * self.table_width(table)
-        res = [separator]
+    # Строки значений с разделителями; rows -- уже отформатированные строки,
+    # по умолчанию строки самой таблицы.
+    def iter_values(self, table=None, rows=None):
+        layout = self.make_layout(table)
+        yield layout.separator
         if table is not None:
-            for line in table:
-                # Хотя бы 1 значение должен напечатать.
-                _values = [line.split('\n') for line in line.values()]
-                line_feed_count = [line.count('\n') + 1
-                                   for line in line.values()]
-                _string_res = [[] for _ in range(max(line_feed_count))]
-                for j in range(max(line_feed_count)):
-                    for i in range(len(line_feed_count)):
-                        if line_feed_count[i] > 0:
-                            # Empty string for adding front border
-                            _string_res[j].append(
-                                VERT_BORDER.join([EMPTY_STR, _values[i][j]]))
-                            line_feed_count[i] -= 1
-                        else:
-                            empty_field = ' ' * len(_values[i][0])
-                            _string_res[j].append(
-                                VERT_BORDER.join([EMPTY_STR, empty_field]))
-                        # add back line border
-                    _string_res[j].append(VERT_BORDER)
-                    _string_res[j] = ''.join(_string_res[j])
-                value_line = '\n'.join(_string_res)
-                res.append(value_line)
-                res.append(separator)
-        return '\n'.join(res)
+            for line in table.rows() if rows is None else rows:
+                yield layout.render_row(line)
+                yield layout.separator
 
-    def make_report(self, table, output_filename):
-        table_width = self.table_width(table)
-        table_name = self.table_name(table_width)
-        table_columns = self.columns_names(table)
-        table_values = self.table_values(table)
-        result = '\n'.join([table_name, table_columns, table_values])
+    def table_values(self, table=None):
+        return '\n'.join(self.iter_values(table))
 
-        # Поправить имя выходного файла в случае чего.
-        with open(f'{output_filename}', 'w', encoding='utf-8') as file:
-            file.write(result)
+    # Части отчета по порядку: заголовок, имена колонок, строки.
+    def iter_report(self, table=None, rows=None):
+        layout = self.make_layout(table)
+        yield self.table_name(layout.width)
+        yield layout.header
+        yield from self.iter_values(table, rows)
 
+    # Части берутся пачками по WRITE_BATCH: в замерах форматирование
+    # (получение частей) и запись в файл -- отдельные этапы.
+    @staticmethod
+    def write_report(parts, output_filename):
+        parts = iter(parts)
+        file = None
+        separator = ''
+        try:
+            while True:
+                with instrumentation.stage('format'):
+                    batch = list(islice(parts, WRITE_BATCH))
+                with instrumentation.stage('write'):
+                    if file is None:
+                        # Поправить имя выходного файла в случае чего.
+                        file = open(f'{output_filename}', 'w',
+                                    encoding='utf-8', buffering=WRITE_BUFFER)
+                    if not batch:
+                        break
+                    file.write(separator + '\n'.join(batch))
+                separator = '\n'
+        finally:
+            if file is not None:
+                with instrumentation.stage('write'):
+                    file.close()
+
+    # Отчет по уже отформатированной таблице; текст собирается целиком,
+    # так как его возвращают вызывающему.
+    def make_report(self, table, output_filename):
+        result = '\n'.join(self.iter_report(table))
+        self.write_report((result,), output_filename)
         return result
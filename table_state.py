@@ -0,0 +1,101 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+from table_tokenizer import ROW_DELIMITER, complete_length
+
+# Меняется вместе с форматом файла состояния: старые файлы не подойдут.
+VERSION = 2
+# Сколько байт перед сохраненным смещением сверяется при следующем запуске:
+# если они другие, файл переписан, а не дописан.
+WINDOW = 4096
+SUFFIX = '.state'
+
+
+# Дописанный хвост читается по байтовому смещению, поэтому разделители
+# должны кодироваться одним байтом ASCII (utf-8, cp1251, но не utf-16).
+def supports(encoding):
+    try:
+        return (ROW_DELIMITER.encode(encoding) == ROW_DELIMITER.encode()
+                and '\n'.encode(encoding) == b'\n')
+    except LookupError:
+        return False
+
+
+def state_filename(directory, d_filename, p_filename):
+    name = '\0'.join([os.path.abspath(d_filename),
+                      os.path.abspath(p_filename or '')])
+    return os.path.join(directory,
+                        hashlib.sha256(name.encode()).hexdigest() + SUFFIX)
+
+
+# Состояние инкрементальной группировки: до какого байта файл данных уже
+# учтен и промежуточные значения агрегатов по группам.
+# signature -- все, от чего зависит группировка (шаблон, кодировка):
+# при другом шаблоне состояние не используется.
+class TableState:
+    def __init__(self, signature, header, offset, window, aggregator):
+        self.signature = signature
+        self.header = header
+        self.offset = offset
+        self.window = window
+        self.aggregator = aggregator
+
+    # Начало с нуля: учтен только заголовок.
+    @classmethod
+    def start(cls, fin, signature, aggregator):
+        fin.seek(0)
+        header = fin.readline()
+        return cls(signature, header, len(header), b'', aggregator)
+
+    @staticmethod
+    def load(filename):
+        try:
+            with open(filename, 'rb') as file:
+                version, state = pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as error:
+            print(f'Broken state file "{filename}" is ignored: {error!r}')
+            return None
+        return state if version == VERSION else None
+
+    def save(self, filename):
+        directory = os.path.dirname(filename) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump((VERSION, self), file)
+            os.replace(temp_name, filename)
+        except BaseException:
+            os.remove(temp_name)
+            raise
+
+    # Файл только дописывался: тот же шаблон, тот же заголовок, не короче
+    # учтенного и те же байты перед смещением.
+    def matches(self, fin, signature):
+        if signature != self.signature:
+            return False
+        fin.seek(0)
+        if fin.readline() != self.header:
+            return False
+        if os.fstat(fin.fileno()).st_size < self.offset:
+            return False
+        fin.seek(self.offset - len(self.window))
+        return fin.read(len(self.window)) == self.window
+
+    # Новые байты после смещения: законченные записи (до последнего '#',
+    # который не в кавычках) и незаконченный хвост. Смещение сдвигается
+    # только за законченные.
+    def read_tail(self, fin, encoding='utf-8'):
+        fin.seek(self.offset)
+        data = fin.read()
+        end = complete_length(data, encoding)
+        complete, partial = data[:end], data[end:]
+        if complete:
+            self.offset += end
+            fin.seek(max(self.offset - WINDOW, 0))
+            self.window = fin.read(self.offset - fin.tell())
+        return complete, partial
@@ -0,0 +1,353 @@
+from itertools import accumulate
+import codecs
+import csv
+import re
+
+ROW_DELIMITER = '#'
+FIELD_DELIMITER = ','
+QUOTE = '"'
+ESCAPE = '\\'
+CHUNK_SIZE = 1 << 16
+# Поле в кавычках ('""' и '\"' внутри -- кавычка, после закрывающей кавычки
+# может идти текст до разделителя) или без них. '\' экранирует следующий
+# символ, в том числе '#' и ','. Кавычка особая только в начале поля, как
+# у csv. Закрывающая кавычка -- та, за которой нет второй: иначе '""' можно
+# было бы прочитать как конец поля раньше, чем у csv.
+FIELD = (r'(?:"(?:[^"\\]|""|\\.)*"(?!")(?:\\.|[^,#\\])*'
+         r'|(?:(?:\\.|[^,#\\"])(?:\\.|[^,#\\])*)?)')
+RECORD = rf'\s*{FIELD}(?:,{FIELD})*'
+RECORD_PATTERN = re.compile(RECORD, re.S)
+SPACES = re.compile(r'\s*')
+DIALECT = dict(delimiter=FIELD_DELIMITER, quotechar=QUOTE,
+               escapechar=ESCAPE, doublequote=True, strict=False)
+# csv считает перевод строки вне кавычек концом строки, поэтому на время
+# разбора переводы строк заменяются символами из области частного
+# использования (U+E000, U+E001). Если они есть в тексте, разбирает
+# split_fields.
+NEWLINES = {'\r': '\ue000', '\n': '\ue001'}
+TO_CSV = str.maketrans(NEWLINES)
+FROM_CSV = str.maketrans({value: key for key, value in NEWLINES.items()})
+
+
+# Значения записи по одному символу -- для того, что csv понимает иначе
+# или не умеет: '\' сразу после закрывающей кавычки (у csv это просто
+# символ) и в самом конце текста, значения длиннее csv.field_size_limit().
+def split_fields(record):
+    fields = []
+    field = []
+    in_quotes = False
+    field_start = True
+    i = 0
+    while i < len(record):
+        char = record[i]
+        i += 1
+        if char == ESCAPE and i < len(record):
+            field.append(record[i])
+            i += 1
+        elif in_quotes:
+            if char != QUOTE:
+                field.append(char)
+            elif record.startswith(QUOTE, i):
+                field.append(QUOTE)
+                i += 1
+            else:
+                in_quotes = False
+        elif char == FIELD_DELIMITER:
+            fields.append(''.join(field))
+            field = []
+            field_start = True
+            continue
+        elif char == QUOTE and field_start:
+            in_quotes = True
+        else:
+            field.append(char)
+        field_start = False
+    fields.append(''.join(field))
+    return fields
+
+
+# Нечетное число '\' в конце: последний символ экранирует следующий.
+def ends_with_escape(text):
+    return (len(text) - len(text.rstrip(ESCAPE))) % 2 == 1
+
+
+# Длина законченных записей в байтах (до последнего '#', который не в
+# кавычках и не экранирован) -- для дописанного хвоста файла. Концы записей
+# ищутся в декодированном тексте: пробелы перед кавычкой (в том числе
+# U+00A0) те же, что у str.strip при разборе. Незаконченный символ в конце
+# не декодируется, байты, которых нет в кодировке, сохраняются
+# (surrogateescape).
+def complete_length(data, encoding='utf-8'):
+    delimiter = ROW_DELIMITER.encode()
+    if b'"' not in data and b'\\' not in data:
+        return data.rfind(delimiter) + 1
+    text = codecs.getincrementaldecoder(encoding)(
+        'surrogateescape').decode(data)
+    end = position = 0
+    while position < len(text):
+        position = RECORD_PATTERN.match(text, position).end()
+        if not text.startswith(ROW_DELIMITER, position):
+            break
+        end = position = position + 1
+    return len(text[:end].encode(encoding, 'surrogateescape'))
+
+
+# Записи таблицы (списки значений) из файла, открытого после заголовка.
+# Записи разделены '#', значения -- ',', края записи без пробелов, пустые
+# записи пропускаются, переводы строк внутри записи сохраняются.
+# Блоки без кавычек и '\' режутся str.split целиком. В блоке с ними
+# RECORD_PATTERN ищет только концы записей с кавычками и '\', а значения
+# разбирает csv (пачкой).
+# width -- число колонок: записи с другим числом значений и с незакрытой
+# кавычкой сообщаются через on_error (с номером записи и строки файла) и
+# пропускаются. line=None -- номер строки неизвестен (кусок файла).
+class TableTokenizer:
+    def __init__(self, width=None, line=2, on_error=print):
+        self.width = width
+        self.numbered = line is not None
+        # Номер строки файла, с которой начинается еще не разобранный текст.
+        self.line = line if line is not None else 1
+        # Номер следующей записи, как в сообщениях TableDataError.
+        self.row = 0
+        self.on_error = on_error
+
+    def records(self, fin, chunk_size=CHUNK_SIZE):
+        pending = []
+        size = 0
+        # В отложенном тексте нет кавычек и '\'.
+        plain = True
+        # Незакрытая кавычка: текст разбирается снова, только когда его
+        # станет вдвое больше, иначе длинное поле в кавычках читалось бы
+        # заново с каждым блоком.
+        wait_size = 0
+        for chunk in iter(lambda: fin.read(chunk_size), ''):
+            plain_chunk = QUOTE not in chunk and ESCAPE not in chunk
+            # Запись заканчивается только с новым '#'.
+            if ROW_DELIMITER not in chunk or size + len(chunk) < wait_size:
+                pending.append(chunk)
+                size += len(chunk)
+                plain = plain and plain_chunk
+                continue
+            if plain and plain_chunk:
+                # Блок режется str.split сам, без склейки с отложенным
+                # текстом (как до разбора кавычек).
+                head = ''.join(pending)
+                records = chunk.split(ROW_DELIMITER)
+                tail = records.pop()
+                records[0] = head + records[0]
+                newlines = head.count('\n') + chunk.count(
+                    '\n', 0, len(chunk) - len(tail))
+                pending = [tail]
+                size = len(tail)
+                yield from self.split_records(records, newlines)
+                continue
+            pending.append(chunk)
+            text = ''.join(pending)
+            rows, end, wait_quote = self.tokenize(text)
+            pending = [text[end:]]
+            size = len(text) - end
+            plain = QUOTE not in pending[0] and ESCAPE not in pending[0]
+            wait_size = 2 * size if wait_quote else 0
+            yield from rows
+        rows, _, _ = self.tokenize(''.join(pending), final=True)
+        yield from rows
+
+    # Законченные записи текста: строки, длина разобранной части и
+    # признак незакрытой кавычки после нее. final -- конец файла.
+    def tokenize(self, text, final=False):
+        if QUOTE in text or ESCAPE in text:
+            return self.scan(text, final)
+        end = len(text) if final else text.rfind(ROW_DELIMITER) + 1
+        return self.split(text, end), end, False
+
+    def split(self, text, end):
+        return list(self.split_records(text[:end].split(ROW_DELIMITER),
+                                       text.count('\n', 0, end)))
+
+    # Записи без кавычек и '\' по одной; newlines -- сколько в них
+    # переводов строк. С записи с другим числом значений остаток
+    # разбирает check (с номерами строк).
+    def split_records(self, records, newlines):
+        width = self.width
+        count = 0
+        for raw in records:
+            record = raw.strip()
+            if record:
+                row = record.split(FIELD_DELIMITER)
+                if len(row) != width and width is not None:
+                    # Такой же записи раньше не было: на ней была бы ошибка.
+                    i = records.index(raw)
+                    self.row += count
+                    self.line += sum(record.count('\n')
+                                     for record in records[:i])
+                    yield from self.check(records[i:])
+                    return
+                count += 1
+                yield row
+        self.row += count
+        self.line += newlines
+
+    # То же по одной записи, с номерами строк: только для блока с ошибкой.
+    def check(self, records):
+        rows = []
+        for record in records:
+            line, stripped = self.strip(record)
+            self.line += record.count('\n')
+            if stripped:
+                row = stripped.split(FIELD_DELIMITER)
+                if self.validate(row, line):
+                    rows.append(row)
+        return rows
+
+    # Номер строки, с которой начинается запись, и запись без пробелов по
+    # краям. Экранированный пробел в конце остается.
+    def strip(self, record):
+        stripped = record.lstrip()
+        line = self.line + record.count('\n', 0, len(record) - len(stripped))
+        end = len(stripped.rstrip())
+        if end < len(stripped) and ends_with_escape(stripped[:end]):
+            end += 1
+        return line, stripped[:end]
+
+    def validate(self, row, line):
+        if self.width is None or len(row) == self.width:
+            self.row += 1
+            return True
+        problem = 'name' if len(row) > self.width else 'value'
+        self.report(f'no column {problem}', line)
+        return False
+
+    def report(self, problem, line):
+        where = f' (line {line})' if self.numbered else ''
+        self.on_error(f'TableDataError: {problem} in row !{self.row}!{where}')
+        self.row += 1
+
+    # Текст режется по '#'; куски без кавычек и '\' -- готовые записи, а
+    # конец записи, начатой куском с ними, ищет RECORD_PATTERN. Записи идут
+    # в тексте подряд, через один '#'.
+    def scan(self, text, final=False):
+        pieces = text.split(ROW_DELIMITER)
+        last = len(pieces) - 1
+        special = [j for j, piece in enumerate(pieces)
+                   if QUOTE in piece or ESCAPE in piece]
+        records = []
+        # Номера записей с незакрытой кавычкой (до следующего '#').
+        unclosed = []
+        i = position = 0
+        wait_quote = False
+        for j in special:
+            if j < i:
+                continue
+            position += sum(map(len, pieces[i:j])) + j - i
+            records += pieces[i:j]
+            i = j
+            if j == last and not final:
+                break
+            end = RECORD_PATTERN.match(text, position).end()
+            if text.startswith(ROW_DELIMITER, end):
+                records.append(text[position:end])
+            elif not final:
+                wait_quote = text.startswith(QUOTE, end)
+                break
+            elif end == len(text) or end + 1 == len(text) and \
+                    text.startswith(ESCAPE, end):
+                # Последняя запись; '\' в самом конце -- просто символ.
+                end = len(text)
+                records.append(text[position:])
+            else:
+                # Незакрытая кавычка: запись пропускается до следующего '#'.
+                end = text.find(ROW_DELIMITER, end)
+                if end == -1:
+                    end = len(text)
+                unclosed.append(len(records))
+                records.append(text[position:end])
+            i = j + 1 + text.count(ROW_DELIMITER, position, end)
+            position = end + 1
+        else:
+            if final:
+                records += pieces[i:]
+                position = len(text)
+            else:
+                records += pieces[i:last]
+                position = len(text) - len(pieces[last])
+        rows = self.parse(text, records, unclosed)
+        self.line += text.count('\n', 0, position)
+        return rows, position, wait_quote
+
+    # Номер строки файла для позиции в тексте -- только для сообщений.
+    # Пробелы в начале записи пропускаются.
+    def line_at(self, text, position):
+        position = SPACES.match(text, position).end()
+        return self.line + text.count('\n', 0, position)
+
+    # Записи разбираются пачками между записями с незакрытой кавычкой.
+    def parse(self, text, records, unclosed):
+        rows = []
+        start = position = 0
+        for end in unclosed + [len(records)]:
+            batch = records[start:end]
+            rows += self.parse_batch(text, position, batch)
+            position += sum(map(len, batch)) + len(batch)
+            if end < len(records):
+                self.report('no closing quote', self.line_at(text, position))
+                position += len(records[end]) + 1
+            start = end + 1
+        return rows
+
+    # Пачка записей разбирается одним csv.reader. Если csv не справился,
+    # записи разбираются split_fields.
+    def parse_batch(self, text, start, records):
+        if not records:
+            return []
+        stripped = list(map(str.strip, records))
+        if ESCAPE in text:
+            stripped = [self.strip(record)[1] if value.endswith(ESCAPE)
+                        else value for record, value in zip(records, stripped)]
+        positions = None
+        if '' in stripped:
+            # Пустые записи пропускаются.
+            positions = self.positions(start, records)
+            items = [item for item in zip(positions, stripped) if item[1]]
+            if not items:
+                return []
+            positions, stripped = zip(*items)
+        parsed = None
+        if not any(char in text for char in NEWLINES.values()) and \
+                not ends_with_escape(stripped[-1]):
+            try:
+                parsed = self.parse_csv(stripped)
+            except csv.Error:
+                pass
+        if parsed is None:
+            parsed = list(map(split_fields, stripped))
+        elif QUOTE + ESCAPE in text:
+            parsed = [split_fields(record) if QUOTE + ESCAPE in record
+                      else row for record, row in zip(stripped, parsed)]
+        if self.width is None or set(map(len, parsed)) == {self.width}:
+            self.row += len(parsed)
+            return parsed
+        if positions is None:
+            positions = self.positions(start, records)
+        rows = []
+        for position, row in zip(positions, parsed):
+            if self.validate(row, self.line_at(text, position)):
+                rows.append(row)
+        return rows
+
+    @staticmethod
+    def positions(start, records):
+        return list(accumulate([start] + [len(record) + 1
+                                          for record in records[:-1]]))
+
+    @staticmethod
+    def parse_csv(records):
+        translated = [record.translate(TO_CSV)
+                      if '\n' in record or '\r' in record else record
+                      for record in records]
+        parsed = list(csv.reader(translated, **DIALECT))
+        if len(parsed) != len(records):
+            return None
+        for row, record, line in zip(parsed, records, translated):
+            if line is not record:
+                row[:] = [field.translate(FROM_CSV) for field in row]
+        return parsed
@@ -1,12 +1,51 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import unittest.mock
 from collections import OrderedDict, namedtuple
-
-from table_report_generator import TableReportGenerator
+from types import SimpleNamespace
+
+from table_report_generator import TableReportGenerator, TableLayout, \
+    NOTHING_FOUND, WRITE_BATCH
+from table_data_reader import TableDataReader
+from columnar_table import ColumnarTable
+from table_pattern_reader import Aggregate, FilterUnit, OrderUnit, \
+    TablePatternReader
+from table_filter import compile_filter
+import aggregation
+import numpy_engine
 from report_generator import ReportGenerator
+from data_reader import DataReader, FieldIndex
+from text_template import compile_template
+import morphology
+import main
+import entering_data
+import benchmark
+import instrumentation
+import report_cache
+import table_order
+import table_index
+import column_cache
+import table_tokenizer
+import table_state
+import server
+from table_state import TableState
 
 Column = namedtuple('Column', ['width', 'align'])
 
 
+def make_table(rows, fieldnames=('ПОЛ', 'СТОИМОСТЬ'), types=None):
+    return ColumnarTable.from_rows(fieldnames, types, rows)
+
+
 class TestTableReportGeneratorMethods(unittest.TestCase):
 
     def setUp(self):
@@ -23,7 +62,7 @@ class TestTableReportGeneratorMethods(unittest.TestCase):
         )
         actual = [OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 38.0)]),
                   OrderedDict([('ПОЛ', 'ж'), ('СТОИМОСТЬ', 21.36)])]
-        self.assertEqual(generator.grouped_table, actual)
+        self.assertEqual(generator.grouped_table.to_dicts(), actual)
 
     def test_none_initialize_grouped_table(self):
         generator = TableReportGenerator(
@@ -55,7 +94,7 @@ class TestTableReportGeneratorMethods(unittest.TestCase):
                               ('СЧЕТ', 1234),
                               ('ПОЛ', 'м'),
                               ('СТОИМОСТЬ', 20)])]
-        self.assertEqual(generator.data.table, actual)
+        self.assertEqual(generator.data.table.to_dicts(), actual)
 
     def test_align_value(self):
         generator = TableReportGenerator(
@@ -89,19 +128,17 @@ class TestTableReportGeneratorMethods(unittest.TestCase):
         )
         actual = [OrderedDict([('ПОЛ', '         м          '),
                                ('СТОИМОСТЬ', '        20.0        ')])]
-        self.assertEqual(generator.filtered_table, actual)
+        self.assertEqual(generator.formatted_table.to_dicts(), actual)
 
-    def test_get_temp_table(self):
+    def test_group_rows(self):
         generator = TableReportGenerator(
             p_filename=self.pattern_name,
             d_filename=self.data_name2,
             output_filename=self.output_name
         )
-        actual = [OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)]),
-                  OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)]),
-                  OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)])]
-        self.assertEqual(generator.get_temp_table(
-            ['ПОЛ'], aggr_column='СТОИМОСТЬ'), actual)
+        actual = [('м', 20), ('м', 20), ('м', 20)]
+        self.assertEqual(list(generator.group_rows(
+            ('ПОЛ',), aggr_columns=('СТОИМОСТЬ',))), actual)
 
     def test_use_aggr_func(self):
         generator = TableReportGenerator(
@@ -109,22 +146,22 @@ class TestTableReportGeneratorMethods(unittest.TestCase):
             d_filename=self.data_name2,
             output_filename=self.output_name
         )
-        table = [OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)]),
-                 OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)]),
-                 OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)])]
-        actual = {(('ПОЛ', 'м'),): 20.0}
-        self.assertEqual(generator.use_aggr_func(
-            table, ['ПОЛ'], 'avg', 'СТОИМОСТЬ'), actual)
-
-    def test_cast_to_ordered(self):
+        rows = [('м', 20, 20), ('м', 20, 20), ('м', 20, 20)]
+        actual = {('м',): (20.0, 3)}
+        self.assertEqual(dict(generator.use_aggr_func(
+            rows, ('avg', 'count'), 1).results()), actual)
+
+    def test_cast_to_table(self):
         generator = TableReportGenerator(
             p_filename=self.pattern_name,
             d_filename=self.data_name2,
             output_filename=self.output_name
         )
-        _dict = {(('ПОЛ', 'м'),): 20.0}
+        aggregator = generator.use_aggr_func([('м', 20)], ('avg',), 1)
+        aggregates = (Aggregate('avg', 'СТОИМОСТЬ', 'СТОИМОСТЬ'),)
         actual = [OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20.0)])]
-        self.assertEqual(generator.cast_to_ordered(_dict, 'СТОИМОСТЬ'), actual)
+        self.assertEqual(generator.cast_to_table(
+            aggregator.results(), ('ПОЛ',), aggregates).to_dicts(), actual)
 
     def test_filter_table(self):
         generator = TableReportGenerator(
@@ -132,14 +169,13 @@ class TestTableReportGeneratorMethods(unittest.TestCase):
             d_filename=self.data_name2,
             output_filename=self.output_name
         )
-        table = [OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)]),
-                 OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)]),
-                 OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)])]
+        table = make_table([('м', 20), ('м', 20), ('м', 20)],
+                           types={'СТОИМОСТЬ': 'int'})
 
         actual = [OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)]),
                   OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)]),
                   OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)])]
-        self.assertEqual(generator.filter_table(table), actual)
+        self.assertEqual(generator.filter_table(table).to_dicts(), actual)
 
     def test_table_name(self):
         generator = TableReportGenerator(
@@ -157,9 +193,7 @@ class TestTableReportGeneratorMethods(unittest.TestCase):
             d_filename=self.data_name2,
             output_filename=self.output_name
         )
-        table = [OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)]),
-                 OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)]),
-                 OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)])]
+        table = make_table([('м', 20), ('м', 20), ('м', 20)])
         actual = '|        ПОЛ         |     СТОИМОСТЬ      |'
         self.assertEqual(generator.columns_names(table), actual)
 
@@ -173,9 +207,7 @@ class TestTableReportGeneratorMethods(unittest.TestCase):
             d_filename=self.data_name2,
             output_filename=self.output_name
         )
-        table = [OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)]),
-                 OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)]),
-                 OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 20)])]
+        table = make_table([('м', 20), ('м', 20), ('м', 20)])
         actual = '|        ПОЛ         |     СТОИМОСТЬ      |'
         self.assertEqual(generator.table_width(table), len(actual))
 
@@ -189,8 +221,8 @@ class TestTableReportGeneratorMethods(unittest.TestCase):
             d_filename=self.data_name2,
             output_filename=self.output_name
         )
-        table = [OrderedDict([('ПОЛ', '         м          '),
-                              ('СТОИМОСТЬ', '        20.0        ')])]
+        table = make_table([('         м          ',
+                             '        20.0        ')])
         actual = '-------------------------------------------\n' \
                  '|         м          |        20.0        |\n' \
                  '-------------------------------------------'
@@ -271,6 +303,1440 @@ class TestReportGeneratorMethods(unittest.TestCase):
         self.assertEqual(generator.generated_report, actual)
 
 
+class TestMorphology(unittest.TestCase):
+
+    def setUp(self):
+        morphology.cache_clear()
+
+    def test_plural_form(self):
+        self.assertEqual(morphology.plural_form(1), morphology.ONE)
+        self.assertEqual(morphology.plural_form(21), morphology.ONE)
+        self.assertEqual(morphology.plural_form(11), morphology.MANY)
+        self.assertEqual(morphology.plural_form(3), morphology.FEW)
+        self.assertEqual(morphology.plural_form(13), morphology.MANY)
+        self.assertEqual(morphology.plural_form(100), morphology.MANY)
+
+    def test_shared_analyzer(self):
+        self.assertIs(morphology.get_analyzer(), morphology.get_analyzer())
+
+    def test_agree_with_number_cache(self):
+        self.assertEqual(morphology.agree_with_number('рубль', 11), 'рублей')
+        self.assertEqual(morphology.agree_with_number('рубль', 25), 'рублей')
+        self.assertEqual(morphology.agree_with_number('рубль', 2), 'рубля')
+        self.assertEqual(morphology.agree_with_number('', 2), '')
+        info = morphology.cache_info()
+        self.assertEqual(info['hits'], 1)
+        self.assertEqual(info['misses'], 2)
+
+
+class TestTextTemplate(unittest.TestCase):
+
+    @staticmethod
+    def format_value(value, width, align, unit):
+        return f'{value}:{width}{align}{unit}'
+
+    def test_compile_template(self):
+        template = compile_template('a {{name|5-l-kg}}#b !!{{x}}#')
+        self.assertEqual(template.chunks[0], 'a ')
+        hole = template.chunks[1]
+        self.assertEqual((hole.name, hole.width, hole.align, hole.unit,
+                          hole.screened), ('NAME', 5, 'l', 'kg', False))
+        self.assertTrue(template.chunks[3].screened)
+        self.assertEqual(template.names, frozenset({'NAME'}))
+
+    def test_render(self):
+        template = compile_template('{{a}} and {{b|3-r}}#!!{{a}}')
+        self.assertEqual(
+            template.render({'A': '1', 'B': '2'}, 7, self.format_value),
+            '1:7c and 2:3r{{a}}')
+        self.assertEqual(
+            template.render({'A': 'x'}, 4, self.format_value),
+            'x:4c and {{b|3-r}}{{a}}')
+
+    # Каждая дыра подставляется сама по себе (раньше -- re.sub по всему
+    # сегменту с шаблоном, собранным из текста дыры).
+    def test_name_with_spaces(self):
+        template = compile_template('{{ФИО полностью|5-l}}')
+        self.assertEqual(template.render({'ФИО ПОЛНОСТЬЮ': 'Иван'}, 4,
+                                         self.format_value), 'Иван:5l')
+
+    def test_repeated_holes_keep_own_format(self):
+        template = compile_template('{{a|5-r}}.{{a}}')
+        self.assertEqual(template.render({'A': 'x'}, 4, self.format_value),
+                         'x:5r.x:4c')
+
+    def test_screened_hole_with_used_name(self):
+        template = compile_template('{{a|3-l}} !!{{a}}')
+        self.assertEqual(template.render({'A': 'x'}, 4, self.format_value),
+                         'x:3l {{a}}')
+
+    def test_value_is_not_a_replacement_template(self):
+        template = compile_template('{{a}}')
+        self.assertEqual(template.render({'A': 'a\\tb\\1'}, 4,
+                                         self.format_value), 'a\\tb\\1:4c')
+
+
+class TestPreparsedPattern(unittest.TestCase):
+
+    def test_report_generator_template(self):
+        template = compile_template('{{name|6-l}}#')
+        with tempfile.TemporaryDirectory() as tmp:
+            data_name = os.path.join(tmp, 'data.txt')
+            with open(data_name, 'w', encoding='utf-8') as file:
+                file.write('name = alex#')
+            for i in range(2):
+                generator = ReportGenerator(
+                    p_filename=None,
+                    d_filename=data_name,
+                    output_filename=os.path.join(tmp, f'{i}_report.txt'),
+                    template=template
+                )
+                self.assertEqual(generator.generated_report, 'alex  ')
+
+
+class TestBatchMode(unittest.TestCase):
+
+    def test_bad_file_does_not_abort_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_name = os.path.join(tmp, 'data.txt')
+            with open(data_name, 'w', encoding='utf-8') as file:
+                file.write('name = alex#')
+            input_data = SimpleNamespace(
+                input_format='text', pattern_name=None, pattern_enc='utf-8',
+                data_name=[data_name, os.path.join(tmp, 'missing.txt'),
+                           data_name],
+                data_enc='utf-8', default_field_width=20, jobs=2,
+                output_filename='report.txt', no_cache=True,
+                check_fields=False)
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                errors = main.generate_reports(
+                    input_data, compile_template('{{name|4}}'))
+            finally:
+                os.chdir(cwd)
+            self.assertEqual([name for name, _ in errors],
+                             [input_data.data_name[1]])
+            self.assertTrue(os.path.exists(os.path.join(tmp, '1_report.txt')))
+            self.assertTrue(os.path.exists(os.path.join(tmp, '3_report.txt')))
+
+    def test_negative_jobs_are_rejected(self):
+        argv = ['main.py', '-p', 'pattern.txt', '-d', 'data.txt',
+                '-in', 'text', '-j', '-1']
+        with unittest.mock.patch('sys.argv', argv), \
+                contextlib.redirect_stderr(io.StringIO()) as error:
+            with self.assertRaises(SystemExit):
+                entering_data.input_data()
+        self.assertIn('--jobs must not be negative', error.getvalue())
+        argv[-1] = '0'
+        with unittest.mock.patch('sys.argv', argv):
+            self.assertEqual(entering_data.input_data().jobs, 0)
+
+
+class TestTableDataStreaming(unittest.TestCase):
+
+    def test_iter_records_chunk_boundaries(self):
+        text = 'a,b\nc,d# e,f #\n#g,h'
+        expected = [['a', 'b\nc', 'd'], ['e', 'f'], ['g', 'h']]
+        for chunk_size in (1, 2, 3, 5, 100):
+            records = TableDataReader.iter_records(io.StringIO(text),
+                                                   chunk_size)
+            self.assertEqual(list(records), expected)
+
+    def test_stream_table(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_name = os.path.join(tmp, 'data.txt')
+            with open(data_name, 'w', encoding='utf-8', newline='') as file:
+                file.write('Пол,Стоимость\nм,20#ж\nж,30#')
+            expected = TableDataReader(data_name).table
+            reader = TableDataReader(data_name, stream=True, chunk_size=4)
+            self.assertEqual(make_table(reader.table), expected)
+            self.assertEqual(expected.row(1), OrderedDict([('ПОЛ', 'ж\nж'),
+                                                           ('СТОИМОСТЬ', '30')]))
+
+
+class TestColumnarTable(unittest.TestCase):
+
+    def setUp(self):
+        self.table = make_table([('м', 20, 1.5), ('ж', 30, 2.5)],
+                                ('ПОЛ', 'СТОИМОСТЬ', 'ВЕС'),
+                                {'СТОИМОСТЬ': 'int', 'ВЕС': 'float'})
+
+    def test_typed_columns(self):
+        self.assertEqual(self.table.column('СТОИМОСТЬ').typecode, 'q')
+        self.assertEqual(self.table.column('ВЕС').typecode, 'd')
+        self.assertEqual(self.table.column('ПОЛ'), ['м', 'ж'])
+        self.assertEqual(len(self.table), 2)
+
+    def test_take(self):
+        table = self.table.take([1])
+        self.assertEqual(table.to_dicts(), [OrderedDict([
+            ('ПОЛ', 'ж'), ('СТОИМОСТЬ', 30), ('ВЕС', 2.5)])])
+
+    def test_int_overflow(self):
+        self.table.append(('м', 2 ** 70, 0.0))
+        self.assertEqual(self.table.row(2)['СТОИМОСТЬ'], 2 ** 70)
+
+
+class TestAggregation(unittest.TestCase):
+
+    def test_group_aggregator(self):
+        rows = [('м', 20, 1), ('ж', 30, 5), ('м', 40, 3), ('м', 30, 2)]
+        aggregator = aggregation.GroupAggregator(
+            ('sum', 'avg', 'count', 'min', 'max', 'median'))
+        aggregator.consume(((sex, cost, cost, cost, n, n, n)
+                            for sex, cost, n in rows), 1)
+        self.assertEqual(dict(aggregator.results()),
+                         {('м',): (90, 30.0, 3, 1, 3, 2),
+                          ('ж',): (30, 30.0, 1, 5, 5, 5)})
+
+    def test_merge(self):
+        first = aggregation.GroupAggregator(('avg', 'max'))
+        second = aggregation.GroupAggregator(('avg', 'max'))
+        first.consume([('a', 1, 1), ('b', 2, 2)], 1)
+        second.consume([('a', 4, 4)], 1)
+        self.assertEqual(dict(first.merge(second).results()),
+                         {('a',): (2.5, 4), ('b',): (2.0, 2)})
+
+    def test_quantile_sketch(self):
+        sketch = aggregation.QuantileSketch(capacity=64)
+        for value in range(1, 10001):
+            sketch.add(value)
+        self.assertLess(sum(map(len, sketch.levels)), 64 * 10)
+        self.assertAlmostEqual(sketch.quantile(0.5), 5000, delta=300)
+        self.assertAlmostEqual(sketch.quantile(0.9), 9000, delta=300)
+
+    def test_extract_group(self):
+        pattern = TablePatternReader.__new__(TablePatternReader)
+        pattern.columns = {'ПОЛ': None, 'СТОИМОСТЬ': None}
+        group = pattern.extract_group(
+            'fields|Пол data|sum; Стоимость data|p90; Стоимость')
+        self.assertEqual(group.grouped_fields, ('ПОЛ',))
+        self.assertEqual(
+            [aggr.name for aggr in group.aggregates],
+            ['sum(СТОИМОСТЬ)', 'p90(СТОИМОСТЬ)'])
+
+
+class TestTableFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.conditions = [FilterUnit('СТОИМОСТЬ', '>=', '20'),
+                           FilterUnit('ПОЛ', '!=', 'м'),
+                           FilterUnit('ТАРИФ', '=', 'Безлимит')]
+        self.types = {'ПОЛ': 'str', 'СТОИМОСТЬ': 'int'}
+
+    def test_compile_filter(self):
+        predicate = compile_filter(self.conditions, ('ПОЛ', 'СТОИМОСТЬ'),
+                                   self.types)
+        self.assertTrue(predicate(('ж', 20)))
+        self.assertFalse(predicate(('м', 30)))
+        self.assertFalse(predicate(('ж', 10)))
+        self.assertIsNone(compile_filter([], ('ПОЛ',), self.types))
+
+    def test_raw_filter(self):
+        predicate = compile_filter(self.conditions, ('ПОЛ', 'СТОИМОСТЬ'),
+                                   self.types, raw=True)
+        self.assertTrue(predicate(['ж', '25']))
+        self.assertFalse(predicate(['ж', 'bad']))
+
+    def test_quotes_in_values(self):
+        conditions = [FilterUnit('ПОЛ', '=', 'а\'"\\'),
+                      FilterUnit('СТОИМОСТЬ', '<', '5')]
+        predicate = compile_filter(conditions, ('ПОЛ', 'СТОИМОСТЬ'),
+                                   self.types, raw=True)
+        self.assertTrue(predicate(['а\'"\\', '1']))
+        self.assertFalse(predicate(['а\'"\\', '7']))
+        self.assertFalse(predicate(['а', '1']))
+
+    def test_filter_while_reading(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            data_name = os.path.join(tmp, 'data.txt')
+            with open(data_name, 'w', encoding='utf-8', newline='') as file:
+                file.write('Пол,Стоимость\nм,20#ж,30#ж,5#')
+            reader = TableDataReader(data_name, types=self.types,
+                                     conditions=self.conditions)
+            self.assertEqual(list(reader.table.rows()), [('ж', 30)])
+
+
+@unittest.skipUnless(numpy_engine.available(), 'numpy is not installed')
+class TestNumpyEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.types = OrderedDict([('ПОЛ', 'str'), ('СТОИМОСТЬ', 'int'),
+                                  ('ВЕС', 'float')])
+        self.rows = [['м', '20', '1.5'], ['ж', '30', '-0.0'],
+                     ['м', '5', '0.0'], ['ж', 'bad', '2.25']]
+
+    def read(self, conditions=None):
+        return numpy_engine.read_table(iter(self.rows), list(self.types),
+                                       self.types, conditions)
+
+    def test_read_table(self):
+        expected = ColumnarTable.from_rows(
+            list(self.types), self.types,
+            [['м', 20, 1.5], ['ж', 30, -0.0], ['м', 5, 0.0], ['ж', 0, 2.25]])
+        self.assertEqual(self.read(), expected)
+
+    def test_read_table_with_filter(self):
+        table = self.read([FilterUnit('СТОИМОСТЬ', '>=', '20')])
+        self.assertEqual(table.column('ПОЛ'), ['м', 'ж'])
+
+    def test_aggregate(self):
+        table = self.read()
+        aggregates = [Aggregate('sum', 'СТОИМОСТЬ', 'СТОИМОСТЬ'),
+                      Aggregate('max', 'ВЕС', 'ВЕС')]
+        aggregator = aggregation.GroupAggregator(['sum', 'max'])
+        aggregator.consume(((row[0], row[1], row[2]) for row in table.rows()),
+                           1)
+        self.assertEqual(
+            numpy_engine.aggregate(table, ['ПОЛ'], aggregates),
+            list(aggregator.results()))
+
+    def test_float_keys_group_like_dict(self):
+        codes, count = numpy_engine.factorize(
+            numpy_engine.np.array([0.0, -0.0, 1.0, 0.0]))
+        self.assertEqual((codes.tolist(), count), ([0, 0, 1, 0], 2))
+
+
+class TestIncrementalReport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.output_name = self.write('report.txt', '')
+        self.generator = TableReportGenerator(
+            p_filename=self.write(
+                'pattern.txt',
+                'table name: Годовой отчет#\n'
+                'table columns: ФИО|str; Тариф|str; Счет|int; Пол|str; '
+                'Стоимость|int#'),
+            d_filename=self.write(
+                'data.txt',
+                'ФИО,Тариф,Счет,Пол,Стоимость\n'
+                'Никольский А.А.,Безлимит\nпочти\nна все,1234,м,20#'
+                'Иванов И.И.,Базовый,1,ж,5#'),
+            output_filename=self.output_name
+        )
+
+    def write(self, name, text):
+        filename = os.path.join(self.tmp.name, name)
+        with open(filename, 'w', encoding='utf-8') as file:
+            file.write(text)
+        return filename
+
+    def test_write_report(self):
+        parts = iter(['a', 'b\nc', 'd'])
+        output_name = os.path.join(self.tmp.name, 'parts.txt')
+        self.generator.write_report(parts, output_name)
+        with open(output_name, encoding='utf-8') as file:
+            self.assertEqual(file.read(), 'a\nb\nc\nd')
+
+    # Части пишутся пачками: на границе пачки тот же разделитель.
+    def test_write_report_batches(self):
+        parts = [str(i) for i in range(2 * WRITE_BATCH + 1)]
+        output_name = os.path.join(self.tmp.name, 'parts.txt')
+        self.generator.write_report(iter(parts), output_name)
+        with open(output_name, encoding='utf-8') as file:
+            self.assertEqual(file.read(), '\n'.join(parts))
+        self.generator.write_report(iter([]), output_name)
+        self.assertEqual(os.path.getsize(output_name), 0)
+
+    def test_report_file_matches_generated_report(self):
+        with open(self.output_name, encoding='utf-8') as file:
+            report = file.read()
+        self.assertEqual(report, self.generator.generated_report)
+        self.assertIn('|                    |       почти        |', report)
+
+    def test_format_rows(self):
+        rows = self.generator.format_rows(self.generator.filtered_table)
+        self.assertEqual(list(rows), list(
+            self.generator.formatted_table.rows()))
+        self.assertIsNone(self.generator.format_rows(None))
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run_cases(self):
+        table_cases = [dict(name='table', rows=30, columns=5, multiline=0.5,
+                            groups=4, selectivity=0.5)]
+        text_cases = [dict(name='text', holes=6, multiline=0.5, units=0.0)]
+        with tempfile.TemporaryDirectory() as tmp:
+            results = benchmark.run_cases(tmp, table_cases, text_cases,
+                                          repeat=1)
+        table, text = results
+        self.assertEqual(list(table['stages']),
+                         list(benchmark.TABLE_STAGES) + ['total'])
+        for stage in ('type', 'format', 'write'):
+            self.assertGreater(table['stages'][stage]['median'], 0)
+        self.assertEqual(table['result_rows'], 2)
+        self.assertEqual(list(text['stages']),
+                         list(benchmark.TEXT_STAGES) + ['total'])
+        self.assertEqual(text['result_rows'], 6)
+
+    def test_generators_are_reproducible(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            contents = []
+            for i in range(2):
+                data_name = os.path.join(tmp, f'{i}.txt')
+                benchmark.make_table_data(data_name, 10, 4, seed=1)
+                with open(data_name, encoding='utf-8') as file:
+                    contents.append(file.read())
+        self.assertEqual(contents[0], contents[1])
+
+    def test_compare(self):
+        def results(median):
+            return {'cases': [{'name': 'a', 'params': {}, 'stages': {
+                'read': {'min': median, 'median': median}}}]}
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(benchmark.compare(results(1.0), results(1.0)),
+                             [])
+            self.assertEqual(benchmark.compare(results(2.0), results(1.0)),
+                             [('a', 'read', 2.0)])
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def tearDown(self):
+        instrumentation.disable()
+
+    def test_disabled(self):
+        instrumentation.disable()
+        self.assertIs(instrumentation.report(data='x'),
+                      instrumentation.NULL_REPORT)
+        with instrumentation.stage('read') as stage:
+            stage.rows = 1
+        self.assertIs(stage, instrumentation.NULL_STAGE)
+
+    def test_report_stages(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            pattern_name = os.path.join(tmp, 'pattern.txt')
+            data_name = os.path.join(tmp, 'data.txt')
+            with open(pattern_name, 'w', encoding='utf-8') as file:
+                file.write('table name: Отчет#\n'
+                           'table columns: Пол|str; Стоимость|int#\n'
+                           'group: fields|Пол data|avg; Стоимость#')
+            with open(data_name, 'w', encoding='utf-8') as file:
+                file.write('Пол,Стоимость\nм,20#м,30#м,x#')
+            profile_name = os.path.join(tmp, 'profile.jsonl')
+            instrumentation.enable(profile_name)
+            with instrumentation.report(data='table_data.txt'), \
+                    contextlib.redirect_stdout(io.StringIO()):
+                TableReportGenerator(
+                    p_filename=pattern_name, d_filename=data_name,
+                    output_filename=os.path.join(tmp, 'report.txt'))
+            with open(profile_name, encoding='utf-8') as file:
+                records = [json.loads(line) for line in file]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['data'], 'table_data.txt')
+        stages = records[0]['stages']
+        self.assertEqual([stage['stage'] for stage in stages],
+                         ['pattern', 'read', 'type', 'group', 'filter',
+                          'format', 'write'])
+        self.assertEqual(stages[1]['rows'], 3)
+        self.assertEqual(stages[-2]['rows'], 1)
+        for stage in stages:
+            self.assertGreaterEqual(stage['cpu'], 0)
+            self.assertGreaterEqual(stage['peak_memory'], 0)
+
+    def test_repeated_and_nested_stages(self):
+        report = benchmark.StageRecorder()
+        with report:
+            with instrumentation.stage('read'):
+                time.sleep(0.02)
+                for _ in range(2):
+                    with instrumentation.stage('type') as stage:
+                        time.sleep(0.02)
+                        stage.rows = 2
+        stages = report.record['stages']
+        self.assertEqual([(stage['stage'], stage['rows']) for stage in stages],
+                         [('read', None), ('type', 2)])
+        self.assertLess(stages[0]['wall'], 0.035)
+        self.assertGreaterEqual(stages[1]['wall'], 0.04)
+
+
+class TestReportCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.pattern_name = self.write('pattern.txt', '{{name|6-l}}#')
+        self.data_name = self.write('data.txt', 'name = alex#')
+        self.cache = report_cache.ReportCache(
+            os.path.join(self.tmp.name, 'cache'), max_size=15)
+
+    def write(self, name, text):
+        filename = os.path.join(self.tmp.name, name)
+        with open(filename, 'w', encoding='utf-8') as file:
+            file.write(text)
+        return filename
+
+    def key(self, width=20):
+        return report_cache.make_key('text', self.pattern_name,
+                                     self.data_name, 'utf-8', 'utf-8', width)
+
+    def test_key(self):
+        key = self.key()
+        self.assertEqual(key, self.key())
+        self.assertNotEqual(key, self.key(width=10))
+        self.write('data.txt', 'name = bob#')
+        self.assertNotEqual(key, self.key())
+
+    def test_key_depends_on_code(self):
+        key = self.key()
+        with unittest.mock.patch.object(report_cache, 'code_version',
+                                        return_value=b'other'):
+            self.assertNotEqual(key, self.key())
+
+    def test_code_version_modules(self):
+        directory = os.path.dirname(os.path.abspath(report_cache.__file__))
+        for name in report_cache.CODE_MODULES:
+            self.assertTrue(os.path.isfile(os.path.join(directory, name)))
+        for name in ('tests.py', 'benchmark.py', 'server.py'):
+            self.assertNotIn(name, report_cache.CODE_MODULES)
+
+    def test_get_put(self):
+        output_name = os.path.join(self.tmp.name, 'out.txt')
+        self.assertIsNone(self.cache.get('a', output_name))
+        self.cache.put('a', self.write('report.txt', 'report'))
+        self.assertEqual(self.cache.get('a', output_name), '')
+        with open(output_name, encoding='utf-8') as file:
+            self.assertEqual(file.read(), 'report')
+        self.cache.put('a', self.write('report.txt', 'report'), 'ой\n')
+        self.assertEqual(self.cache.get('a', output_name), 'ой\n')
+        with open(output_name, encoding='utf-8') as file:
+            self.assertEqual(file.read(), 'report')
+
+    def test_evict_least_recently_used(self):
+        report_name = self.write('report.txt', 'four')
+        self.cache.put('a', report_name)
+        self.cache.put('b', report_name)
+        os.utime(self.cache.path('a'), (1, 1))
+        self.cache.put('c', report_name)
+        self.assertFalse(os.path.exists(self.cache.path('a')))
+        self.assertLessEqual(self.cache.size(), 15)
+
+    def test_generate_report_hit(self):
+        input_data = SimpleNamespace(
+            input_format='text', pattern_name=self.pattern_name,
+            pattern_enc='utf-8', data_name=[self.data_name],
+            data_enc='utf-8', default_field_width=20,
+            output_filename='report.txt', no_cache=False,
+            check_fields=False, cache_dir=self.cache.directory,
+            cache_size=1)
+        template = compile_template('{{name|6-l}}#')
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        try:
+            output_name = main.generate_report(input_data, template, 0)
+            os.remove(output_name)
+            # Шаблон не нужен: отчет берется из кэша.
+            main.generate_report(input_data, None, 0)
+            with open(output_name, encoding='utf-8') as file:
+                self.assertEqual(file.read(), 'alex  ')
+        finally:
+            os.chdir(cwd)
+
+    def test_generate_report_hit_prints_messages(self):
+        self.write('pattern.txt', '{{name|6-l}} {{age}}#')
+        input_data = SimpleNamespace(
+            input_format='text', pattern_name=self.pattern_name,
+            pattern_enc='utf-8', data_name=[self.data_name],
+            data_enc='utf-8', default_field_width=20,
+            output_filename='report.txt', no_cache=False,
+            check_fields=False, cache_dir=self.cache.directory,
+            cache_size=1)
+        template = compile_template('{{name|6-l}} {{age}}#')
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()) as first:
+                main.generate_report(input_data, template, 0)
+            with contextlib.redirect_stdout(io.StringIO()) as second:
+                main.generate_report(input_data, None, 0)
+        finally:
+            os.chdir(cwd)
+        self.assertIn('No value for name: age', first.getvalue())
+        self.assertEqual(second.getvalue(), first.getvalue())
+
+
+class TestIncrementalGroup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.pattern_name = self.path('pattern.txt')
+        self.data_name = self.path('data.txt')
+        self.state_name = self.path('data.state')
+        with open(self.pattern_name, 'w', encoding='utf-8') as file:
+            file.write('table name: Отчет#\n'
+                       'table columns: Пол|str; Стоимость|int#\n'
+                       'group: fields|Пол data|sum; Стоимость#')
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def write(self, text, mode='w'):
+        with open(self.data_name, mode, encoding='utf-8',
+                  newline='') as file:
+            file.write(text)
+
+    def report(self, state_name=None):
+        return TableReportGenerator(
+            p_filename=self.pattern_name, d_filename=self.data_name,
+            output_filename=self.path('report.txt'),
+            state_filename=state_name).grouped_table.to_dicts()
+
+    def test_append(self):
+        self.write('Пол,Стоимость\nм,20#ж,30#')
+        self.assertEqual(self.report(self.state_name), self.report())
+        self.write('м,5#ж,1', mode='a')
+        self.assertEqual(self.report(self.state_name), self.report())
+        state = TableState.load(self.state_name)
+        self.assertEqual(state.offset, os.path.getsize(self.data_name) - 4)
+        self.write('0#', mode='a')
+        self.assertEqual(self.report(self.state_name),
+                         [OrderedDict([('ПОЛ', 'м'), ('СТОИМОСТЬ', 25)]),
+                          OrderedDict([('ПОЛ', 'ж'), ('СТОИМОСТЬ', 40)])])
+
+    def test_rebuild_after_rewrite(self):
+        self.write('Пол,Стоимость\nм,20#ж,30#')
+        self.report(self.state_name)
+        self.write('Пол,Стоимость\nж,1#')
+        self.assertEqual(self.report(self.state_name), self.report())
+        self.write('Пол,Стоимость,Счет\nж,1,2#')
+        self.assertEqual(self.report(self.state_name), self.report())
+
+    def test_supports(self):
+        self.assertTrue(table_state.supports('utf-8'))
+        self.assertTrue(table_state.supports('cp1251'))
+        self.assertFalse(table_state.supports('utf-16'))
+
+
+class TestMergeMode(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.pattern_name = self.write(
+            'pattern.txt', 'table name: Отчет#\n'
+                           'table columns: Пол|str; Стоимость|int#\n'
+                           'group: fields|Пол data|sum; Стоимость '
+                           'data|avg; Стоимость#')
+        self.data_names = [
+            self.write('a.txt', 'Пол,Стоимость\nм,20#ж,30#'),
+            self.write('b.txt', 'Стоимость,Пол\n5,ж#1,м#'),
+            self.write('c.txt', 'Пол,Стоимость\nж#')]
+
+    def write(self, name, text):
+        filename = os.path.join(self.tmp.name, name)
+        with open(filename, 'w', encoding='utf-8', newline='') as file:
+            file.write(text)
+        return filename
+
+    def report(self, jobs=1):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            generator = TableReportGenerator(
+                p_filename=self.pattern_name, d_filename=self.data_names,
+                output_filename=os.path.join(self.tmp.name, 'report.txt'),
+                jobs=jobs)
+        if jobs == 1:
+            # Сообщения процессов пула сюда не попадают.
+            self.assertIn('c.txt', output.getvalue())
+        return generator.filtered_table.to_dicts()
+
+    def test_merge_groups(self):
+        expected = [
+            OrderedDict([('ПОЛ', 'м'), ('sum(СТОИМОСТЬ)', 21),
+                         ('avg(СТОИМОСТЬ)', 10.5)]),
+            OrderedDict([('ПОЛ', 'ж'), ('sum(СТОИМОСТЬ)', 35),
+                         ('avg(СТОИМОСТЬ)', 17.5)])]
+        self.assertEqual(self.report(), expected)
+        self.assertEqual(self.report(jobs=2), expected)
+
+    def test_merge_rows(self):
+        with open(self.pattern_name, 'w', encoding='utf-8') as file:
+            file.write('table name: Отчет#\n'
+                       'table columns: Пол|str; Стоимость|int#\n'
+                       'filter: Стоимость > 1#')
+        self.assertEqual([list(line.values()) for line in self.report()],
+                         [['м', 20], ['ж', 30], ['ж', 5]])
+
+    def test_first_file_missing(self):
+        self.data_names.insert(0, os.path.join(self.tmp.name, 'missing.txt'))
+        self.assertEqual([list(line.values()) for line in self.report()],
+                         [['м', 21, 10.5], ['ж', 35, 17.5]])
+        with open(self.pattern_name, 'w', encoding='utf-8') as file:
+            file.write('table name: Отчет#\n'
+                       'table columns: Пол|str; Стоимость|int#')
+        self.assertEqual([list(line.values()) for line in self.report()],
+                         [['м', 20], ['ж', 30], ['ж', 5], ['м', 1]])
+
+
+class TestDataReaderIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, text, encoding='utf-8'):
+        filename = os.path.join(self.tmp.name, 'data.txt')
+        with open(filename, 'w', encoding=encoding, newline='') as file:
+            file.write(text)
+        return filename
+
+    def read_both(self, text, encoding='utf-8'):
+        filename = self.write(text, encoding)
+        with contextlib.redirect_stdout(io.StringIO()) as old_output:
+            expected = DataReader.extract_values(
+                DataReader.read_data(filename, encoding))
+        with contextlib.redirect_stdout(io.StringIO()) as new_output:
+            fields = DataReader(filename, encoding).fields
+        self.assertEqual(new_output.getvalue(), old_output.getvalue())
+        return fields, expected
+
+    def test_same_fields(self):
+        fields, expected = self.read_both(
+            'Фамилия = Иванов#имя=Петр \r\n#Имя=Иван#=пусто#Плохо=+1#'
+            'Нет значения#\n')
+        self.assertIsInstance(fields, FieldIndex)
+        self.assertEqual(dict(fields), expected)
+        self.assertEqual(dict(fields), {'ФАМИЛИЯ': 'Иванов', 'ИМЯ': 'Иван'})
+
+    def test_empty_file(self):
+        fields, expected = self.read_both('')
+        self.assertEqual(dict(fields), expected)
+        self.assertEqual(len(fields), 0)
+
+    def test_lazy_values(self):
+        filename = self.write('Город=Москва#Улица=Тверская#')
+        fields = DataReader(filename).fields
+        self.assertEqual(fields.values, {})
+        self.assertEqual(fields['ГОРОД'], 'Москва')
+        self.assertEqual(fields.values, {'ГОРОД': 'Москва'})
+        start, end = fields.offsets('УЛИЦА')
+        self.assertEqual(fields.buffer[start:end].decode(), 'Тверская')
+
+    def test_not_byte_delimited(self):
+        fields, expected = self.read_both('Город=Москва#', 'utf-16')
+        self.assertEqual(fields, {'ГОРОД': 'Москва'})
+
+
+class TestSelectiveFields(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.data_name = os.path.join(self.tmp.name, 'data.txt')
+        lines = [f'поле{i}=значение{i}#' for i in range(10000)]
+        lines[5] = 'Город=Москва#'
+        lines.append('город = Казань#Улица=Ленина#')
+        with open(self.data_name, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(lines))
+
+    def test_last_value_wins(self):
+        fields = DataReader(self.data_name, names={'ГОРОД', 'ПОЛЕ7'}).fields
+        self.assertEqual(dict(fields), {'ГОРОД': 'Казань',
+                                        'ПОЛЕ7': 'значение7'})
+
+    def test_same_as_full_read(self):
+        names = {'ГОРОД', 'УЛИЦА', 'ПОЛЕ9999', 'НЕТ'}
+        full = DataReader(self.data_name).fields
+        fields = DataReader(self.data_name, names=names).fields
+        self.assertEqual(dict(fields),
+                         {name: full[name] for name in names if name in full})
+
+    def test_stops_early(self):
+        calls = []
+        index_spans = DataReader.index_spans.__func__
+
+        def counting(cls, *args):
+            calls.append(args)
+            return index_spans(cls, *args)
+
+        with unittest.mock.patch.object(DataReader, 'index_spans',
+                                        classmethod(counting)):
+            fields = DataReader(self.data_name, names={'УЛИЦА'}).fields
+        self.assertEqual(dict(fields), {'УЛИЦА': 'Ленина'})
+        self.assertEqual(len(calls), 1)
+        self.assertGreater(calls[0][2], 0)
+
+    def test_field_usage(self):
+        template = compile_template('{{Город}} {{Дом}}')
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            ReportGenerator(self.data_name, None,
+                            os.path.join(self.tmp.name, 'report.txt'),
+                            template=template, check_fields=True)
+        lines = output.getvalue().splitlines()
+        self.assertIn(f'{self.data_name}: missing fields: ДОМ', lines)
+        unused = [line for line in lines if 'unused fields' in line][0]
+        self.assertIn('УЛИЦА', unused)
+        self.assertNotIn('ГОРОД', unused)
+
+
+class TestTemplateServer(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = server.TemplateServer(jobs=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.socket_path = os.path.join(self.tmp.name, 'server.sock')
+
+    # Запросы по очереди к серверу, запущенному на время теста.
+    def requests(self, *requests):
+        async def run():
+            listener = await self.server.start(self.socket_path)
+            async with listener:
+                return await asyncio.gather(*[self.send(*request)
+                                              for request in requests])
+        return asyncio.run(run())
+
+    async def send(self, method, path, request=None):
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        body = json.dumps(request).encode() if request is not None else b''
+        writer.write(f'{method} {path} HTTP/1.1\r\n'
+                     f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+        response = await reader.read()
+        writer.close()
+        head, _, body = response.partition(b'\r\n\r\n')
+        return int(head.split()[1]), json.loads(body)
+
+    def test_render(self):
+        data_name = os.path.join(self.tmp.name, 'data.txt')
+        output_name = os.path.join(self.tmp.name, 'report.txt')
+        with open(data_name, 'w', encoding='utf-8') as file:
+            file.write('Имя=Иван#Город=Москва#')
+        (status, _), = self.requests(
+            ('POST', '/patterns', {'id': 'card', 'format': 'text',
+                                   'text': '{{Имя|6-l}}{{Фамилия}}'}))
+        self.assertEqual(status, 200)
+        responses = self.requests(
+            ('POST', '/render', {'pattern': 'card', 'data': data_name}),
+            ('POST', '/render', {'pattern': 'card', 'inline': 'имя=Петр#'}),
+            ('POST', '/render', {'pattern': 'card', 'data': data_name,
+                                 'output': output_name}),
+            ('GET', '/patterns'))
+        self.assertEqual(responses[0][1]['report'], 'Иван  {{Фамилия}}')
+        self.assertIn('No value for name: Фамилия',
+                      responses[0][1]['messages'])
+        self.assertEqual(responses[1][1]['report'], 'Петр  {{Фамилия}}')
+        self.assertEqual(responses[2][1]['output'], output_name)
+        with open(output_name, encoding='utf-8') as file:
+            self.assertEqual(file.read(), 'Иван  {{Фамилия}}')
+        self.assertEqual(responses[3], (200, {'patterns': ['card']}))
+
+    def test_errors(self):
+        responses = self.requests(
+            ('POST', '/render', {'pattern': 'missing', 'inline': ''}),
+            ('POST', '/patterns', {'id': 'x', 'format': 'pdf', 'text': ''}),
+            ('POST', '/render', {}),
+            ('GET', '/nothing'))
+        self.assertEqual([status for status, _ in responses],
+                         [404, 400, 400, 404])
+        self.assertTrue(all('error' in response for _, response in responses))
+
+    def test_bad_content_length(self):
+        async def respond(length):
+            reader = asyncio.StreamReader()
+            reader.feed_data(f'POST /patterns HTTP/1.1\r\n'
+                             f'Content-Length: {length}\r\n\r\n'.encode())
+            reader.feed_eof()
+            return await self.server.respond(reader)
+        for length in ('-1', 'x'):
+            status, response = asyncio.run(respond(length))
+            self.assertEqual(status, 400)
+            self.assertEqual(response, {'error': 'Bad Content-Length'})
+
+    def test_pattern_is_loaded_outside_event_loop(self):
+        threads = []
+        load_pattern = self.server.load_pattern
+
+        def record_thread(*args):
+            threads.append(threading.get_ident())
+            return load_pattern(*args)
+        with unittest.mock.patch.object(self.server, 'load_pattern',
+                                        record_thread):
+            (status, _), = self.requests(
+                ('POST', '/patterns', {'id': 'thread', 'format': 'text',
+                                       'text': '{{Имя}}'}))
+        self.addCleanup(self.server.patterns.pop, 'thread')
+        self.assertEqual(status, 200)
+        self.assertNotEqual(threads, [threading.get_ident()])
+        self.assertEqual(self.server.patterns['thread'][0], 'text')
+
+    def test_root(self):
+        self.server.root = os.path.realpath(self.tmp.name)
+        self.addCleanup(setattr, self.server, 'root', None)
+        with open(os.path.join(self.tmp.name, 'data.txt'), 'w',
+                  encoding='utf-8') as file:
+            file.write('Имя=Иван#')
+        # Запросы идут одновременно, поэтому шаблон добавляется заранее.
+        (status, _), = self.requests(
+            ('POST', '/patterns', {'id': 'name', 'format': 'text',
+                                   'text': '{{Имя}}'}))
+        self.assertEqual(status, 200)
+        responses = self.requests(
+            ('POST', '/render', {'pattern': 'name', 'data': 'data.txt',
+                                 'output': 'report.txt'}),
+            ('POST', '/render', {'pattern': 'name', 'data': '../data.txt'}),
+            ('POST', '/render', {'pattern': 'name', 'data': '/etc/passwd'}),
+            ('POST', '/render', {'pattern': 'name', 'data': 'data.txt',
+                                 'output': '../report.txt'}),
+            ('POST', '/patterns', {'id': 'x', 'format': 'text',
+                                   'path': '/etc/passwd'}))
+        self.assertEqual([status for status, _ in responses],
+                         [200, 403, 403, 403, 403])
+        with open(os.path.join(self.tmp.name, 'report.txt'),
+                  encoding='utf-8') as file:
+            self.assertEqual(file.read().strip(), 'Иван')
+
+    def test_port_requires_root(self):
+        with unittest.mock.patch('sys.argv', ['server.py', '--port', '0']), \
+                contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                server.main()
+
+    def test_negative_jobs_are_rejected(self):
+        argv = ['server.py', '--socket', 'server.sock', '-j', '-2']
+        with unittest.mock.patch('sys.argv', argv), \
+                contextlib.redirect_stderr(io.StringIO()) as error:
+            with self.assertRaises(SystemExit):
+                server.main()
+        self.assertIn('--jobs must not be negative', error.getvalue())
+
+    def test_warm_worker_survives_morphology_error(self):
+        with unittest.mock.patch('signal.signal'), \
+                unittest.mock.patch('morphology.get_analyzer',
+                                    side_effect=AttributeError('getargspec')), \
+                contextlib.redirect_stdout(io.StringIO()) as output:
+            server.warm_worker()
+        self.assertIn('pymorphy2 is not loaded', output.getvalue())
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def imported(self, code, modules):
+        script = (f'import sys\n{code}\n'
+                  f'print(*[name in sys.modules for name in {modules!r}])')
+        result = subprocess.run(
+            [sys.executable, '-c', script], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        return result.stdout.split()
+
+    def test_main_imports_no_pipeline(self):
+        self.assertEqual(
+            self.imported('import main', ['pymorphy2', 'numpy',
+                                          'table_report_generator',
+                                          'report_generator',
+                                          'report_cache', 'tempfile',
+                                          'shutil', 'pickle']),
+            ['False'] * 8)
+
+    def test_table_pattern_imports_no_text_pipeline(self):
+        code = ('import main, entering_data\n'
+                'main.read_pattern(main.ed.EnteredData(entering_data.'
+                'create_argument_parser().parse_args(["-p", "pattern.txt", '
+                '"-d", "table_data.txt", "-in", "table"])))')
+        self.assertEqual(
+            self.imported(code, ['table_pattern_reader', 'report_generator',
+                                 'pymorphy2']),
+            ['True', 'False', 'False'])
+
+    def test_plain_table_imports_no_optional_modules(self):
+        code = ('from table_report_generator import TableReportGenerator\n'
+                'TableReportGenerator("pattern.txt", "table_data.txt", '
+                '"/dev/null")')
+        self.assertEqual(
+            self.imported(code, ['table_state', 'table_merge', 'table_order',
+                                 'numpy']),
+            ['False'] * 4)
+
+    def test_morphology_without_unit(self):
+        code = ('import morphology\n'
+                'morphology.agree_with_number("", 5)')
+        self.assertEqual(self.imported(code, ['pymorphy2']), ['False'])
+
+    def test_import_timer(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, text in (('lazy_outer', 'import lazy_inner\n'),
+                               ('lazy_inner', 'x = 1\n')):
+                with open(os.path.join(tmp, name + '.py'), 'w') as file:
+                    file.write(text)
+            sys.path.insert(0, tmp)
+            timer = instrumentation.ImportTimer()
+            timer.install()
+            try:
+                import lazy_outer
+            finally:
+                timer.uninstall()
+                sys.path.remove(tmp)
+                sys.modules.pop('lazy_outer', None)
+                sys.modules.pop('lazy_inner', None)
+        records = {name: (depth, own, cumulative)
+                   for depth, name, own, cumulative in timer.records}
+        self.assertEqual(records['lazy_outer'][0], 0)
+        self.assertEqual(records['lazy_inner'][0], 1)
+        self.assertGreaterEqual(records['lazy_outer'][2],
+                                records['lazy_inner'][2])
+        output = io.StringIO()
+        timer.write(output)
+        self.assertIn('|   lazy_inner\n', output.getvalue())
+
+
+class TestTableLayout(unittest.TestCase):
+
+    def setUp(self):
+        self.layout = TableLayout([
+            SimpleNamespace(name='ИМЯ', width=5, align='l', unit=''),
+            SimpleNamespace(name='ЦЕНА', width=6, align='r', unit='руб')])
+
+    def test_header(self):
+        self.assertEqual(self.layout.header, '|ИМЯ  |ЦЕНА,р|')
+        self.assertEqual(self.layout.width, len(self.layout.header))
+        self.assertEqual(self.layout.separator, '-' * 14)
+
+    def test_format_row(self):
+        self.assertEqual(self.layout.format_row(('а\nбвгдеж', 12)),
+                         ('а    \nбвгде', '    12'))
+
+    def test_render_multiline_row(self):
+        cells = self.layout.format_row(('а\nб\nв', '1\n2'))
+        self.assertEqual(self.layout.render_row(cells),
+                         '|а    |     1|\n'
+                         '|б    |     2|\n'
+                         '|в    |      |')
+        self.assertEqual(self.layout.render_row(('x    ', '     y')),
+                         '|x    |     y|')
+
+    def test_no_columns(self):
+        layout = TableLayout()
+        self.assertEqual(layout.header,
+                         '|Ничего не найдено. Проверьте шаблон и данные|')
+
+
+class TestOrderLimit(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.data_name = self.write(
+            'data.txt', 'Тариф,Стоимость\nБ,5#А,7#В,5#А,1#Б,9#Г,2#')
+
+    def write(self, name, text):
+        filename = os.path.join(self.tmp.name, name)
+        with open(filename, 'w', encoding='utf-8') as file:
+            file.write(text)
+        return filename
+
+    def report(self, directives, group='', stream=False):
+        pattern_name = self.write(
+            'pattern.txt', 'table name: Топ#\n'
+                           'table columns: Тариф|str; Стоимость|int#\n'
+                           f'{group}{directives}')
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            generator = TableReportGenerator(
+                p_filename=pattern_name, d_filename=self.data_name,
+                output_filename=os.path.join(self.tmp.name, 'report.txt'),
+                stream=stream)
+        self.output = output.getvalue()
+        return [tuple(line.values())
+                for line in generator.filtered_table.to_dicts()]
+
+    def test_order(self):
+        expected = [('Б', 9), ('А', 7), ('Б', 5), ('В', 5), ('Г', 2),
+                    ('А', 1)]
+        for stream in (False, True):
+            self.assertEqual(self.report('order: стоимость DESC; Тариф#',
+                                         stream=stream), expected)
+
+    def test_limit(self):
+        for stream in (False, True):
+            self.assertEqual(self.report('order: Тариф desc#limit: 2#',
+                                         stream=stream),
+                             [('Г', 2), ('В', 5)])
+            self.assertEqual(self.report('limit: 2#', stream=stream),
+                             [('Б', 5), ('А', 7)])
+
+    def test_grouped_top(self):
+        group = 'group: fields|Тариф data|sum; Стоимость data|max; ' \
+                'Стоимость#'
+        self.assertEqual(
+            self.report('order: sum(Стоимость) desc#limit: 2#', group),
+            [('Б', 14, 9), ('А', 8, 7)])
+
+    # Колонку агрегируют дважды: условие на нее самое не применилось бы.
+    def test_filter_aggregated_twice(self):
+        group = 'group: fields|Тариф data|sum; Стоимость data|max; ' \
+                'Стоимость#'
+        self.assertEqual(
+            self.report('filter: Sum(Стоимость) > 8#order: Тариф#', group),
+            [('Б', 14, 9)])
+        self.assertEqual(len(self.report('filter: Стоимость > 8#', group)),
+                         4)
+        self.assertIn('Column СТОИМОСТЬ is aggregated several times, filter '
+                      'by one of: sum(СТОИМОСТЬ), max(СТОИМОСТЬ)', self.output)
+
+    def test_filter_outside_grouped_table(self):
+        pattern_name = self.write(
+            'pattern.txt', 'table columns: Тариф|str; Пол|str#\n'
+                           'group: fields|Тариф data|max; Тариф#\n'
+                           'filter: Пол = м#')
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            pattern = TablePatternReader(pattern_name)
+        self.assertEqual(pattern.filter, [])
+        self.assertIn('Column ПОЛ is not in the grouped table',
+                      output.getvalue())
+
+    def test_bad_directives(self):
+        self.assertEqual(len(self.report('order: Нет#limit: много#')), 6)
+        self.assertIn('Unknown table field: Нет', self.output)
+        self.assertIn('Not valid limit: "много"', self.output)
+
+    def test_external_sort(self):
+        rows = [(i % 7, str(i % 3), i) for i in range(100)]
+        order = [OrderUnit(1, True), OrderUnit(0, False)]
+        key = table_order.order_key((0, 1, 2), {1: 'str'}, order)
+        expected = sorted(rows, key=key)
+        self.assertEqual(list(table_order.sort_rows(rows, key, 8)),
+                         expected)
+        self.assertEqual(list(table_order.sort_rows(rows, key, 100)),
+                         expected)
+        self.assertEqual(
+            table_order.order_rows(iter(rows), (0, 1, 2), {1: 'str'}, order,
+                                   limit=10), expected[:10])
+
+
+class TestTableIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.index_name = os.path.join(self.tmp.name, 'index', 'data.index')
+        self.data_name = self.write(
+            'name,price,weight\n' + '#'.join(
+                f'n{i % 5},{i % 13},{i % 4}.5' for i in range(60)) + '#')
+
+    def write(self, text, encoding='utf-8'):
+        filename = os.path.join(self.tmp.name, 'data.txt')
+        with open(filename, 'w', encoding=encoding, newline='') as file:
+            file.write(text)
+        return filename
+
+    def rows(self, conditions, index_name=None, encoding='utf-8'):
+        types = {'PRICE': 'int', 'WEIGHT': 'float'}
+        data = TableDataReader(self.data_name, encoding, stream=True,
+                               types=types, conditions=conditions,
+                               index_filename=index_name)
+        return list(data.table)
+
+    def test_same_rows_as_scan(self):
+        for op in ('=', '!=', '<', '>', '<=', '>='):
+            conditions = [FilterUnit('PRICE', op, '6'),
+                          FilterUnit('NAME', '!=', 'n2')]
+            self.assertEqual(self.rows(conditions, self.index_name),
+                             self.rows(conditions), op)
+        conditions = [FilterUnit('WEIGHT', '>=', '2.5')]
+        self.assertEqual(self.rows(conditions, self.index_name),
+                         self.rows(conditions))
+
+    def test_index_is_reused(self):
+        conditions = [FilterUnit('PRICE', '<', '3')]
+        self.rows(conditions, self.index_name)
+        self.assertTrue(os.path.exists(self.index_name))
+        with unittest.mock.patch.object(
+                table_index.TableIndex, 'add_columns') as add_columns:
+            self.assertEqual(len(self.rows(conditions, self.index_name)), 15)
+        add_columns.assert_not_called()
+
+    def test_changed_file_rebuilds_index(self):
+        conditions = [FilterUnit('PRICE', '=', '1')]
+        self.rows(conditions, self.index_name)
+        self.write('name,price,weight\nx,1,1.0#y,2,1.0#z,1,1.0#')
+        self.assertEqual(self.rows(conditions, self.index_name),
+                         [['x', 1, 1.0], ['z', 1, 1.0]])
+
+    def test_bad_rows_are_scanned(self):
+        self.write('name,price\na,1#b#c,3#')
+        conditions = [FilterUnit('PRICE', '>', '0')]
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            self.assertEqual(self.rows(conditions, self.index_name),
+                             [['a', 1], ['c', 3]])
+        self.assertIn('no column value in row !1! (line 2)',
+                      output.getvalue())
+        self.assertIsNone(table_index.TableIndex.load(
+            self.index_name).find(conditions, {'PRICE': 'int'}))
+
+    def test_utf16_is_not_indexed(self):
+        self.write('name,price\na,1#b,2#', 'utf-16')
+        conditions = [FilterUnit('PRICE', '>', '1')]
+        self.assertEqual(self.rows(conditions, self.index_name, 'utf-16'),
+                         [['b', 2]])
+        self.assertFalse(os.path.exists(self.index_name))
+
+
+class TestFanout(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.data_name = self.write(
+            'data.txt', 'Тариф,Стоимость\nБ,5#А,7#В,x#А,1#Б,9#Г,2#')
+        self.pattern_names = [self.write(f'p{j}.txt', text) for j, text in (
+            (1, 'table name: Все#\n'
+                'table columns: Тариф|str; Стоимость|int#\n'
+                'filter: Стоимость > 1#'),
+            (2, 'table name: Гр#\n'
+                'table columns: Тариф|str; Стоимость|float#\n'
+                'group: fields|Тариф data|sum; Стоимость#\n'
+                'order: Тариф#'),
+            (3, 'table name: Стр#\n'
+                'table columns: Тариф|str; Стоимость|str#\n'
+                'filter: Тариф = А#'))]
+        self.input_data = SimpleNamespace(
+            input_format='table', pattern_names=self.pattern_names,
+            pattern_name=self.pattern_names[0], pattern_enc='utf-8',
+            data_name=[self.data_name], data_enc='utf-8',
+            default_field_width=20, jobs=1, engine='python',
+            output_filename='report.txt', no_cache=True, check_fields=False)
+
+    def write(self, name, text):
+        filename = os.path.join(self.tmp.name, name)
+        with open(filename, 'w', encoding='utf-8') as file:
+            file.write(text)
+        return filename
+
+    def read(self, name):
+        with open(os.path.join(self.tmp.name, name), encoding='utf-8') as file:
+            return file.read()
+
+    def generate(self, jobs=1):
+        self.input_data.jobs = jobs
+        patterns = [main.read_pattern(self.input_data, name)
+                    for name in self.pattern_names]
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                errors = main.generate_fanout_reports(self.input_data,
+                                                      patterns)
+        finally:
+            os.chdir(cwd)
+        return errors, output.getvalue()
+
+    def single_report(self, pattern_name):
+        output_name = os.path.join(self.tmp.name, 'single.txt')
+        with contextlib.redirect_stdout(io.StringIO()):
+            TableReportGenerator(p_filename=pattern_name,
+                                 d_filename=self.data_name,
+                                 output_filename=output_name)
+        return self.read('single.txt')
+
+    def test_same_reports_as_single_pattern(self):
+        with unittest.mock.patch.object(
+                TableDataReader, 'iter_rows', autospec=True,
+                side_effect=TableDataReader.iter_rows) as iter_rows:
+            errors, output = self.generate()
+        self.assertEqual(errors, [])
+        self.assertEqual(iter_rows.call_count, 1)
+        # Колонка приводится к int и к float по разу.
+        self.assertEqual(output.count('It is not possible to convert'), 2)
+        for j, pattern_name in enumerate(self.pattern_names):
+            self.assertEqual(self.read(f'1_{j + 1}_report.txt'),
+                             self.single_report(pattern_name))
+
+    def test_parallel(self):
+        self.generate()
+        expected = [self.read(f'1_{j + 1}_report.txt') for j in range(3)]
+        errors, _ = self.generate(jobs=3)
+        self.assertEqual(errors, [])
+        self.assertEqual([self.read(f'1_{j + 1}_report.txt')
+                          for j in range(3)], expected)
+
+    def test_bad_data(self):
+        self.write('data.txt', 'Тариф,Стоимость\nБ,5#А#')
+        errors, output = self.generate()
+        self.assertEqual(errors, [])
+        self.assertEqual(output.count('TableDataError'), 1)
+        self.assertIn('|         Б          |         5          |',
+                      self.read('1_1_report.txt'))
+        self.assertIn(NOTHING_FOUND, self.read('1_3_report.txt'))
+
+    def test_cache_prints_messages(self):
+        self.input_data.no_cache = False
+        self.input_data.cache_dir = os.path.join(self.tmp.name, 'cache')
+        self.input_data.cache_size = 1
+        _, expected = self.generate()
+        # В кэше только часть отчетов: колонки все равно приводятся для
+        # всех шаблонов, сообщения те же.
+        self.write('p1.txt', 'table name: Все#\n'
+                             'table columns: Тариф|str; Стоимость|int#')
+        _, output = self.generate()
+        self.assertEqual(output, expected)
+        with unittest.mock.patch.object(
+                TableDataReader, 'iter_rows', autospec=True,
+                side_effect=TableDataReader.iter_rows) as iter_rows:
+            _, output = self.generate()
+        iter_rows.assert_not_called()
+        self.assertEqual(output, expected)
+
+
+class TestColumnCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache_dir = os.path.join(self.tmp.name, 'columns')
+        self.types = {'ИМЯ': 'str', 'ЦЕНА': 'int', 'ВЕС': 'float'}
+        self.data_name = self.write(
+            'Имя,Цена,Вес\nчай\nзеленый,5,0.5#кофе,x,1.25#'
+            'сахар,99999999999999999999,2#')
+
+    def write(self, text):
+        filename = os.path.join(self.tmp.name, 'data.txt')
+        with open(filename, 'w', encoding='utf-8', newline='') as file:
+            file.write(text)
+        return filename
+
+    def read(self, conditions=None, cache_dir=None):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            data = TableDataReader(self.data_name, types=self.types,
+                                   conditions=conditions,
+                                   column_cache_dir=cache_dir)
+        self.output = output.getvalue()
+        return data.table
+
+    def test_round_trip(self):
+        table = self.read()
+        self.assertEqual(table.column('ЦЕНА'), [5, 0, 99999999999999999999])
+        filename = column_cache.cache_filename(self.cache_dir,
+                                               self.data_name, 'utf-8',
+                                               self.types)
+        signature = column_cache.file_signature(self.data_name)
+        column_cache.save(filename, self.data_name, table, signature)
+        cached = column_cache.load(filename, self.data_name, self.types)
+        self.assertEqual(cached, table)
+        self.assertEqual(cached.types, table.types)
+        self.assertIsNone(column_cache.load(filename, self.data_name,
+                                            dict(self.types, ВЕС='str')))
+
+    def test_cached_reads(self):
+        conditions = [FilterUnit('ВЕС', '>', '0.7')]
+        expected = self.read(conditions)
+        expected_all = self.read()
+        self.assertEqual(self.read(conditions, self.cache_dir), expected)
+        self.assertIn('It is not possible to convert "x"', self.output)
+        messages = self.output
+        with unittest.mock.patch.object(TableDataReader,
+                                        'iter_file_rows') as iter_file_rows:
+            self.assertEqual(self.read(conditions, self.cache_dir), expected)
+            # Сообщения о значениях из кэша печатаются те же.
+            self.assertEqual(self.output, messages)
+            self.assertEqual(self.read(None, self.cache_dir), expected_all)
+        iter_file_rows.assert_not_called()
+
+    def test_changed_file_rebuilds_cache(self):
+        self.read(None, self.cache_dir)
+        self.write('Имя,Цена,Вес\nхлеб,3,1.0#')
+        self.assertEqual(self.read(None, self.cache_dir).to_dicts(),
+                         [OrderedDict([('ИМЯ', 'хлеб'), ('ЦЕНА', 3),
+                                       ('ВЕС', 1.0)])])
+
+    def test_bad_rows_are_not_cached(self):
+        self.write('Имя,Цена,Вес\nхлеб,3#')
+        self.assertEqual(len(self.read(None, self.cache_dir)), 0)
+        self.assertIn('TableDataError', self.output)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+
+class TestTableTokenizer(unittest.TestCase):
+
+    def tokenize(self, text, width=None,
+                 chunk_size=table_tokenizer.CHUNK_SIZE):
+        errors = []
+        tokenizer = table_tokenizer.TableTokenizer(width,
+                                                   on_error=errors.append)
+        rows = list(tokenizer.records(io.StringIO(text), chunk_size))
+        return rows, errors
+
+    def test_plain_records(self):
+        text = ' a,1#\nb,2 ##c,3\n'
+        self.assertEqual(self.tokenize(text)[0],
+                         [['a', '1'], ['b', '2'], ['c', '3']])
+
+    def test_quotes_and_escapes(self):
+        text = ('"a#b, c",1#"say ""hi""",2#x\\#y\\,z,3#'
+                '"много\r\nстрок",4#e\\ ,5#')
+        expected = [['a#b, c', '1'], ['say "hi"', '2'], ['x#y,z', '3'],
+                    ['много\r\nстрок', '4'], ['e ', '5']]
+        for chunk_size in (1, 2, 5, table_tokenizer.CHUNK_SIZE):
+            self.assertEqual(self.tokenize(text, 2, chunk_size),
+                             (expected, []))
+
+    def test_bad_rows_are_reported(self):
+        text = 'a,1#\n\n  b#c,2,3#"d,4\n#e,5'
+        for chunk_size in (1, 3, table_tokenizer.CHUNK_SIZE):
+            rows, errors = self.tokenize(text, 2, chunk_size)
+            self.assertEqual(rows, [['a', '1'], ['e', '5']])
+            self.assertEqual(errors, [
+                'TableDataError: no column value in row !1! (line 4)',
+                'TableDataError: no column name in row !2! (line 4)',
+                'TableDataError: no closing quote in row !3! (line 4)'])
+
+    # Блоки без кавычек режутся сразу; одинаковые ошибочные записи.
+    def test_bad_plain_rows_are_reported(self):
+        text = 'a,1#\nb#\nb,2#\nb#\nc,3\n#d,4'
+        for chunk_size in (1, 4, 7, table_tokenizer.CHUNK_SIZE):
+            rows, errors = self.tokenize(text, 2, chunk_size)
+            self.assertEqual(rows, [['a', '1'], ['b', '2'], ['c', '3'],
+                                    ['d', '4']])
+            self.assertEqual(errors, [
+                'TableDataError: no column value in row !1! (line 3)',
+                'TableDataError: no column value in row !3! (line 5)'])
+
+    def test_split_fields(self):
+        self.assertEqual(table_tokenizer.split_fields('"a,""b""" x,c\\,d,'),
+                         ['a,"b" x', 'c,d', ''])
+
+    def test_complete_length(self):
+        self.assertEqual(table_tokenizer.complete_length(b'a,1#b,2'), 4)
+        self.assertEqual(table_tokenizer.complete_length(b'a,1#"b#c",2'), 4)
+        self.assertEqual(table_tokenizer.complete_length(b'a\\#b#c'), 5)
+        self.assertEqual(table_tokenizer.complete_length(b'"a#b",1#c'), 8)
+
+    # Кавычка после неразрывного пробела -- начало поля в кавычках, как при
+    # разборе: '#' внутри нее не конец записи.
+    def test_complete_length_unicode_spaces(self):
+        text = '\xa0"#a\n\xa0aé'
+        for encoding in ('utf-8', 'cp1251'):
+            data = text.encode(encoding, 'replace')
+            self.assertEqual(
+                table_tokenizer.complete_length(data, encoding), 0)
+            self.assertEqual(table_tokenizer.complete_length(
+                data + b'",1#x', encoding), len(data) + 4)
+        # Незаконченный символ utf-8 в конце.
+        data = 'x,"é#"#é'.encode()[:-1]
+        self.assertEqual(table_tokenizer.complete_length(data), 8)
+
+    def test_reader_keeps_good_rows(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'data.txt')
+            with open(filename, 'w', encoding='utf-8', newline='') as file:
+                file.write('Имя,Цена\n"чай, черный",5#кофе#"с#ахар",7#')
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                data = TableDataReader(filename, types={'ЦЕНА': 'int'})
+        self.assertEqual(list(data.table.rows()),
+                         [('чай, черный', 5), ('с#ахар', 7)])
+        self.assertEqual(output.getvalue(),
+                         f'{filename}: TableDataError: no column value '
+                         f'in row !1! (line 2)\n')
+
+
 
 
 
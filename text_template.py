@@ -0,0 +1,84 @@
+from collections import namedtuple
+import re
+
+FIELD_PATTERN = re.compile(r'''(?P<screen>!!)?
+                             {{(?P<name>[\w\s\-,]+)\|?\s*
+                               (?P<width>\d+)?-?\s*
+                               (?P<align>[rcl])?-?\s*
+                               (?P<unit>\w+[\w\s\-,]*)?}}
+                            ''', re.X)
+
+# label -- имя поля как в шаблоне (для сообщений),
+# source -- исходный текст дыры, печатается, если подставить нечего.
+Hole = namedtuple('Hole', 'name width align unit screened label source')
+
+SEGMENT_DELIMITER = '#'
+SCREEN = '!!'
+
+
+class CompiledTemplate:
+    __slots__ = ('chunks', 'names')
+
+    def __init__(self, chunks):
+        # Строки -- литеральный текст, Hole -- места подстановки.
+        self.chunks = tuple(chunks)
+        self.names = frozenset(chunk.name for chunk in self.chunks
+                               if isinstance(chunk, Hole)
+                               and not chunk.screened)
+
+    def render(self, data, default_field_width, format_value):
+        parts = []
+        for chunk in self.chunks:
+            if not isinstance(chunk, Hole):
+                parts.append(chunk)
+                continue
+            value = None if chunk.screened else data.get(chunk.name)
+            if value is None:
+                if not chunk.screened:
+                    print(f'No value for name: {chunk.label}')
+                parts.append(chunk.source)
+                continue
+            width = (chunk.width if chunk.width is not None
+                     else default_field_width)
+            parts.append(format_value(value, width, chunk.align, chunk.unit))
+        return ''.join(parts)
+
+
+def none_check(field, default):
+    return field if field is not None else default
+
+
+def compile_hole(match):
+    if match.group('screen') is not None:
+        return Hole(None, None, None, None, True, match.group('name'),
+                    match.group()[len(SCREEN):])
+    width = match.group('width')
+    return Hole(match.group('name').upper(),
+                int(width) if width is not None else None,
+                none_check(match.group('align'), 'c'),
+                none_check(match.group('unit'), ''),
+                False, match.group('name'), match.group())
+
+
+# Один проход по шаблону: '#' разделяет сегменты и в отчет не попадает.
+def compile_template(text):
+    chunks = []
+    for segment in text.split(SEGMENT_DELIMITER):
+        holes = []
+        literals = []
+        position = 0
+        for match in FIELD_PATTERN.finditer(segment):
+            literals.append(segment[position:match.start()])
+            holes.append(compile_hole(match))
+            position = match.end()
+        literals.append(segment[position:])
+        # Экранирование убирает '!!' во всем сегменте.
+        if any(hole.screened for hole in holes):
+            literals = [literal.replace(SCREEN, '') for literal in literals]
+        for literal, hole in zip(literals, holes):
+            if literal:
+                chunks.append(literal)
+            chunks.append(hole)
+        if literals[-1]:
+            chunks.append(literals[-1])
+    return CompiledTemplate(chunks)